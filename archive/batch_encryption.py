@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from Crypto.Random import get_random_bytes
+from encryption_service import API_KEY, KEY_SIZE, encrypt_knob, knob_chunks
+from knob_tuning import ROTATION_BUDGET
+from upload_client import UploadClient
+from knob_keyring import default_keyring
+from knob_epoch import Epoch
+from knob_metadata import MetadataLog, pack_record, path_id
+from shard_coordinator import LEASE_TTL, NUM_SHARDS, WorkStream, open_coordinator
+import instrumentation
+
+META_FILES = ("metaFK", "metaSK", "metaIndex", "metaSGX")
+
+# Clés chargées une seule fois par processus du pool (GK, knob-pub-key, clé d'époque)
+worker_keys = None
+
+def init_worker(gk_file, knob_key_file, epoch=None):
+    """
+    Initialisation d'un processus : lecture de GK et de la clé RSA. epoch
+    (knob_epoch.Epoch) : clé d'époque du lot, partagée par tous les processus.
+    """
+    global worker_keys
+    worker_keys = (default_keyring.group_key(gk_file), default_keyring.rsa_key(knob_key_file).publickey(), epoch)
+
+def encrypt_one(input_file, path, legacy_dirs=False, params=None, record=False):
+    """
+    Chiffre un fichier dans path et y écrit ses métadonnées (exécuté dans un
+    processus du pool). Avec record, les métadonnées sont renvoyées en
+    enregistrement binaire (result["record"]) pour le journal, sans fichiers.
+    result["super_block_indices"] ne sert qu'à l'envoi et ne doit pas être écrit.
+    """
+    gk_key, knob_pub_key, epoch = worker_keys
+    start_time = time.perf_counter()
+
+    with instrumentation.instrument("encrypt"):
+        meta = encrypt_knob(input_file, path, gk_key, knob_pub_key, get_random_bytes(KEY_SIZE), legacy_dirs,
+                            epoch=epoch, **(params or {}))
+    if not record:
+        for name in META_FILES + ("metaMerkle",):
+            if name in meta:
+                with open(os.path.join(path, name + ".bin"), "wb") as f:
+                    f.write(meta[name])
+
+    result = {
+        "input": input_file,
+        "path": path,
+        "bytes": os.path.getsize(input_file),
+        "num_blocks": meta["num_blocks"],
+        "block_size": meta["block_size"],
+        "num_super_blocks": meta["num_super_blocks"],
+        "super_block_indices": meta["super_block_indices"],
+        "compression": meta["compression"],
+        "mode": meta["mode"],
+        "seconds": time.perf_counter() - start_time,
+    }
+    if record:
+        result["record"] = pack_record(path_id(path), meta)
+    return result
+
+def list_inputs(source, out_dir):
+    """
+    Génère (fichier, dossier de sortie) à partir d'un dossier (parcouru
+    récursivement), d'un manifeste (un chemin par ligne) ou de '-' (stdin).
+    """
+    if os.path.isdir(source):
+        out = os.path.realpath(out_dir)
+        for root, dirs, files in os.walk(source):
+            # out_dir dans source : ses fichiers chiffrés ne sont pas repris en entrée
+            dirs[:] = sorted(d for d in dirs if os.path.realpath(os.path.join(root, d)) != out)
+            for name in sorted(files):
+                input_file = os.path.join(root, name)
+                yield input_file, os.path.join(out_dir, os.path.relpath(input_file, source))
+        return
+
+    lines = sys.stdin if source == "-" else open(source)
+    try:
+        for n, line in enumerate(lines):
+            input_file = line.strip()
+            if input_file:
+                # Préfixe numérique : deux fichiers de même nom ne se marchent pas dessus
+                yield input_file, os.path.join(out_dir, f"{n:06d}_{os.path.basename(input_file)}")
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+def run_batch(inputs, gk_file, knob_key_file, workers=None, max_in_flight=None, legacy_dirs=False, params=None,
+              work=None, metadata_log=None, epoch=False):
+    """
+    Chiffre tous les fichiers de inputs sur un pool de processus. Au plus
+    max_in_flight fichiers sont en cours à la fois. params (block_size,
+    num_super_blocks, rotation_budget, compression) est transmis à encrypt_knob. Avec work
+    (WorkStream de shard_coordinator), les (fichier, dossier) viennent des
+    tranches attribuées à ce nœud. Avec metadata_log (MetadataLog ouvert en
+    écriture), les métadonnées y sont ajoutées au lieu des fichiers meta*.bin.
+    Avec epoch, une seule clé d'époque (une opération RSA) chiffre les SK de
+    tout le lot (voir knob_epoch). Renvoie le bilan.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    summary = {"succeeded": [], "failed": [], "bytes": 0}
+    pending = {}
+    start_time = time.perf_counter()
+
+    def collect(futures):
+        for future in futures:
+            input_file, path = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                summary["failed"].append({"input": input_file, "error": f"{type(e).__name__}: {e}"})
+            else:
+                if work is not None and not work.complete((input_file, path)):
+                    continue  # Bail perdu : le fichier est rechiffré par un autre nœud
+                if metadata_log is not None:
+                    metadata_log.append_records([result.pop("record")])
+                summary["succeeded"].append(result)
+                summary["bytes"] += result["bytes"]
+
+    batch_epoch = Epoch(default_keyring.rsa_key(knob_key_file).publickey()) if epoch else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(gk_file, knob_key_file, batch_epoch)) as executor:
+        for input_file, path in (work if work is not None else inputs):
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(encrypt_one, input_file, path, legacy_dirs, params, metadata_log is not None)
+            pending[future] = (input_file, path)
+        collect(list(pending))
+
+    if batch_epoch is not None:
+        batch_epoch.close()
+    summary["seconds"] = time.perf_counter() - start_time
+    return summary
+
+def upload_batch(results, api_url, concurrency=8, metadata_log=None):
+    """
+    Envoie à l'API les fichiers chiffrés (blocs et métadonnées), plusieurs à
+    la fois. Les métadonnées sont lues dans metadata_log s'il est donné.
+    """
+    def job(result):
+        meta = {name: result[name] for name in ("num_blocks", "block_size", "num_super_blocks", "super_block_indices",
+                                                "compression", "mode")}
+        if metadata_log is not None:
+            return dict(metadata_log.get(path_id(result["path"])), **meta)
+        for name in META_FILES:
+            with open(os.path.join(result["path"], name + ".bin"), "rb") as f:
+                meta[name] = f.read()
+        merkle_file = os.path.join(result["path"], "metaMerkle.bin")
+        if os.path.exists(merkle_file):
+            with open(merkle_file, "rb") as f:
+                meta["metaMerkle"] = f.read()
+        return meta
+
+    jobs, sent = [], []
+    for result in results:
+        try:
+            meta = job(result)
+        except (OSError, KeyError, ValueError) as e:
+            result["upload_error"] = f"{type(e).__name__}: {e}"
+            continue
+        jobs.append((knob_chunks(result["path"], meta), meta))
+        sent.append(result)
+
+    with UploadClient(api_url, API_KEY, pool_size=concurrency) as client:
+        for result, file_id in zip(sent, asyncio.run(client.upload_many(jobs, concurrency))):
+            if isinstance(file_id, Exception):
+                result["upload_error"] = f"{type(file_id).__name__}: {file_id}"
+            else:
+                result["file_id"] = file_id
+
+def main():
+    parser = argparse.ArgumentParser(description="Chiffrement KNOB d'un lot de fichiers.")
+    parser.add_argument("source", help="Dossier, manifeste (un chemin par ligne) ou '-' pour lire la liste sur stdin")
+    parser.add_argument("out_dir", help="Dossier de sortie (un sous-dossier par fichier)")
+    parser.add_argument("gk", help="Fichier contenant la clé de groupe GK")
+    parser.add_argument("--knob-key", default="knob-pri-key", help="Clé RSA knob (privée ou publique)")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus (par défaut, un par cœur)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Nombre maximal de fichiers en cours")
+    parser.add_argument("--legacy-dirs", action="store_true", help="Un fichier par bloc au lieu du conteneur")
+    parser.add_argument("--summary", help="Fichier JSON où écrire le bilan")
+    parser.add_argument("--block-size", type=int, default=None, help="Taille de bloc (par défaut, selon la taille de chaque fichier)")
+    parser.add_argument("--super-blocks", type=int, default=None, help="Nombre de super blocs (par défaut, selon le budget de rotation)")
+    parser.add_argument("--rotation-budget", type=int, default=ROTATION_BUDGET,
+                        help="Octets de super blocs par fichier visés pour le choix automatique")
+    parser.add_argument("--compression", choices=("none", "zlib", "zstd", "lz4", "auto"), default="none",
+                        help="Compresser les données avant le chiffrement")
+    parser.add_argument("--mode", choices=("cbc", "ctr"), default="cbc", help="Mode de chiffrement de la couche FK")
+    parser.add_argument("--merkle", action="store_true", help="Écrire l'arbre de Merkle des blocs de chaque fichier")
+    parser.add_argument("--epoch", action="store_true",
+                        help="Une seule opération RSA pour tout le lot : les SK sont chiffrées avec une clé d'époque")
+    parser.add_argument("--metadata-log", help="Ajouter les métadonnées à ce journal (voir knob_metadata.py) au lieu des fichiers meta*.bin")
+    parser.add_argument("--api-url", help="Envoyer aussi les fichiers chiffrés à cette API de stockage")
+    parser.add_argument("--upload-concurrency", type=int, default=8, help="Nombre d'envois simultanés")
+    parser.add_argument("--coordinator", help="Répartir les fichiers entre plusieurs nœuds (zk://..., sqlite://...)")
+    parser.add_argument("--job", default="batch", help="Nom du travail réparti")
+    parser.add_argument("--worker-id", help="Identifiant de ce nœud (par défaut, hôte et pid)")
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS, help="Nombre de tranches du travail réparti")
+    parser.add_argument("--lease-ttl", type=float, default=LEASE_TTL, help="Durée des baux en secondes")
+    args = parser.parse_args()
+
+    params = {"block_size": args.block_size, "num_super_blocks": args.super_blocks,
+              "rotation_budget": args.rotation_budget, "compression": args.compression,
+              "mode": args.mode, "workers": 1, "merkle": args.merkle}  # Un processus par fichier : pas de threads en plus
+    metadata_log = None
+    if args.metadata_log:
+        try:
+            metadata_log = MetadataLog(args.metadata_log, writable=True)
+        except (OSError, ValueError) as e:
+            print(f"Erreur : {e}")
+            sys.exit(1)
+
+    if args.coordinator:
+        # Chaque nœud lance la même commande : le premier crée le travail, tous se partagent les tranches
+        try:
+            with open_coordinator(args.coordinator, args.lease_ttl) as coordinator:
+                coordinator.create_job(args.job, (json.dumps(pair) for pair in list_inputs(args.source, args.out_dir)),
+                                       args.shards)
+                with WorkStream(coordinator, args.job, args.worker_id, decode=lambda item: tuple(json.loads(item))) as work:
+                    summary = run_batch(None, args.gk, args.knob_key, args.workers, args.max_in_flight,
+                                        args.legacy_dirs, params, work, metadata_log, args.epoch)
+        except ImportError as e:
+            print(f"Erreur : {e}")
+            sys.exit(1)
+    else:
+        summary = run_batch(list_inputs(args.source, args.out_dir), args.gk, args.knob_key,
+                            args.workers, args.max_in_flight, args.legacy_dirs, params, metadata_log=metadata_log,
+                            epoch=args.epoch)
+
+    size_mb = summary["bytes"] / (1024 * 1024)
+    print(f"{len(summary['succeeded'])} fichiers chiffrés ({size_mb:.1f} Mo) en {summary['seconds']:.2f} secondes, "
+          f"{len(summary['failed'])} échecs.")
+    for failure in summary["failed"]:
+        print(f"Échec : {failure['input']} -> {failure['error']}")
+
+    upload_failures = 0
+    if args.api_url:
+        upload_batch(summary["succeeded"], args.api_url, args.upload_concurrency, metadata_log)
+        for result in summary["succeeded"]:
+            if "upload_error" in result:
+                upload_failures += 1
+                print(f"Échec de l'envoi : {result['input']} -> {result['upload_error']}")
+    if metadata_log is not None:
+        metadata_log.close()
+
+    # Indices des super blocs (secrets, chiffrés avec SK dans metaIndex) : gardés en mémoire pour l'envoi seulement
+    for result in summary["succeeded"]:
+        result.pop("super_block_indices", None)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["failed"] or upload_failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
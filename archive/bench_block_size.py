@@ -0,0 +1,80 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+from block_container import HEADER, open_block_source
+from decryption_service import decrypt_to_file
+from encryption_service import KEY_SIZE, encrypt_knob
+from knob_tuning import ROTATION_BUDGET, tune
+
+# Courbe débit / taille des métadonnées selon la taille de bloc, pour un
+# fichier donné. La ligne marquée * est le choix automatique (knob_tuning).
+
+def bench(function, repeat):
+    """Meilleur temps d'exécution de function() sur repeat essais, et son dernier résultat."""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Débit et taille des métadonnées KNOB selon la taille de bloc.")
+    parser.add_argument("size", type=int, help="Taille du fichier de test en octets")
+    parser.add_argument("--block-sizes", default="1024,4096,16384,65536,262144,1048576")
+    parser.add_argument("--rotation-budget", type=int, default=ROTATION_BUDGET)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    auto_block_size, _, _ = tune(args.size, rotation_budget=args.rotation_budget)
+    block_sizes = sorted({int(bs) for bs in args.block_sizes.split(",")} | {auto_block_size})
+
+    workdir = tempfile.mkdtemp(prefix="knob-bs-")
+    try:
+        input_file = os.path.join(workdir, "input.bin")
+        with open(input_file, "wb") as f:
+            f.write(os.urandom(args.size))
+        gk_key = get_random_bytes(KEY_SIZE)
+        knob_key = RSA.generate(2048)
+        size_mb = args.size / (1024 * 1024)
+
+        print(f"Fichier de {size_mb:.1f} Mo, budget de rotation {args.rotation_budget} octets")
+        print(f"  {'bloc':>8} {'blocs':>9} {'super':>6} {'chiffr. Mo/s':>13} {'déchiffr. Mo/s':>15} "
+              f"{'métadonnées':>12} {'rotation':>9}")
+        for block_size in block_sizes:
+            path = os.path.join(workdir, str(block_size))
+            try:
+                _, num_super_blocks, _ = tune(args.size, block_size, rotation_budget=args.rotation_budget)
+            except ValueError as e:
+                print(f"  {block_size:>8} {e}")
+                continue
+
+            def encrypt():
+                shutil.rmtree(path, ignore_errors=True)
+                return encrypt_knob(input_file, path, gk_key, knob_key.publickey(), get_random_bytes(KEY_SIZE),
+                                    block_size=block_size, num_super_blocks=num_super_blocks)
+
+            def decrypt():
+                with open_block_source(path) as source:
+                    decrypt_to_file(source, meta["super_block_indices"], meta["num_blocks"], gk_key, meta["metaFK"],
+                                    os.path.join(workdir, "output.bin"), os.cpu_count())
+
+            t_encrypt, meta = bench(encrypt, args.repeat)
+            t_decrypt, _ = bench(decrypt, args.repeat)
+
+            # Métadonnées : metaFK, metaSK, metaIndex, metaSGX et ce que le conteneur ajoute aux blocs
+            metadata = sum(len(meta[name]) for name in ("metaFK", "metaSK", "metaIndex", "metaSGX")) + HEADER.size + 16
+            marker = "*" if block_size == auto_block_size else " "
+            print(f"{marker} {block_size:>8} {meta['num_blocks']:>9} {num_super_blocks:>6} {size_mb / t_encrypt:>13.1f} "
+                  f"{size_mb / t_decrypt:>15.1f} {metadata:>12} {num_super_blocks * block_size:>9}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
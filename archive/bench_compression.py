@@ -0,0 +1,96 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+from block_container import open_block_source
+from decryption_service import decrypt_to_file
+from encryption_service import KEY_SIZE, encrypt_knob
+from knob_compression import available_codecs
+
+# Débit de bout en bout (compression + chiffrement KNOB, puis déchiffrement +
+# décompression) et octets stockés selon le codec, sur un corpus de fichiers.
+# Par défaut : les fichiers texte du dépôt (input.txt, documentation, test.txt).
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = [os.path.join(REPO, name) for name in ("input.txt", "README.md", "Cassandra.md", "Zookeeper.md",
+                                                         "Chiffrements.md", os.path.join("archive", "test.txt"))]
+
+def list_corpus(paths):
+    """Fichiers des chemins donnés (les dossiers sont parcourus récursivement)."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield path
+
+def stored_bytes(path):
+    """Octets écrits pour un fichier chiffré (conteneur ou dossiers blocks/ et super_blocks/)."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def bench_codec(files, codec, gk_key, knob_key, workdir, repeat):
+    """Meilleurs temps de chiffrement et de déchiffrement du corpus, et octets stockés."""
+    best_encrypt = best_decrypt = None
+    for _ in range(repeat):
+        shutil.rmtree(os.path.join(workdir, codec), ignore_errors=True)
+        metas = []
+        start_time = time.perf_counter()
+        for n, input_file in enumerate(files):
+            path = os.path.join(workdir, codec, str(n))
+            metas.append((path, encrypt_knob(input_file, path, gk_key, knob_key.publickey(), get_random_bytes(KEY_SIZE),
+                                             compression=codec)))
+        elapsed = time.perf_counter() - start_time
+        best_encrypt = elapsed if best_encrypt is None else min(best_encrypt, elapsed)
+
+        start_time = time.perf_counter()
+        for (path, meta), input_file in zip(metas, files):
+            output_file = os.path.join(workdir, "output.bin")
+            with open_block_source(path) as source:
+                decrypt_to_file(source, meta["super_block_indices"], meta["num_blocks"], gk_key, meta["metaFK"],
+                                output_file)
+        elapsed = time.perf_counter() - start_time
+        best_decrypt = elapsed if best_decrypt is None else min(best_decrypt, elapsed)
+
+    # Vérification sur le dernier fichier
+    with open(files[-1], "rb") as f, open(os.path.join(workdir, "output.bin"), "rb") as g:
+        if f.read() != g.read():
+            raise ValueError(f"{codec} : le fichier déchiffré diffère de l'original.")
+    return best_encrypt, best_decrypt, stored_bytes(os.path.join(workdir, codec))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compression avant chiffrement : débit et octets stockés par codec.")
+    parser.add_argument("corpus", nargs="*", help="Fichiers ou dossiers du corpus (par défaut, les textes du dépôt)")
+    parser.add_argument("--codecs", default=",".join(available_codecs()), help="Codecs comparés")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    files = list(list_corpus(args.corpus or DEFAULT_CORPUS))
+    if not files:
+        print("Erreur : corpus vide.")
+        sys.exit(1)
+    original = sum(os.path.getsize(f) for f in files)
+    size_mb = original / (1024 * 1024)
+
+    gk_key = get_random_bytes(KEY_SIZE)
+    knob_key = RSA.generate(2048)
+    workdir = tempfile.mkdtemp(prefix="knob-compression-")
+    try:
+        print(f"Corpus : {len(files)} fichiers, {original} octets")
+        print(f"  {'codec':<6} {'stockés':>12} {'gain':>7} {'chiffr. Mo/s':>13} {'déchiffr. Mo/s':>15}")
+        for codec in args.codecs.split(","):
+            if codec not in available_codecs():
+                print(f"  {codec:<6} indisponible (module Python manquant)")
+                continue
+            t_encrypt, t_decrypt, stored = bench_codec(files, codec, gk_key, knob_key, workdir, args.repeat)
+            print(f"  {codec:<6} {stored:>12} {100 * (1 - stored / original):>6.1f}% "
+                  f"{size_mb / t_encrypt:>13.1f} {size_mb / t_decrypt:>15.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Banc d'essai comparatif : KNOB, AES-CBC classique et Mix&Slice.
+#
+# Chaque mesure est faite dans un processus neuf (le pic de mémoire, ru_maxrss,
+# est alors celui de l'opération) ; seule l'opération elle-même est chronométrée,
+# pas le démarrage de l'interpréteur ni la préparation. Le résultat est un JSON
+# stable, à comparer d'une version à l'autre avec --compare.
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+WRITE_CHUNK = 16 * 1024 * 1024
+MACRO_BLOCK_SIZE = 4096  # Mix&Slice ne traite pas les fichiers plus petits
+PERCENTILES = (50, 90, 99)
+
+KNOB_OPERATIONS = ("knob_encrypt", "knob_decrypt")
+CLASSIC_OPERATIONS = ("classic_encrypt", "classic_decrypt", "mixslice_reencrypt", "mixslice_decrypt")
+
+def parse_size(text):
+    """'1K', '64M', '2G' ou un nombre d'octets."""
+    text = text.strip().upper()
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+def percentile(sorted_values, q):
+    """Percentile q (interpolation linéaire) d'une liste triée."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+def write_random_file(filename, size):
+    with open(filename, "wb") as f:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, WRITE_CHUNK)
+            f.write(os.urandom(chunk))
+            remaining -= chunk
+
+# --- Opérations (exécutées dans le processus de mesure) ---
+
+def run_operation(case):
+    """Exécute une opération, renvoie sa durée en secondes."""
+    from Crypto.PublicKey import RSA
+
+    op = case["operation"]
+    files = case["files"]
+    key = bytes.fromhex(case["key"])
+
+    if op in KNOB_OPERATIONS:
+        import encryption_service
+        import decryption_service
+        from block_container import open_block_source
+
+        gk_key = bytes.fromhex(case["gk"])
+        knob_key = RSA.import_key(open(files["knob_key"], "rb").read())
+        start_time = time.perf_counter()
+
+        if op == "knob_encrypt":
+            meta = encryption_service.encrypt_knob(files["input"], files["knob_dir"], gk_key, knob_key.publickey(), key,
+                                                   block_size=case["block_size"], num_super_blocks=case["super_blocks"])
+            elapsed = time.perf_counter() - start_time
+            for name in ("metaFK", "metaIndex", "metaSGX"):
+                with open(os.path.join(files["knob_dir"], name + ".bin"), "wb") as f:
+                    f.write(meta[name])
+            return elapsed
+
+        # Déchiffrement complet, RSA compris : c'est la latence vue par un lecteur
+        meta = {}
+        for name in ("metaFK", "metaIndex", "metaSGX"):
+            with open(os.path.join(files["knob_dir"], name + ".bin"), "rb") as f:
+                meta[name] = f.read()
+        sk = decryption_service.get_sk(knob_key, meta["metaSGX"])
+        super_block_indices, num_blocks = decryption_service.get_super_blocks_indices(meta["metaIndex"], sk)
+        with open_block_source(files["knob_dir"]) as source:
+            decryption_service.decrypt_to_file(source, super_block_indices, num_blocks, gk_key, meta["metaFK"],
+                                               files["output"], case["workers"])
+        return time.perf_counter() - start_time
+
+    new_key = bytes.fromhex(case["new_key"])
+    start_time = time.perf_counter()
+    if op == "classic_encrypt":
+        from encrypt_classic import encrypt_classic
+        encrypt_classic(files["input"], files["classic"], key)
+    elif op == "classic_decrypt":
+        from decrypt_classic import decrypt_classic
+        decrypt_classic(files["classic"], files["output"], key, case["workers"])
+    elif op == "mixslice_reencrypt":
+        from reencrypt_mixslice import reencrypt_mixslice
+        reencrypt_mixslice(files["classic"], files["mixslice"], new_key)
+    elif op == "mixslice_decrypt":
+        from decrypt_mixslice import decrypt_mixslice
+        decrypt_mixslice(files["mixslice"], files["output"], key, new_key)
+    else:
+        raise ValueError(f"Opération inconnue : {op}")
+    return time.perf_counter() - start_time
+
+def worker_main(case_json):
+    """Point d'entrée du processus de mesure : une ligne JSON sur stdout."""
+    case = json.loads(case_json)
+    with contextlib.redirect_stdout(sys.stderr):  # Les scripts mesurés affichent leurs propres messages
+        seconds = run_operation(case)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # Octets sous macOS, Ko sous Linux
+        peak_rss_kb //= 1024
+    print(json.dumps({"seconds": seconds, "peak_rss_kb": peak_rss_kb}))
+
+# --- Orchestration ---
+
+def measure(case, repeat):
+    """Lance repeat processus de mesure, renvoie la ligne de résultat."""
+    result = {key: case[key] for key in ("operation", "size", "block_size", "super_blocks", "workers")}
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case)],
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            result["error"] = (proc.stderr.strip().splitlines() or ["code " + str(proc.returncode)])[-1]
+            return result
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    seconds = sorted(run["seconds"] for run in runs)
+    size_mb = case["size"] / (1024 * 1024)
+    result["runs"] = len(runs)
+    result["seconds"] = {"min": seconds[0], "mean": sum(seconds) / len(seconds),
+                         **{f"p{q}": percentile(seconds, q) for q in PERCENTILES}}
+    result["throughput_mb_s"] = size_mb / result["seconds"]["p50"] if result["seconds"]["p50"] else None
+    result["peak_rss_kb"] = max(run["peak_rss_kb"] for run in runs)
+    return result
+
+def build_cases(sizes, block_sizes, super_blocks, operations, workers):
+    """Matrice des cas, dans l'ordre où ils doivent être exécutés (chiffrement avant déchiffrement)."""
+    cases = []
+    for size in sizes:
+        for op in CLASSIC_OPERATIONS:
+            if op in operations and not (op.startswith("mixslice") and size + 16 < MACRO_BLOCK_SIZE):
+                cases.append({"operation": op, "size": size, "block_size": None, "super_blocks": None, "workers": workers})
+        for block_size in block_sizes:
+            for k in super_blocks:
+                if size // block_size + 1 < k:  # Pas assez de blocs pour k super blocs
+                    continue
+                for op in KNOB_OPERATIONS:
+                    if op in operations:
+                        cases.append({"operation": op, "size": size, "block_size": block_size, "super_blocks": k,
+                                      "workers": workers})
+    return cases
+
+def run_suite(sizes, block_sizes, super_blocks, operations, repeat, workers, workdir, log=print):
+    from Crypto.PublicKey import RSA
+    from Crypto.Random import get_random_bytes
+
+    knob_key = RSA.generate(2048)
+    keys = {"key": get_random_bytes(32).hex(), "new_key": get_random_bytes(32).hex(), "gk": get_random_bytes(32).hex()}
+    with open(os.path.join(workdir, "knob-key.pem"), "wb") as f:
+        f.write(knob_key.export_key())
+
+    results = []
+    current_size = None
+    for case in build_cases(sizes, block_sizes, super_blocks, operations, workers):
+        size = case["size"]
+        tag = format_size(size)
+        if size != current_size:
+            write_random_file(os.path.join(workdir, f"input-{tag}.bin"), size)
+            current_size = size
+        knob_dir = os.path.join(workdir, f"knob-{tag}-{case['block_size']}-{case['super_blocks']}")
+        case.update(keys)
+        case["files"] = {
+            "input": os.path.join(workdir, f"input-{tag}.bin"),
+            "output": os.path.join(workdir, "output.bin"),
+            "classic": os.path.join(workdir, f"classic-{tag}.bin"),
+            "mixslice": os.path.join(workdir, f"mixslice-{tag}.bin"),
+            "knob_dir": knob_dir,
+            "knob_key": os.path.join(workdir, "knob-key.pem"),
+        }
+        if case["operation"] == "knob_encrypt":
+            shutil.rmtree(knob_dir, ignore_errors=True)
+
+        result = measure(case, repeat)
+        results.append(result)
+        if "error" in result:
+            log(f"{result['operation']:<20} {tag:>6} : échec ({result['error']})")
+        else:
+            log(f"{result['operation']:<20} {tag:>6} bs={case['block_size'] or '-'} k={case['super_blocks'] or '-'} : "
+                f"p50 {result['seconds']['p50']:.4f} s, {result['throughput_mb_s'] or 0:.1f} Mo/s, "
+                f"RSS {result['peak_rss_kb'] / 1024:.0f} Mo")
+    return results
+
+def environment():
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit.stdout.strip() or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+def case_key(result):
+    return (result["operation"], result["size"], result["block_size"], result["super_blocks"], result["workers"])
+
+def compare(old_results, new_results):
+    """Affiche, pour chaque cas présent dans les deux rapports, l'évolution du p50 et du pic mémoire."""
+    old = {case_key(r): r for r in old_results if "error" not in r}
+    for r in new_results:
+        before = old.get(case_key(r))
+        if before is None or "error" in r:
+            continue
+        ratio = r["seconds"]["p50"] / before["seconds"]["p50"] if before["seconds"]["p50"] else float("inf")
+        print(f"{r['operation']:<20} {format_size(r['size']):>6} bs={r['block_size'] or '-'} k={r['super_blocks'] or '-'} : "
+              f"p50 x{ratio:.2f}, RSS {before['peak_rss_kb']} -> {r['peak_rss_kb']} Ko")
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        return worker_main(sys.argv[2])
+
+    parser = argparse.ArgumentParser(description="Banc d'essai comparatif KNOB / AES-CBC classique / Mix&Slice.")
+    parser.add_argument("--sizes", default="1K,64K,1M,16M", help="Tailles de fichier (ex. 1K,1M,4G)")
+    parser.add_argument("--block-sizes", default="1024", help="Tailles de bloc KNOB (ex. 1024,4096)")
+    parser.add_argument("--super-blocks", default="2", help="Nombres de super blocs KNOB (ex. 2,8)")
+    parser.add_argument("--operations", default=",".join(CLASSIC_OPERATIONS + KNOB_OPERATIONS),
+                        help="Opérations à mesurer, séparées par des virgules")
+    parser.add_argument("--repeat", type=int, default=5, help="Nombre de mesures par cas")
+    parser.add_argument("--workers", type=int, default=1, help="Threads de déchiffrement")
+    parser.add_argument("--workdir", help="Dossier de travail (par défaut, temporaire et supprimé)")
+    parser.add_argument("--output", default="bench_results.json", help="Rapport JSON")
+    parser.add_argument("--compare", help="Rapport JSON précédent à comparer")
+    args = parser.parse_args()
+
+    operations = [op.strip() for op in args.operations.split(",")]
+    unknown = set(operations) - set(CLASSIC_OPERATIONS + KNOB_OPERATIONS)
+    if unknown:
+        print(f"Opérations inconnues : {', '.join(sorted(unknown))}")
+        sys.exit(1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="knob-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run_suite([parse_size(s) for s in args.sizes.split(",")],
+                            [int(bs) for bs in args.block_sizes.split(",")],
+                            [int(k) for k in args.super_blocks.split(",")],
+                            operations, args.repeat, args.workers, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Rapport écrit dans {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)["results"], results)
+
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
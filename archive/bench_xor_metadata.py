@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+from xor_metadata import compute_xor_metadata, compute_xor_metadata_batched
+
+# Constantes
+BLOCK_SIZE = 1024  # Taille de bloc en octets (1 Ko)
+KEY_SIZE = 32      # Clé FK de 256 bits
+
+def bench(function, *args, repeat=3):
+    """Renvoie le meilleur temps d'exécution et le résultat de function(*args)."""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python bench_xor_metadata.py <nombre_de_blocs> [taille_de_bloc] [threads]")
+        sys.exit(1)
+
+    num_blocks = int(sys.argv[1])
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else BLOCK_SIZE
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    data = os.urandom(num_blocks * block_size)
+    blocks = [data[i:i + block_size] for i in range(0, len(data), block_size)]
+    key = os.urandom(KEY_SIZE)
+
+    t_ref, meta_ref = bench(compute_xor_metadata, blocks, key)
+    t_batched, meta_batched = bench(compute_xor_metadata_batched, blocks, key, None, workers)
+
+    if meta_ref != meta_batched:
+        print("Erreur : les deux implémentations donnent des résultats différents.")
+        sys.exit(1)
+
+    size_mb = len(data) / (1024 * 1024)
+    print(f"{num_blocks} blocs de {block_size} octets ({size_mb:.1f} Mo)")
+    print(f"compute_xor_metadata         : {t_ref:.4f} s ({size_mb / t_ref:.1f} Mo/s)")
+    print(f"compute_xor_metadata_batched : {t_batched:.4f} s ({size_mb / t_batched:.1f} Mo/s)")
+    print(f"Accélération : x{t_ref / t_batched:.2f}")
+
+if __name__ == "__main__":
+    main()
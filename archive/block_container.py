@@ -0,0 +1,315 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+# Conteneur compact des blocs d'un fichier KNOB : un seul fichier au lieu d'un
+# fichier par bloc dans blocks/ et super_blocks/.
+#
+#   [en-tête (64 o)][IV][segment des blocs][segment des super blocs]
+#
+# Les blocs sont de taille fixe : l'en-tête donne la position de chaque segment
+# et le nombre de blocs, ce qui suffit à retrouver n'importe quel bloc.
+CONTAINER_NAME = "blocks.knob"
+MAGIC = b"KNOBPACK"
+VERSION = 1
+
+# magic, version, flags, block_size, iv_size, num_blocks, num_super_blocks,
+# iv_offset, blocks_offset, super_blocks_offset (4 octets réservés). L'octet
+# de poids faible de flags est le codec de compression (knob_compression),
+# l'octet de poids fort le mode de chiffrement de la couche FK (knob_modes).
+HEADER = struct.Struct("<8sHHIIQQQQQ4x")
+FLAGS_NAME = "flags.txt"  # Équivalent de flags pour l'ancien format (absent si nul)
+GK_TAG_NAME = "gk.tag"    # Empreinte de la clé de groupe des super blocs (vérifiée par group_key_rotation)
+GK_TAG_SIZE = 16
+
+class BlockContainerWriter:
+    """Écrit un conteneur en flux : les blocs sont ajoutés dans l'ordre du fichier."""
+
+    def __init__(self, filename, block_size, iv, flags=0):
+        self.filename = filename
+        self.block_size = block_size
+        self.iv = iv
+        self.flags = flags
+        self.num_blocks = 0
+        self.super_blocks = []  # Peu nombreux : écrits à la fermeture
+        self._file = open(filename, "wb")
+        self._file.write(bytes(HEADER.size))
+        self._file.write(iv)
+
+    def write_block(self, block):
+        """Ajoute un bloc au segment des blocs."""
+        if len(block) != self.block_size:
+            raise ValueError(f"Bloc de {len(block)} octets, {self.block_size} attendus.")
+        self._file.write(block)
+        self.num_blocks += 1
+
+    def write_super_block(self, block):
+        """Ajoute un super bloc au segment des super blocs."""
+        if len(block) != self.block_size:
+            raise ValueError(f"Super bloc de {len(block)} octets, {self.block_size} attendus.")
+        self.super_blocks.append(bytes(block))
+
+    def close(self):
+        """Écrit le segment des super blocs puis l'en-tête définitif."""
+        if self._file is None:
+            return
+        iv_offset = HEADER.size
+        blocks_offset = iv_offset + len(self.iv)
+        super_blocks_offset = blocks_offset + self.num_blocks * self.block_size
+
+        for block in self.super_blocks:
+            self._file.write(block)
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, self.flags, self.block_size, len(self.iv),
+                                     self.num_blocks, len(self.super_blocks),
+                                     iv_offset, blocks_offset, super_blocks_offset))
+        self._file.close()
+        self._file = None
+
+    def abort(self):
+        """Abandonne l'écriture : le conteneur partiel (en-tête jamais écrit) est supprimé."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # En-tête définitif seulement si tous les blocs ont été écrits
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class BlockContainer:
+    """
+    Lecture d'un conteneur par mmap. Les blocs renvoyés sont des memoryview sur
+    le fichier (aucune copie) : ils doivent être libérés avant close().
+    """
+
+    zero_copy = True  # read_blocks renvoie une vue sur le mmap : rien à lire en avance (block_prefetch)
+
+    def __init__(self, filename, writable=False):
+        self.filename = filename
+        self._file = open(filename, "r+b" if writable else "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        if len(self._mmap) < HEADER.size:
+            self.close()
+            raise ValueError(f"{filename} : conteneur tronqué.")
+        (magic, version, self.flags, self.block_size, iv_size, self.num_blocks, self.num_super_blocks,
+         iv_offset, self.blocks_offset, self.super_blocks_offset) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} n'est pas un conteneur de blocs KNOB.")
+        if self.super_blocks_offset + self.num_super_blocks * self.block_size > len(self._mmap):
+            self.close()
+            raise ValueError(f"{filename} : conteneur tronqué.")
+
+        self.iv = bytes(self._mmap[iv_offset:iv_offset + iv_size])
+
+    def block(self, j):
+        """j-ième bloc ordinaire."""
+        if not 0 <= j < self.num_blocks:
+            raise IndexError(j)
+        start = self.blocks_offset + j * self.block_size
+        return self._view[start:start + self.block_size]
+
+    def super_block(self, j):
+        """j-ième super bloc."""
+        if not 0 <= j < self.num_super_blocks:
+            raise IndexError(j)
+        start = self.super_blocks_offset + j * self.block_size
+        return self._view[start:start + self.block_size]
+
+    def blocks_segment(self):
+        """Segment des blocs ordinaires d'un seul tenant."""
+        return self._view[self.blocks_offset:self.blocks_offset + self.num_blocks * self.block_size]
+
+    def read_blocks(self, j, count, buffer=None):
+        """Blocs ordinaires j à j + count - 1 : vue directe sur le mmap, buffer est ignoré."""
+        if count < 0 or not 0 <= j <= j + count <= self.num_blocks:
+            raise IndexError(j)
+        start = self.blocks_offset + j * self.block_size
+        return self._view[start:start + count * self.block_size]
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BlockDirectoryWriter:
+    """Ancien format : un fichier par bloc dans path/blocks et path/super_blocks."""
+
+    def __init__(self, path, iv, flags=0):
+        self.blocks_dir = os.path.join(path, "blocks")
+        self.super_blocks_dir = os.path.join(path, "super_blocks")
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        os.makedirs(self.super_blocks_dir, exist_ok=True)
+        with open(os.path.join(self.blocks_dir, "iv.bin"), "wb") as f:
+            f.write(iv)
+        if flags:
+            with open(os.path.join(self.blocks_dir, FLAGS_NAME), "w") as f:
+                f.write(str(flags))
+        self.num_blocks = 0
+        self.num_super_blocks = 0
+
+    def write_block(self, block):
+        with open(os.path.join(self.blocks_dir, str(self.num_blocks) + ".bin"), "wb") as f:
+            f.write(block)
+        self.num_blocks += 1
+
+    def write_super_block(self, block):
+        with open(os.path.join(self.super_blocks_dir, str(self.num_super_blocks) + ".bin"), "wb") as f:
+            f.write(block)
+        self.num_super_blocks += 1
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BlockDirectory:
+    """Ancien format : un fichier par bloc dans path/blocks et path/super_blocks."""
+
+    def __init__(self, path):
+        self.path = path
+        self.blocks_dir = os.path.join(path, "blocks")
+        self.super_blocks_dir = os.path.join(path, "super_blocks")
+        if not (os.path.isdir(self.blocks_dir) and os.path.isdir(self.super_blocks_dir)):
+            raise FileNotFoundError("Les dossiers super_blocks et blocks n'existent pas.")
+
+        with open(os.path.join(self.blocks_dir, "iv.bin"), "rb") as f:
+            self.iv = f.read()
+        try:
+            with open(os.path.join(self.blocks_dir, FLAGS_NAME)) as f:
+                self.flags = int(f.read())
+        except FileNotFoundError:
+            self.flags = 0
+        self.num_blocks = count_numbered_files(self.blocks_dir)
+        self.num_super_blocks = count_numbered_files(self.super_blocks_dir)
+        first = self.block(0) if self.num_blocks else self.super_block(0)
+        self.block_size = len(first)
+
+    def block(self, j):
+        with open(os.path.join(self.blocks_dir, str(j) + ".bin"), "rb") as f:
+            return f.read()
+
+    def super_block(self, j):
+        with open(os.path.join(self.super_blocks_dir, str(j) + ".bin"), "rb") as f:
+            return f.read()
+
+    def read_blocks(self, j, count, buffer):
+        """Lit les blocs ordinaires j à j + count - 1 dans buffer (readinto, sans copie intermédiaire)."""
+        view = memoryview(buffer)[:count * self.block_size]
+        for n in range(count):
+            with open(os.path.join(self.blocks_dir, str(j + n) + ".bin"), "rb") as f:
+                f.readinto(view[n * self.block_size:(n + 1) * self.block_size])
+        return view
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def group_key_tag(group_key):
+    """Empreinte d'une clé de groupe : ne révèle rien de la clé, identifie celle des super blocs."""
+    return hashlib.sha256(group_key).digest()[:GK_TAG_SIZE]
+
+def read_group_key_tag(path):
+    """Empreinte de la clé de groupe des super blocs de path, ou None (dossier écrit avant gk.tag)."""
+    try:
+        with open(os.path.join(path, GK_TAG_NAME), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def write_group_key_tag(path, group_key):
+    with open(os.path.join(path, GK_TAG_NAME), "wb") as f:
+        f.write(group_key_tag(group_key))
+
+def count_numbered_files(directory):
+    """Nombre de fichiers <n>.bin numérotés à partir de 0."""
+    return sum(1 for name in os.listdir(directory) if name.endswith(".bin") and name[:-4].isdigit())
+
+def open_block_source(path):
+    """Ouvre le conteneur de path s'il existe, sinon les dossiers blocks/ et super_blocks/."""
+    container = os.path.join(path, CONTAINER_NAME)
+    if os.path.exists(container):
+        return BlockContainer(container)
+    return BlockDirectory(path)
+
+def iter_file_order(source, super_block_indices, num_blocks, chunk_blocks=None):
+    """
+    Blocs stockés (super blocs chiffrés avec GK) dans l'ordre du fichier, par
+    paquets d'au plus chunk_blocks blocs (256 Ko par défaut) : la mémoire
+    utilisée reste bornée.
+    """
+    chunk_blocks = chunk_blocks or max(1, 256 * 1024 // source.block_size)
+    buffer = bytearray(chunk_blocks * source.block_size)
+    i = 0  # Indice dans le fichier
+    j = 0  # Indice du bloc ordinaire
+    for k, super_index in enumerate(list(super_block_indices) + [num_blocks]):
+        while i < super_index:
+            count = min(chunk_blocks, super_index - i)
+            yield bytes(source.read_blocks(j, count, buffer))
+            i += count
+            j += count
+        if super_index < num_blocks:
+            yield bytes(source.super_block(k))
+            i += 1
+
+def convert_blocks_directory(path, filename=None):
+    """Convertit path/blocks et path/super_blocks en conteneur, renvoie son chemin."""
+    filename = filename or os.path.join(path, CONTAINER_NAME)
+    with BlockDirectory(path) as source, BlockContainerWriter(filename, source.block_size, source.iv, source.flags) as writer:
+        for j in range(source.num_blocks):
+            writer.write_block(source.block(j))
+        for j in range(source.num_super_blocks):
+            writer.write_super_block(source.super_block(j))
+    return filename
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python block_container.py <path> [conteneur]")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    filename = sys.argv[2] if len(sys.argv) > 2 else None
+
+    try:
+        filename = convert_blocks_directory(path, filename)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+
+    with BlockContainer(filename) as container:
+        print(f"{container.num_blocks} blocs et {container.num_super_blocks} super blocs regroupés dans {filename}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Lecture anticipée des blocs pour le déchiffrement : les blocs ordinaires sont
+# lus par fenêtres de WINDOW_SIZE octets sur FETCH_WORKERS threads, au plus
+# PREFETCH fenêtres en avance (file bornée : la mémoire reste en
+# O(PREFETCH × WINDOW_SIZE)), pendant que le thread appelant hache ou déchiffre
+# la fenêtre courante. Les super blocs sont lus en même temps que les premières
+# fenêtres. Sur un stockage distant (StoreBlockSource), le temps total tend vers
+# max(lecture, calcul) au lieu de leur somme. Les sources dont read_blocks
+# renvoie une vue sans copie (zero_copy, conteneur local projeté en mémoire)
+# sont lues dans le thread appelant, sans tampon ni thread.
+#
+# Les lectures concurrentes n'utilisent que read_blocks (chaque fenêtre a son
+# propre tampon) et super_block : c'est tout ce que les sources doivent
+# supporter depuis plusieurs threads.
+WINDOW_SIZE = 1024 * 1024
+PREFETCH = 8
+FETCH_WORKERS = 4
+
+def split_blocks(windows, block_size):
+    """Blocs (vues) des fenêtres de windows, dans l'ordre."""
+    for window in windows:
+        view = memoryview(window)
+        for offset in range(0, len(view), block_size):
+            yield view[offset:offset + block_size]
+
+class Prefetcher:
+    """
+    Itérateur sur les résultats de tasks (fonctions sans argument), dans
+    l'ordre, exécutées sur executor avec au plus depth tâches en avance. Les
+    premières sont lancées dès la création ; close() annule celles en attente.
+    """
+
+    def __init__(self, executor, tasks, depth=PREFETCH):
+        self._executor = executor
+        self._tasks = iter(tasks)
+        self._depth = max(1, depth)
+        self._pending = deque()
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self._depth:
+            task = next(self._tasks, None)
+            if task is None:
+                return
+            self._pending.append(self._executor.submit(task))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            raise StopIteration
+        future = self._pending.popleft()
+        try:
+            result = future.result()
+        except BaseException:
+            self.close()
+            raise
+        self._fill()
+        return result
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._tasks = iter(())
+
+class BlockFetcher:
+    """Lectures anticipées sur une source de blocs (voir block_container et block_storage)."""
+
+    def __init__(self, source, window_size=WINDOW_SIZE, depth=PREFETCH, workers=FETCH_WORKERS):
+        self.source = source
+        self.zero_copy = getattr(source, "zero_copy", False)
+        # Sans copie, rien à recouvrir : une seule fenêtre par plage de blocs
+        self.window_blocks = max(1, source.num_blocks if self.zero_copy else window_size // source.block_size)
+        self.depth = max(1, depth)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(workers, self.depth)))
+        self._super_blocks = None
+        self._prefetchers = []
+
+    def super_blocks(self):
+        """Future de la liste des super blocs stockés (lus une seule fois, en parallèle des fenêtres)."""
+        if self._super_blocks is None:
+            source = self.source
+            self._super_blocks = self.executor.submit(
+                lambda: [bytes(source.super_block(j)) for j in range(source.num_super_blocks)])
+        return self._super_blocks
+
+    def windows(self, start, end):
+        """(j, count) des fenêtres couvrant les blocs ordinaires start à end - 1."""
+        return [(j, min(self.window_blocks, end - j)) for j in range(start, end, self.window_blocks)]
+
+    def prefetch(self, tasks, depth=None):
+        """Prefetcher sur l'exécuteur de la source, fermé avec elle."""
+        prefetcher = Prefetcher(self.executor, tasks, depth or self.depth)
+        self._prefetchers.append(prefetcher)
+        return prefetcher
+
+    def read_windows(self, windows, buffers=None):
+        """
+        Itérateur (lectures lancées) sur les données des fenêtres (j, count) de
+        blocs ordinaires. buffers : tampon de chaque fenêtre, dans le même
+        ordre (par défaut, un nouveau bytearray par fenêtre).
+        """
+        source = self.source
+        bs = source.block_size
+        if self.zero_copy:
+            return (source.read_blocks(j, count) for j, count in windows)
+
+        def tasks():
+            for n, (j, count) in enumerate(windows):
+                buffer = buffers[n] if buffers is not None else bytearray(count * bs)
+                yield lambda j=j, count=count, buffer=buffer: source.read_blocks(j, count, buffer)
+
+        return self.prefetch(tasks())
+
+    def regular_blocks(self, start=0, end=None):
+        """Itérateur (lectures lancées) sur les blocs ordinaires start à end - 1, un par un (FK, hachage)."""
+        end = self.source.num_blocks if end is None else end
+        return split_blocks(self.read_windows(self.windows(start, end)), self.source.block_size)
+
+    def close(self):
+        for prefetcher in self._prefetchers:
+            prefetcher.close()
+        self._prefetchers = []
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,547 @@
+import abc
+import argparse
+import base64
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from block_container import open_block_source, read_group_key_tag
+
+try:
+    from cassandra.cluster import Cluster
+    from cassandra.concurrent import execute_concurrent
+    from cassandra.query import BatchStatement, BatchType
+except ImportError:  # cassandra-driver absent : seuls les stockages locaux sont disponibles
+    Cluster = None
+
+# Stockage des blocs KNOB par file_id, derrière une même interface :
+#
+# - LocalStore : un dossier par fichier (blocs et super blocs dans deux fichiers,
+#   écrits et lus par paquets avec pwrite/pread) ;
+# - SQLiteStore : une ligne par bloc, comme dans Cassandra (stockage local de
+#   référence pour les essais) ;
+# - CassandraStore : tables de data_keyspace (voir Cassandra.md), requêtes
+#   préparées, lots UNLOGGED par partition envoyés en parallèle.
+#
+# Comme dans le conteneur blocks.knob, les blocs ordinaires et les super blocs
+# sont rangés à part : la position des super blocs reste secrète (metaIndex) et
+# une rotation de GK ne réécrit que les super blocs. Les métadonnées sont
+# écrites en dernier : un fichier qui en a est complet. Elles portent aussi
+# gk_tag, l'empreinte de la clé de groupe des super blocs (gk.tag des dossiers),
+# et rotation_journal pendant une rotation de GK (voir group_key_rotation).
+BATCH_SIZE = 256 * 1024  # Octets écrits par lot (put_blocks)
+READ_SIZE = 256 * 1024   # Octets lus par requête (read_ranges)
+READ_WORKERS = 8
+BINARY_FIELDS = ("iv", "metaFK", "metaSK", "metaIndex", "metaSGX", "metaMerkle", "gk_tag", "rotation_journal")
+
+def encode_metadata(meta):
+    """Métadonnées en JSON (champs binaires en base64), sans les indices des super blocs (secrets)."""
+    record = {}
+    for name, value in meta.items():
+        if name == "super_block_indices":
+            continue
+        record[name] = base64.b64encode(value).decode() if name in BINARY_FIELDS else value
+    return json.dumps(record)
+
+def decode_metadata(text):
+    record = json.loads(text)
+    for name in BINARY_FIELDS:
+        if name in record:
+            record[name] = base64.b64decode(record[name])
+    return record
+
+def split_blocks(data, block_size):
+    return [data[n:n + block_size] for n in range(0, len(data), block_size)]
+
+class BlockStore(abc.ABC):
+    """
+    Interface commune. Les blocs ordinaires sont numérotés à partir de 0 dans
+    l'ordre du fichier, hors super blocs.
+    """
+
+    @abc.abstractmethod
+    def put_blocks(self, file_id, start, blocks):
+        """Écrit les blocs start, start + 1, ... en un seul lot."""
+
+    @abc.abstractmethod
+    def get_blocks(self, file_id, start, count):
+        """Liste des blocs start à start + count - 1."""
+
+    @abc.abstractmethod
+    def put_super_blocks(self, file_id, blocks):
+        """Écrit (ou remplace) tous les super blocs du fichier."""
+
+    @abc.abstractmethod
+    def get_super_blocks(self, file_id):
+        """Liste des super blocs du fichier."""
+
+    @abc.abstractmethod
+    def put_metadata(self, file_id, meta):
+        """Écrit (ou remplace) les métadonnées du fichier."""
+
+    @abc.abstractmethod
+    def get_metadata(self, file_id):
+        """Métadonnées du fichier, KeyError s'il est inconnu."""
+
+    def read_ranges(self, file_id, ranges):
+        """Blocs de plusieurs plages (start, count), lues en parallèle, dans l'ordre des plages."""
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            return list(executor.map(lambda r: self.get_blocks(file_id, *r), ranges))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LocalStore(BlockStore):
+    """root/<file_id>/ : blocks.bin, super_blocks.bin et meta.json."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, file_id, name):
+        return os.path.join(self.root, str(file_id), name)
+
+    def _block_size(self, file_id):
+        return self.get_metadata(file_id)["block_size"]
+
+    def put_blocks(self, file_id, start, blocks):
+        if not blocks:
+            return
+        os.makedirs(os.path.join(self.root, str(file_id)), exist_ok=True)
+        fd = os.open(self._path(file_id, "blocks.bin"), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, b"".join(blocks), start * len(blocks[0]))
+        finally:
+            os.close(fd)
+
+    def get_blocks(self, file_id, start, count, block_size=None):
+        block_size = block_size or self._block_size(file_id)
+        fd = os.open(self._path(file_id, "blocks.bin"), os.O_RDONLY)
+        try:
+            data = os.pread(fd, count * block_size, start * block_size)
+        finally:
+            os.close(fd)
+        if len(data) != count * block_size:
+            raise IndexError(f"{file_id} : blocs {start} à {start + count - 1} absents.")
+        return split_blocks(data, block_size)
+
+    def read_ranges(self, file_id, ranges):
+        block_size = self._block_size(file_id)
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            return list(executor.map(lambda r: self.get_blocks(file_id, *r, block_size), ranges))
+
+    def put_super_blocks(self, file_id, blocks):
+        os.makedirs(os.path.join(self.root, str(file_id)), exist_ok=True)
+        with open(self._path(file_id, "super_blocks.bin"), "wb") as f:
+            f.write(b"".join(blocks))
+
+    def get_super_blocks(self, file_id):
+        with open(self._path(file_id, "super_blocks.bin"), "rb") as f:
+            return split_blocks(f.read(), self._block_size(file_id))
+
+    def put_metadata(self, file_id, meta):
+        os.makedirs(os.path.join(self.root, str(file_id)), exist_ok=True)
+        filename = self._path(file_id, "meta.json")
+        with open(filename + ".tmp", "w") as f:
+            f.write(encode_metadata(meta))
+        os.replace(filename + ".tmp", filename)
+
+    def get_metadata(self, file_id):
+        try:
+            with open(self._path(file_id, "meta.json")) as f:
+                return decode_metadata(f.read())
+        except FileNotFoundError:
+            raise KeyError(file_id) from None
+
+class SQLiteStore(BlockStore):
+    """Une ligne par bloc (comme Cassandra) ; une connexion par thread pour les lectures parallèles."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blocks (file_id TEXT, block_index INTEGER, data BLOB,
+                                           PRIMARY KEY (file_id, block_index));
+        CREATE TABLE IF NOT EXISTS super_blocks (file_id TEXT, block_index INTEGER, data BLOB,
+                                                 PRIMARY KEY (file_id, block_index));
+        CREATE TABLE IF NOT EXISTS files (file_id TEXT PRIMARY KEY, metadata TEXT);
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, check_same_thread=False, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def put_blocks(self, file_id, start, blocks):
+        # Un seul executemany dans une seule transaction par lot
+        with self._connection() as connection:
+            connection.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)",
+                                   ((str(file_id), start + n, block) for n, block in enumerate(blocks)))
+
+    def get_blocks(self, file_id, start, count):
+        rows = self._connection().execute(
+            "SELECT data FROM blocks WHERE file_id = ? AND block_index >= ? AND block_index < ? ORDER BY block_index",
+            (str(file_id), start, start + count)).fetchall()
+        if len(rows) != count:
+            raise IndexError(f"{file_id} : blocs {start} à {start + count - 1} absents.")
+        return [row[0] for row in rows]
+
+    def put_super_blocks(self, file_id, blocks):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM super_blocks WHERE file_id = ?", (str(file_id),))
+            connection.executemany("INSERT INTO super_blocks VALUES (?, ?, ?)",
+                                   ((str(file_id), n, block) for n, block in enumerate(blocks)))
+
+    def get_super_blocks(self, file_id):
+        rows = self._connection().execute(
+            "SELECT data FROM super_blocks WHERE file_id = ? ORDER BY block_index", (str(file_id),)).fetchall()
+        return [row[0] for row in rows]
+
+    def put_metadata(self, file_id, meta):
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (str(file_id), encode_metadata(meta)))
+
+    def get_metadata(self, file_id):
+        row = self._connection().execute("SELECT metadata FROM files WHERE file_id = ?", (str(file_id),)).fetchone()
+        if row is None:
+            raise KeyError(file_id)
+        return decode_metadata(row[0])
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+class CassandraStore(BlockStore):
+    """
+    Tables de data_keyspace. Les blocs d'un fichier sont répartis en partitions
+    (file_id, bucket) de BUCKET_BLOCKS blocs pour éviter les partitions géantes.
+    """
+
+    BUCKET_BLOCKS = 4096
+    MAX_BATCH_BYTES = 48 * 1024  # Sous batch_size_fail_threshold (50 Ko par défaut)
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS knob_blocks (file_id uuid, bucket int, block_index int, data blob, "
+        "PRIMARY KEY ((file_id, bucket), block_index))",
+        "CREATE TABLE IF NOT EXISTS super_blocks (file_id uuid, block_index int, data blob, "
+        "PRIMARY KEY (file_id, block_index))",
+        "CREATE TABLE IF NOT EXISTS files (file_id uuid PRIMARY KEY, metadata text)",
+    )
+
+    def __init__(self, contact_points, keyspace="data_keyspace", port=9042, session=None, concurrency=64):
+        if session is None:
+            if Cluster is None:
+                raise ImportError("CassandraStore nécessite cassandra-driver (pip install cassandra-driver).")
+            self._cluster = Cluster(list(contact_points), port=port)
+            session = self._cluster.connect(keyspace)
+        else:
+            self._cluster = None
+        self.session = session
+        self.concurrency = concurrency
+        for statement in self.SCHEMA:
+            session.execute(statement)
+        self._insert_block = session.prepare(
+            "INSERT INTO knob_blocks (file_id, bucket, block_index, data) VALUES (?, ?, ?, ?)")
+        self._select_blocks = session.prepare(
+            "SELECT data FROM knob_blocks WHERE file_id = ? AND bucket = ? AND block_index >= ? AND block_index < ?")
+        self._delete_super_blocks = session.prepare("DELETE FROM super_blocks WHERE file_id = ?")
+        self._insert_super_block = session.prepare(
+            "INSERT INTO super_blocks (file_id, block_index, data) VALUES (?, ?, ?)")
+        self._select_super_blocks = session.prepare("SELECT data FROM super_blocks WHERE file_id = ?")
+        self._insert_metadata = session.prepare("INSERT INTO files (file_id, metadata) VALUES (?, ?)")
+        self._select_metadata = session.prepare("SELECT metadata FROM files WHERE file_id = ?")
+
+    def _execute_all(self, statements_and_params):
+        results = execute_concurrent(self.session, statements_and_params, concurrency=self.concurrency,
+                                     raise_on_first_error=True)
+        return [result for _, result in results]
+
+    def put_blocks(self, file_id, start, blocks):
+        file_id = uuid.UUID(str(file_id))
+        rows_per_batch = max(1, self.MAX_BATCH_BYTES // max(1, len(blocks[0]))) if blocks else 1
+
+        # Un lot ne regroupe que des lignes d'une même partition (pas de coordination entre nœuds)
+        statements = []
+        batch, batch_bucket = None, None
+        for n, block in enumerate(blocks):
+            index = start + n
+            bucket = index // self.BUCKET_BLOCKS
+            if batch is None or bucket != batch_bucket or len(batch) >= rows_per_batch:
+                batch, batch_bucket = BatchStatement(batch_type=BatchType.UNLOGGED), bucket
+                statements.append((batch, ()))
+            batch.add(self._insert_block, (file_id, bucket, index, block))
+        self._execute_all(statements)
+
+    def _range_queries(self, file_id, start, count):
+        file_id = uuid.UUID(str(file_id))
+        queries = []
+        index, end = start, start + count
+        while index < end:
+            bucket = index // self.BUCKET_BLOCKS
+            bucket_end = min(end, (bucket + 1) * self.BUCKET_BLOCKS)
+            queries.append((self._select_blocks, (file_id, bucket, index, bucket_end)))
+            index = bucket_end
+        return queries
+
+    def get_blocks(self, file_id, start, count):
+        return self.read_ranges(file_id, [(start, count)])[0]
+
+    def read_ranges(self, file_id, ranges):
+        queries, owners = [], []
+        for n, (start, count) in enumerate(ranges):
+            for query in self._range_queries(file_id, start, count):
+                queries.append(query)
+                owners.append(n)
+        blocks = [[] for _ in ranges]
+        for owner, rows in zip(owners, self._execute_all(queries)):
+            blocks[owner].extend(row.data for row in rows)
+        for (start, count), result in zip(ranges, blocks):
+            if len(result) != count:
+                raise IndexError(f"{file_id} : blocs {start} à {start + count - 1} absents.")
+        return blocks
+
+    def put_super_blocks(self, file_id, blocks):
+        file_id = uuid.UUID(str(file_id))
+        self.session.execute(self._delete_super_blocks, (file_id,))
+        self._execute_all([(self._insert_super_block, (file_id, n, block)) for n, block in enumerate(blocks)])
+
+    def get_super_blocks(self, file_id):
+        return [row.data for row in self.session.execute(self._select_super_blocks, (uuid.UUID(str(file_id)),))]
+
+    def put_metadata(self, file_id, meta):
+        self.session.execute(self._insert_metadata, (uuid.UUID(str(file_id)), encode_metadata(meta)))
+
+    def get_metadata(self, file_id):
+        row = self.session.execute(self._select_metadata, (uuid.UUID(str(file_id)),)).one()
+        if row is None:
+            raise KeyError(file_id)
+        return decode_metadata(row.metadata)
+
+    def close(self):
+        if self._cluster is not None:
+            self._cluster.shutdown()
+            self._cluster = None
+
+def open_store(url):
+    """
+    Stockage désigné par url : sqlite://<fichier>, cassandra://<hôte>[,<hôte>...][:port]/<keyspace>,
+    sinon un dossier (file://<dossier> ou chemin) pour LocalStore.
+    """
+    if url.startswith("sqlite://"):
+        return SQLiteStore(url[len("sqlite://"):])
+    if url.startswith("cassandra://"):
+        hosts, _, keyspace = url[len("cassandra://"):].partition("/")
+        port = 9042
+        if ":" in hosts:
+            hosts, port = hosts.rsplit(":", 1)
+        return CassandraStore(hosts.split(","), keyspace or "data_keyspace", int(port))
+    if url.startswith("file://"):
+        url = url[len("file://"):]
+    return LocalStore(url)
+
+class StoreBlockWriter:
+    """
+    Écrit les blocs d'un fichier dans un BlockStore en flux, par lots de
+    batch_size octets, avec la même interface que les écrivains de
+    block_container (voir encrypt_knob). Les super blocs sont écrits à la
+    fermeture ; les métadonnées (record) restent à écrire par l'appelant, en
+    dernier.
+    """
+
+    def __init__(self, store, file_id, block_size, iv, flags=0, batch_size=BATCH_SIZE):
+        self.store = store
+        self.file_id = file_id
+        self.block_size = block_size
+        self.iv = iv
+        self.flags = flags
+        self.batch_blocks = max(1, batch_size // block_size)
+        self.num_blocks = 0
+        self._batch = []
+        self._super_blocks = []
+
+    def _flush(self):
+        if self._batch:
+            self.store.put_blocks(self.file_id, self.num_blocks, self._batch)
+            self.num_blocks += len(self._batch)
+            self._batch = []
+
+    def write_block(self, block):
+        self._batch.append(bytes(block))
+        if len(self._batch) >= self.batch_blocks:
+            self._flush()
+
+    def write_super_block(self, block):
+        self._super_blocks.append(bytes(block))
+
+    def close(self):
+        self._flush()
+        self.store.put_super_blocks(self.file_id, self._super_blocks)
+
+    def record(self, meta):
+        """Métadonnées à enregistrer avec le fichier (lues par StoreBlockSource)."""
+        return dict(meta, iv=self.iv, block_size=self.block_size, flags=self.flags,
+                    num_regular_blocks=self.num_blocks, num_super_blocks=len(self._super_blocks))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def store_knob(store, path, meta, file_id=None, batch_size=BATCH_SIZE):
+    """Copie les blocs du dossier KNOB path dans store, par lots, puis les métadonnées. Renvoie le file_id."""
+    file_id = str(file_id or uuid.uuid4())
+    with open_block_source(path) as source:
+        writer = StoreBlockWriter(store, file_id, source.block_size, source.iv, source.flags, batch_size)
+        with writer:
+            for j in range(source.num_blocks):
+                writer.write_block(source.block(j))
+            for j in range(source.num_super_blocks):
+                writer.write_super_block(source.super_block(j))
+    record = writer.record(meta)
+    tag = read_group_key_tag(path)
+    if tag is not None:
+        record["gk_tag"] = tag
+    store.put_metadata(file_id, record)
+    return file_id
+
+class StoreBlockSource:
+    """
+    Blocs d'un fichier d'un BlockStore, avec la même interface que les sources
+    de block_container (pour decrypt_to_file et KnobReader). Les blocs sont
+    lus par fenêtres de READ_SIZE octets, plusieurs fenêtres en parallèle.
+    """
+
+    def __init__(self, store, file_id, close_store=False):
+        self.store = store
+        self.file_id = file_id
+        self.close_store = close_store
+        self.meta = store.get_metadata(file_id)
+        self.iv = self.meta["iv"]
+        self.block_size = self.meta["block_size"]
+        self.num_blocks = self.meta["num_regular_blocks"]
+        self.num_super_blocks = self.meta["num_super_blocks"]
+        self.flags = self.meta.get("flags", 0)
+        self.window_blocks = max(1, READ_SIZE // self.block_size)
+        self._super_blocks = None
+        self._window_start = None
+        self._window = []
+
+    def block(self, j):
+        if not 0 <= j < self.num_blocks:
+            raise IndexError(j)
+        if self._window_start is None or not self._window_start <= j < self._window_start + len(self._window):
+            # Lecture séquentielle (récupération de FK) : plusieurs fenêtres d'avance d'un coup
+            start = j - j % self.window_blocks
+            ranges = []
+            for n in range(start, min(self.num_blocks, start + READ_WORKERS * self.window_blocks), self.window_blocks):
+                ranges.append((n, min(self.window_blocks, self.num_blocks - n)))
+            self._window_start = start
+            self._window = [block for blocks in self.store.read_ranges(self.file_id, ranges) for block in blocks]
+        return self._window[j - self._window_start]
+
+    def super_block(self, j):
+        if self._super_blocks is None:
+            self._super_blocks = self.store.get_super_blocks(self.file_id)
+        return self._super_blocks[j]
+
+    def read_blocks(self, j, count, buffer):
+        """Lit les blocs j à j + count - 1 dans buffer, par fenêtres lues en parallèle."""
+        if count < 0 or not 0 <= j <= j + count <= self.num_blocks:
+            raise IndexError(j)
+        view = memoryview(buffer)[:count * self.block_size]
+        ranges = [(n, min(self.window_blocks, j + count - n)) for n in range(j, j + count, self.window_blocks)]
+        offset = 0
+        for blocks in self.store.read_ranges(self.file_id, ranges):
+            for block in blocks:
+                view[offset:offset + self.block_size] = block
+                offset += self.block_size
+        return view
+
+    def close(self):
+        self._window = []
+        self._super_blocks = None
+        if self.close_store:
+            self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def bench(url, num_blocks, block_size):
+    """Écriture bloc par bloc puis par lots dans le stockage url, et relecture."""
+    blocks = [os.urandom(block_size) for _ in range(num_blocks)]
+    batch_blocks = max(1, BATCH_SIZE // block_size)
+    with open_store(url) as store:
+        results = {}
+        for name, per_call in (("bloc par bloc", 1), ("par lots", batch_blocks)):
+            file_id = str(uuid.uuid4())
+            store.put_metadata(file_id, {"block_size": block_size})
+            start_time = time.perf_counter()
+            for j in range(0, num_blocks, per_call):
+                store.put_blocks(file_id, j, blocks[j:j + per_call])
+            results[name] = time.perf_counter() - start_time
+
+        ranges = [(j, min(batch_blocks, num_blocks - j)) for j in range(0, num_blocks, batch_blocks)]
+        start_time = time.perf_counter()
+        read = [block for chunk in store.read_ranges(file_id, ranges) for block in chunk]
+        results["lecture"] = time.perf_counter() - start_time
+        if read != blocks:
+            raise ValueError("Blocs relus différents des blocs écrits.")
+
+    size_mb = num_blocks * block_size / (1024 * 1024)
+    for name, elapsed in results.items():
+        print(f"  {name:<14} {elapsed:8.3f} s  {num_blocks / elapsed:>10.0f} blocs/s  {size_mb / elapsed:8.1f} Mo/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Débit d'écriture et de lecture d'un stockage de blocs KNOB.")
+    parser.add_argument("store", nargs="?", help="sqlite://<fichier>, cassandra://<hôtes>/<keyspace> ou dossier "
+                                                 "(par défaut, une base SQLite temporaire)")
+    parser.add_argument("--blocks", type=int, default=20000)
+    parser.add_argument("--block-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    workdir = None
+    url = args.store
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="knob-store-")
+        url = "sqlite://" + os.path.join(workdir, "blocks.db")
+
+    try:
+        print(f"{args.blocks} blocs de {args.block_size} octets → {url}")
+        bench(url, args.blocks, args.block_size)
+    except (ImportError, ValueError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
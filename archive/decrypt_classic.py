@@ -1,51 +1,65 @@
+import argparse
+import mmap
 import os
 import sys
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
+from parallel_decryption import decrypt_cbc_sharded, decrypt_file_sharded
 import time
 
 # Constantes
 BLOCK_SIZE = 1024  # Taille de lecture
 KEY_SIZE = 32      # Clé AES-256
 
-def decrypt_classic(input_file, output_file, key):
-    """Déchiffre un fichier chiffré en AES-256-CBC (mode classique)."""
+def decrypt_classic(input_file, output_file, key, workers=1, processes=False):
+    """Déchiffre un fichier chiffré en AES-256-CBC (mode classique), en tranches parallèles si workers > 1."""
     
     start_time = time.time()  # Chrono début
 
-    with open(input_file, 'rb') as infile, open(output_file, 'wb') as outfile:
+    with open(input_file, 'rb') as infile, open(output_file, 'w+b') as outfile:
         iv = infile.read(16)  # Récupération de l'IV
+        size = os.fstat(infile.fileno()).st_size - 16
 
-        cipher = AES.new(key, AES.MODE_CBC, iv)
+        if size > 0:
+            # Déchiffrement direct du fichier projeté en mémoire vers la sortie
+            # préallouée : aucun objet intermédiaire par bloc
+            outfile.truncate(size)
+            if processes:
+                outfile.flush()
+                decrypt_file_sharded(key, iv, input_file, 16, output_file, 0, size, workers)
 
-        while True:
-            block = infile.read(BLOCK_SIZE)
-            if len(block) == 0:
-                break
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as src, mmap.mmap(outfile.fileno(), size) as dst:
+                if not processes:
+                    src_view, dst_view = memoryview(src), memoryview(dst)
+                    try:
+                        decrypt_cbc_sharded(key, iv, src_view[16:], dst_view, workers)
+                    finally:
+                        src_view.release()
+                        dst_view.release()
+                last_block = dst[size - AES.block_size:size]
 
-            decrypted_block = cipher.decrypt(block)
-
-            if len(block) < BLOCK_SIZE:  # Dernier bloc → retirer le padding
-                decrypted_block = unpad(decrypted_block, AES.block_size)
-
-            outfile.write(decrypted_block)
+            if size % BLOCK_SIZE:  # Dernier bloc incomplet → retirer le padding
+                outfile.truncate(size - AES.block_size + len(unpad(last_block, AES.block_size)))
 
     end_time = time.time()
     print(f"Déchiffrement classique terminé en {end_time - start_time:.4f} secondes.")
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python decrypt_classic.py <input_file> <output_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Déchiffrement classique AES-256-CBC.")
+    parser.add_argument("input_file", help="Fichier chiffré")
+    parser.add_argument("output_file", help="Fichier de sortie")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de tranches déchiffrées en parallèle")
+    parser.add_argument("--processes", action="store_true", help="Utiliser un pool de processus plutôt que de threads")
+    args = parser.parse_args()
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    input_file = args.input_file
+    output_file = args.output_file
 
     # Charger la clé AES-256 depuis le fichier
     with open("classic_key.bin", "rb") as key_file:
         key = key_file.read()
     
-    decrypt_classic(input_file, output_file, key)
+    decrypt_classic(input_file, output_file, key, args.workers, args.processes)
 
 if __name__ == "__main__":
     main()
@@ -1,71 +1,35 @@
 import os
 import sys
 import argparse
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
+from mixslice_engine import decrypt_file, read_sidecar
 
 # Constantes
 BLOCK_SIZE = 1024
 MACRO_BLOCK_SIZE = 4096
 MINI_BLOCK_SIZE = 64
 
-def decrypt_mixslice(input_file, output_file, old_key, new_key=None):
-    with open(input_file, "rb") as f:
-        file_data = f.read()
-
-    iv = file_data[:16]
-    encrypted_data = file_data[16:]
-    decrypted_data = bytearray()
-
-    num_macro_blocks = len(encrypted_data) // MACRO_BLOCK_SIZE
-
-    for macro_index in range(num_macro_blocks):
-        macro_offset = macro_index * MACRO_BLOCK_SIZE
-        macro_block = encrypted_data[macro_offset:macro_offset + MACRO_BLOCK_SIZE]
-
-        cipher_old = AES.new(old_key, AES.MODE_CBC, iv)
-        try:
-            decrypted_macro = cipher_old.decrypt(macro_block)
-            decrypted_data += decrypted_macro
-            continue
-        except:
-            pass  # Essai avec nouvelle clé (si fournie)
-
-        if new_key is None:
-            print(f" Échec : Bloc modifié détecté à l’index {macro_index}. Accès refusé (clé manquante).")
-            sys.exit(1)
-
-        # Tentative de récupération avec nouvelle clé
-        decrypted_macro = bytearray(cipher_old.decrypt(macro_block))
-        found = False
-        for i in range(0, MACRO_BLOCK_SIZE, MINI_BLOCK_SIZE):
-            mini_block = macro_block[i:i + MINI_BLOCK_SIZE]
-            cipher_new = AES.new(new_key, AES.MODE_CBC, iv)
-            try:
-                decrypted_mini = cipher_new.decrypt(mini_block)
-                unpad(decrypted_mini, MINI_BLOCK_SIZE)
-                decrypted_macro[i:i + MINI_BLOCK_SIZE] = decrypted_mini
-                found = True
-                print(f" Mini-bloc modifié récupéré à l’offset {macro_offset + i}")
-                break
-            except:
-                continue
-
-        if not found:
-            print(f" Échec : Bloc modifié mais non récupérable même avec la nouvelle clé.")
-            sys.exit(1)
-
-        decrypted_data += decrypted_macro
-
-    # Tentative de suppression du padding global
+def decrypt_mixslice(input_file, output_file, old_key, new_key=None, workers=1):
+    """
+    Déchiffre un fichier Mix&Slice. Les mini-blocs révoqués sont connus par
+    l'annexe <input_file>.mixslice : aucune clé n'est essayée à l'aveugle.
+    """
+    layer_keys = [new_key] if new_key is not None else []
     try:
-        decrypted_data = unpad(decrypted_data, AES.block_size)
-    except:
-        pass
-
-    with open(output_file, "wb") as f:
-        f.write(decrypted_data)
-
+        decrypt_file(input_file, output_file, old_key, layer_keys, workers)
+    except KeyError as e:
+        if new_key is None:
+            print(f" Échec : {e.args[0]} Accès refusé (clé manquante).")
+        else:
+            print(f" Échec : {e.args[0]} Bloc modifié mais non récupérable avec la nouvelle clé.")
+        sys.exit(1)
+    except ValueError as e:
+        print(f" Échec : {e}")
+        sys.exit(1)
+
+    batches, _, _ = read_sidecar(input_file)
+    revoked = sum(len(records) for records in batches)
+    if revoked:
+        print(f" {revoked} mini-blocs révoqués récupérés avec la nouvelle clé")
     print(f" Déchiffrement terminé avec succès → {output_file}")
 
 def main():
@@ -73,6 +37,7 @@ def main():
     parser.add_argument("input_file", help="Fichier chiffré (e.g. test_reencrypted.bin)")
     parser.add_argument("output_file", help="Fichier de sortie (e.g. test_decrypted.txt)")
     parser.add_argument("--with-new-key", action="store_true", help="Utiliser mixslice_new_key.bin pour récupérer les mini-blocs modifiés")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de tranches déchiffrées en parallèle")
 
     args = parser.parse_args()
 
@@ -88,7 +53,7 @@ def main():
             print(" Impossible de charger mixslice_new_key.bin. Le fichier est-il présent ?")
             sys.exit(1)
 
-    decrypt_mixslice(args.input_file, args.output_file, old_key, new_key)
+    decrypt_mixslice(args.input_file, args.output_file, old_key, new_key, args.workers)
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,23 @@
-import hashlib
+import argparse
+import mmap
 import os
 import sys
-from xor_metadata import xor_bytes
-from xor_metadata import compute_xor_metadata
-from Crypto.Cipher import PKCS1_OAEP
-from Crypto.PublicKey import RSA
+import tempfile
+from xor_metadata import compute_xor_metadata_batched
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
-
-# Constantes
-BLOCK_SIZE = 1024  # Taille de bloc en octets (1 Ko)
+from knob_padding import unpad_block
+from block_container import open_block_source
+from block_prefetch import PREFETCH, BlockFetcher
+from block_storage import StoreBlockSource, open_store
+from knob_compression import codec_from_flags, decompress_stream
+from knob_modes import ctr_cipher, mode_from_flags
+from knob_merkle import TREE_NAME, MerkleTree, verify_source
+from knob_metadata import MetadataLog, path_id
+from knob_reader import KnobReader
+from knob_unwrap import aes_decrypt, get_sk, get_super_blocks_indices
+from parallel_decryption import crypt_ctr_sharded, decrypt_cbc_sharded
+from knob_keyring import default_keyring
+import instrumentation
 
 def load_files(metaFK_file, metaSK_file, metaIndex_file, metaSGX_file, group_key_file, knob_priv_key_file):
     """Charge les fichiers nécessaires pour le déchiffrement."""
@@ -26,150 +34,292 @@ def load_files(metaFK_file, metaSK_file, metaIndex_file, metaSGX_file, group_key
     with open(metaSGX_file, "rb") as f_metaSGX:
         metaSGX = f_metaSGX.read()
     
-    with open(group_key_file, "rb") as f_gk:
-        group_key = f_gk.read()
-    
-    with open(knob_priv_key_file, "rb") as f_kpk:
-        knob_priv_key = RSA.import_key(f_kpk.read())
+    # Clés lues une seule fois par processus (trousseau)
+    group_key = default_keyring.group_key(group_key_file)
+    knob_priv_key = default_keyring.rsa_key(knob_priv_key_file)
     
     return metaFK, metaSK, metaIndex, metaSGX, group_key, knob_priv_key
 
-def load_data(path, super_block_indices, N_blocks):
-    """Récupère tous les fichiers du dossier path/blocks et path/super_blocks pour reconstituer les données chiffrées."""
-    if not (os.path.exists("super_blocks") and os.path.exists("blocks")):
-        print("Les dossiers super_blocks et blocks n'existent pas.")
-        sys.exit(1)
-    
-    # Nombre de blocs et de super blocs
-    N_super_blocks = len(super_block_indices)
-
-    # Récupérer les fichiers des super blocs
-    super_blocks = []
-    for i in range(N_super_blocks):
-        file = path + "/super_blocks/" + str(i) + ".bin"
-        with open(file, "rb") as f:
-            super_blocks.append(f.read())
-    
-    data_blocks = []
-    i_block = 0
-    i_super_block = 0
-    for i in range(N_blocks):
-        if i in super_block_indices:
-            data_blocks.append(super_blocks[i_super_block])
-            i_super_block += 1
-        else:
-            file = path + "/blocks/" + str(i_block) + ".bin"
-            with open(file, "rb") as f:
-                data_blocks.append(f.read())
-            i_block += 1
-    
-    # Récupération de l'IV
-    with open(path + "/blocks/iv.bin", "rb") as f:
-        iv = f.read()
-    
-    return iv, data_blocks
+def load_meta(meta, group_key_file, knob_priv_key_file):
+    """Comme load_files, avec des métadonnées déjà lues (journal, stockage de blocs) au lieu de quatre fichiers."""
+    group_key = default_keyring.group_key(group_key_file)
+    knob_priv_key = default_keyring.rsa_key(knob_priv_key_file)
+    return meta["metaFK"], meta["metaSK"], meta["metaIndex"], meta["metaSGX"], group_key, knob_priv_key
 
-def aes_decrypt(encrypted_data, key, iv=None, block_size=AES.block_size, unpadd=True, cipher=None):
-    # Extraire l'IV des premiers 16 octets
-    if (iv is None):
-        iv = encrypted_data[:16]
-        cipher_text = encrypted_data[16:]  # Le reste est le texte chiffré
-    else:
-        cipher_text = encrypted_data
-    
-    # Initialiser le déchiffreur AES en mode CBC
-    if cipher is None:
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-
-    decrypted_data = cipher.decrypt(cipher_text)
-    if unpadd:
-        return unpad(decrypted_data, block_size)
-    return decrypted_data
-
-def divide_into_blocks(data_blocks, N_blocks): 
-    data = [] # Blocs de données chiffrées (sans l'IV)
-    iv = data_blocks[:16] # Extraire l'IV des premiers 16 octets
-    for i in range(N_blocks):
-        start = i * BLOCK_SIZE 
-        end = (i + 1) * BLOCK_SIZE
-        data.append(data_blocks[16+start:end+16])
-    return data, iv
-
-def get_sk(knob_priv_key, metaSGX):
-    """ Utilise RSA pour récupérer SK"""
-    cipher_rsa = PKCS1_OAEP.new(knob_priv_key)  # Déchiffrement avec la clé privée
-    return cipher_rsa.decrypt(metaSGX)
-
-def get_super_blocks_indices(metaIndex, sk):
-    """ Récupère les indices des super blocs"""
-    super_block_indices_str = aes_decrypt(metaIndex, sk).decode('utf-8') # Caractères de 0 et de 1 pour les super blocs
-    N_blocks = 0
-    super_block_indices = []
-    for i in range(len(super_block_indices_str)):
-        N_blocks += 1
-        if super_block_indices_str[i] == '1':
-            print("Super bloc trouvé à l'indice : ", i)
-            super_block_indices.append(i)
-        elif super_block_indices_str[i] != '0':
-            break
-    return super_block_indices, N_blocks
-
-def get_blocks_decrypted(data, super_block_indices, group_key, iv):
-    """ Récupère les blocs déchiffrés """
-    super_blocs = []
-    for i in super_block_indices: # Déchiffrement du super bloc avec GK 
-        super_blocs.append(aes_decrypt(data[i], group_key, iv, BLOCK_SIZE, False))
-
-    return super_blocs
+def load_record(metadata_log, file_id, group_key_file, knob_priv_key_file):
+    """Comme load_files, avec les métadonnées lues dans un journal (knob_metadata)."""
+    with MetadataLog(metadata_log) as log:
+        meta = log.get(file_id)
+    return load_meta(meta, group_key_file, knob_priv_key_file)
 
-def main():
-    # Vérification des arguments
-    if len(sys.argv) < 9:
-        print("Usage: python knob_decrypt.py <path> <meta_FK> <meta_SK> <meta_index> <meta_SGX> <group key> <knob-pri-key> <output_file>")
+def decrypt_blocks_into(fk, iv, source, super_block_indices, super_blocks, N_blocks, out_view, workers=1,
+                        fetcher=None):
+    """
+    Déchiffre avec FK tous les blocs du fichier dans out_view (tampon préalloué).
+    Les blocs ordinaires sont lus par fenêtres (fetcher : lectures anticipées,
+    voir block_prefetch), chaque fenêtre étant déchiffrée dès qu'elle arrive.
+    """
+    if fetcher is None:
+        with BlockFetcher(source) as fetcher:
+            return decrypt_blocks_into(fk, iv, source, super_block_indices, super_blocks, N_blocks, out_view,
+                                       workers, fetcher)
+
+    bs = source.block_size
+    ctr = mode_from_flags(getattr(source, "flags", 0)) == "ctr"
+
+    # Fenêtres de blocs ordinaires (jamais à cheval sur un super bloc), lues
+    # directement à leur place dans out_view
+    windows, positions = [], []
+    i = 0  # Indice dans le fichier
+    j = 0  # Indice du bloc ordinaire
+    for super_index in list(super_block_indices) + [N_blocks]:
+        for j_window, count in fetcher.windows(j, j + super_index - i):
+            windows.append((j_window, count))
+            positions.append(i + j_window - j)
+        j += super_index - i
+        i = super_index + 1
+    reads = fetcher.read_windows(windows, [out_view[p * bs:(p + count) * bs] for p, (_, count) in zip(positions, windows)])
+
+    # En CBC, l'IV d'une fenêtre est le dernier bloc AES chiffré qui la précède ;
+    # en CTR, chaque fenêtre se déchiffre à sa position
+    previous = iv
+    n = 0
+    i = 0
+    for k, super_index in enumerate(list(super_block_indices) + [N_blocks]):
+        while i < super_index:
+            count = windows[n][1]
+            dst = out_view[i * bs:(i + count) * bs]
+            src = next(reads)
+            if ctr:
+                crypt_ctr_sharded(fk, iv, i * bs, src, dst, workers)
+            else:
+                next_previous = bytes(src[-AES.block_size:])  # Copié avant un éventuel déchiffrement en place
+                decrypt_cbc_sharded(fk, previous, src, dst, workers)
+                previous = next_previous
+            i += count
+            n += 1
+        if super_index < N_blocks:
+            dst = out_view[super_index * bs:(super_index + 1) * bs]
+            if ctr:
+                ctr_cipher(fk, iv, super_index * bs).decrypt(super_blocks[k], output=dst)
+            else:
+                AES.new(fk, AES.MODE_CBC, previous).decrypt(super_blocks[k], output=dst)
+                previous = super_blocks[k][-AES.block_size:]
+        i = super_index + 1
+
+def decrypt_to_file(source, super_block_indices, N_blocks, group_key, metaFK, output_file, workers=1,
+                    prefetch=PREFETCH):
+    """
+    Déchiffre les blocs de source directement dans output_file projeté en mémoire.
+    Seul le dernier bloc est traité à part pour retirer le padding. Si les
+    données ont été compressées avant le chiffrement (codec dans les flags de
+    la source), elles sont déchiffrées dans un fichier temporaire puis
+    décompressées en flux dans output_file. Les blocs sont lus en avance, au
+    plus prefetch fenêtres à la fois (voir block_prefetch).
+    """
+    with BlockFetcher(source, depth=prefetch) as fetcher:
+        decrypt_with_fetcher(fetcher, super_block_indices, N_blocks, group_key, metaFK, output_file, workers)
+
+def decrypt_with_fetcher(fetcher, super_block_indices, N_blocks, group_key, metaFK, output_file, workers=1):
+    source = fetcher.source
+    bs = source.block_size
+    iv = source.iv
+    codec = codec_from_flags(getattr(source, "flags", 0))
+
+    # Lectures lancées ensemble : super blocs et premières fenêtres de blocs ordinaires
+    regular_blocks = fetcher.regular_blocks()
+    super_blocks = fetcher.super_blocks()
+
+    # Déchiffrement des super blocs avec GK (les seuls blocs copiés)
+    with instrumentation.stage("gk_decrypt", len(super_block_indices) * bs):
+        super_blocks = [aes_decrypt(block, group_key, iv, bs, False) for block in super_blocks.result()]
+
+    # Inverse de la première AONT pour retrouver FK
+    with instrumentation.stage("fk_recover", N_blocks * bs):
+        fk = compute_xor_metadata_batched(regular_blocks, metaFK, super_blocks)
+
+    if codec == "none":
+        with open(output_file, "w+b") as f:
+            decrypt_into_file(f, fk, iv, source, super_block_indices, super_blocks, N_blocks, workers, fetcher)
+        return
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_file))) as f:
+        decrypt_into_file(f, fk, iv, source, super_block_indices, super_blocks, N_blocks, workers, fetcher)
+        f.seek(0)
+        with instrumentation.stage("decompress"), open(output_file, "wb") as out:
+            written = decompress_stream(f, out, codec)
+        instrumentation.current().add_bytes("decompress", written)
+
+def decrypt_into_file(f, fk, iv, source, super_block_indices, super_blocks, N_blocks, workers=1, fetcher=None):
+    """Déchiffre tous les blocs dans le fichier ouvert f (projeté en mémoire), padding retiré."""
+    bs = source.block_size
+    size = N_blocks * bs
+    f.truncate(size)
+    with mmap.mmap(f.fileno(), size) as out:
+        out_view = memoryview(out)
+        try:
+            with instrumentation.stage("fk_decrypt", size):
+                decrypt_blocks_into(fk, iv, source, super_block_indices, super_blocks, N_blocks, out_view, workers,
+                                    fetcher)
+        finally:
+            out_view.release()
+        last_block = out[size - bs:size]
+
+    # Retrait du padding : il suffit de tronquer le fichier
+    with instrumentation.stage("unpad"):
+        f.truncate(size - bs + len(unpad_block(last_block, bs)))
+
+def run(args):
+    """Déchiffrement complet (ou d'une plage) à partir des arguments de la ligne de commande."""
+    if args.store and args.range and args.merkle_root:
+        # La vérification partielle lit l'arbre de Merkle à côté des blocs : il n'est pas dans le stockage
+        print("Erreur : --range avec --merkle-root demande l'arbre de Merkle du dossier KNOB, absent avec --store "
+              "(sans --range, tous les blocs lus sont vérifiés).")
         sys.exit(1)
 
+    # Avec --store, le fichier et ses métadonnées (store_knob) sont lus dans le stockage
+    source = None
+    if args.store:
+        try:
+            source = StoreBlockSource(open_store(args.store), args.path, close_store=True)
+        except KeyError:
+            print(f"Fichier {args.path} absent de {args.store}.")
+            sys.exit(1)
+        except (OSError, ValueError, ImportError) as e:
+            print(e)
+            sys.exit(1)
+
     # Initialisation des fichiers
-    metaFK, metaSK, metaIndex, metaSGX, group_key, knob_priv_key = load_files(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6], sys.argv[7])
+    if args.metadata:
+        file_id = args.path if args.store else path_id(args.path)
+        try:
+            metaFK, metaSK, metaIndex, metaSGX, group_key, knob_priv_key = load_record(args.metadata, file_id, args.group_key, args.knob_pri_key)
+        except KeyError:
+            print(f"Fichier {file_id} absent du journal {args.metadata}.")
+            sys.exit(1)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+    elif source is not None:
+        metaFK, metaSK, metaIndex, metaSGX, group_key, knob_priv_key = load_meta(source.meta, args.group_key, args.knob_pri_key)
+    else:
+        metaFK, metaSK, metaIndex, metaSGX, group_key, knob_priv_key = load_files(args.meta_FK, args.meta_SK, args.meta_index, args.meta_SGX, args.group_key, args.knob_pri_key)
     
     # Inverse de la deuxième AONT pour retrouver SK 
-    sk = get_sk(knob_priv_key, metaSGX)
+    with instrumentation.stage("rsa_unwrap"):
+        sk = get_sk(knob_priv_key, metaSGX)
     
     # TODO : Vérification de meta_SK
     
     # Déduction des indices des super blocs
-    super_block_indices, N_blocks = get_super_blocks_indices(metaIndex, sk)
+    with instrumentation.stage("index_decrypt"):
+        super_block_indices, N_blocks = get_super_blocks_indices(metaIndex, sk)
 
-    # TODO : optimiser tout ça 
-    iv, data = load_data(sys.argv[1], super_block_indices, N_blocks)
+    if source is None:
+        try:
+            source = open_block_source(args.path)
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+            sys.exit(1)
 
-    # Segmentation des blocs à partir des données chiffrées
-    #data, iv = divide_into_blocks(data_blocks, N_blocks)
-    
-    # Reconstruction des blocs complètement déchiffrés
-    superBlocs = get_blocks_decrypted(data, super_block_indices, group_key, iv)
-    for i in range(len(superBlocs)):
-        data[super_block_indices[i]] = superBlocs[i]
+    merkle_root = None
+    if args.merkle_root:
+        with open(args.merkle_root, "rb") as f:
+            merkle_root = f.read()
 
-    # Inverse de la première AONT pour retrouver FK
-    fk = metaFK
-    for i in range(len(data)):
-        fk = xor_bytes(hashlib.sha256(data[i]).digest(), fk)
-    
-    # Déchiffrement des blocs avec FK et écriture sur le fichier de sortie 
-    
-    # Ecriture du fichier de sortie
-    with open(sys.argv[8], "wb") as f:
-        cipher = AES.new(fk, AES.MODE_CBC, iv)
-        
-        for i in range(len(data)):
-            if i < len(data) - 1: # TODO : Gérer le cas où le dernier bloc est de bonne taille BLOCK_SIZE
-                temp = aes_decrypt(data[i], fk, iv, BLOCK_SIZE, False, cipher)
-            else: 
-                temp = aes_decrypt(data[i], fk, iv, BLOCK_SIZE, True, cipher)
-
-            f.write(temp)
+    if args.range:
+        # Lecture partielle : seuls les blocs couvrant la plage sont déchiffrés
+        # (et vérifiés avec l'arbre de Merkle stocké à côté des blocs)
+        with source:
+            merkle = None
+            if merkle_root:
+                try:
+                    merkle = (MerkleTree(os.path.join(args.path, TREE_NAME)), merkle_root)
+                except (FileNotFoundError, ValueError) as e:
+                    print(f"Arbre de Merkle illisible : {e}")
+                    sys.exit(1)
+            try:
+                reader = KnobReader(source, metaFK, super_block_indices, N_blocks, group_key, merkle)
+                data = reader.decrypt_range(*args.range)
+            except ValueError as e:
+                print(f"Erreur : {e}")
+                sys.exit(1)
+            finally:
+                if merkle:
+                    merkle[0].close()
+            if args.output_file == "-":
+                sys.stdout.buffer.write(data)
+                return
+            with open(args.output_file, "wb") as f:
+                f.write(data)
+        print("Plage déchiffrée avec succès -> ", args.output_file)
+        return
+
+    # Déchiffrement des super blocs avec GK, récupération de FK et déchiffrement
+    # des blocs avec FK directement dans le fichier de sortie
+    with source:
+        if merkle_root:
+            # Vérification complète : la racine est recalculée en flux, l'arbre n'est pas lu
+            with instrumentation.stage("merkle_verify", N_blocks * source.block_size):
+                valid = verify_source(source, merkle_root)
+            if not valid:
+                print("Erreur : blocs altérés (la racine de Merkle ne correspond pas).")
+                sys.exit(1)
+        if args.output_file == "-":
+            stream_to_stdout(source, super_block_indices, N_blocks, group_key, metaFK, args.path)
+            return
+        decrypt_to_file(source, super_block_indices, N_blocks, group_key, metaFK, args.output_file, args.workers,
+                        args.prefetch)
     
-    print("Fichier déchiffré avec succès -> ", sys.argv[8])
+    print("Fichier déchiffré avec succès -> ", args.output_file)
+
+def stream_to_stdout(source, super_block_indices, N_blocks, group_key, metaFK, file_id):
+    """Envoie le fichier déchiffré sur la sortie standard au fur et à mesure (voir knob_stream)."""
+    from knob_stream import decrypt_stream
+    out = sys.stdout.buffer
+    try:
+        for chunk in decrypt_stream(source, super_block_indices, N_blocks, group_key, metaFK, file_id):
+            out.write(chunk)
+        out.flush()
+    except ValueError as e:
+        print(f"Erreur : {e}", file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        # Lecteur arrêté avant la fin (head...) : pas de trace d'erreur à la fermeture
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+def main():
+    # Avec --metadata (journal) ou --store (stockage de blocs), les quatre fichiers meta_* ne sont pas demandés
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--metadata")
+    pre_parser.add_argument("--store")
+    known = pre_parser.parse_known_args()[0]
+    with_meta_files = known.metadata is None and known.store is None
+
+    parser = argparse.ArgumentParser(description="Déchiffrement KNOB d'un fichier.")
+    parser.add_argument("path", help="Dossier contenant les blocs (file_id avec --store)")
+    if with_meta_files:
+        parser.add_argument("meta_FK")
+        parser.add_argument("meta_SK")
+        parser.add_argument("meta_index")
+        parser.add_argument("meta_SGX")
+    parser.add_argument("group_key", help="Fichier contenant la clé de groupe GK")
+    parser.add_argument("knob_pri_key", help="Clé privée RSA knob-pri-key")
+    parser.add_argument("output_file", help="Fichier de sortie ('-' : sortie standard, en flux)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Nombre de threads de déchiffrement")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH,
+                        help="Fenêtres de blocs lues en avance pendant le déchiffrement (stockage distant)")
+    parser.add_argument("--range", nargs=2, type=int, metavar=("OFFSET", "LENGTH"),
+                        help="Ne déchiffrer que LENGTH octets à partir de OFFSET")
+    parser.add_argument("--merkle-root", help="Racine de Merkle (metaMerkle.bin) : vérifier les blocs lus avant de les déchiffrer")
+    parser.add_argument("--metadata", help="Journal de métadonnées (knob_metadata.py) : remplace les arguments meta_FK à meta_SGX")
+    parser.add_argument("--store", help="Lire les blocs et les métadonnées du file_id path dans ce stockage (sqlite://..., cassandra://..., dossier) : remplace les arguments meta_FK à meta_SGX")
+    args = parser.parse_args()
+
+    # Mesures par étape si KNOB_INSTRUMENT est défini (voir instrumentation.py)
+    with instrumentation.instrument("decrypt"):
+        run(args)
 
 # Point d'entrée du programme
 if __name__ == "__main__":
@@ -1,30 +1,48 @@
+import argparse
 import os
 import sys
-import random
-from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.PublicKey import RSA
+import tempfile
+import uuid
+from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
-from xor_metadata import compute_xor_metadata
 from Crypto.Util.Padding import pad
+from knob_tuning import ROTATION_BUDGET, tune
+from streaming_encryption import StreamingEncryptor
+from superblock_index import encode_index
+from block_container import (CONTAINER_NAME, BlockContainerWriter, BlockDirectoryWriter, iter_file_order,
+                             group_key_tag, open_block_source, write_group_key_tag)
+from upload_client import UploadClient
+from block_storage import StoreBlockWriter, open_store
+from knob_keyring import default_keyring
+from knob_compression import codec_flags, compress_stream, resolve_codec
+from knob_modes import mode_flags, resolve_mode
+from knob_merkle import BUILD_NODES, HASH_SIZE, TREE_NAME, MerkleTree, leaf_hash
+from knob_metadata import MetadataLog, path_id
+import instrumentation
 
 import requests
 
 API_URL = "http://api-server-address"
 API_KEY = "1234567890abcdef"
 
-def send_to_api(endpoint, data):
-    """Envoie les fichiers et métadonnées vers l'API REST."""
-    headers = {"X-API-KEY": API_KEY}
-    response = requests.post(f"{API_URL}{endpoint}", headers=headers, files=data)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Erreur lors de l'envoi des données à {endpoint}: {response.text}")
-        sys.exit(1)
+def knob_chunks(path, meta):
+    """
+    Fabrique de morceaux pour UploadClient : les blocs stockés dans path, dans
+    l'ordre du fichier, lus en flux depuis le conteneur.
+    """
+    def chunks():
+        with open_block_source(path) as source:
+            yield from iter_file_order(source, meta["super_block_indices"], meta["num_blocks"])
+    return chunks
+
+def upload_knob(client, path, meta):
+    """Envoie les blocs stockés dans path puis les métadonnées. Renvoie le file_id."""
+    file_id = client.upload(knob_chunks(path, meta))
+    client.store_metadata(file_id, meta)
+    return file_id
 
 
 # Constantes
-BLOCK_SIZE = 1024  # Taille de bloc en octets (1 Ko)
 KEY_SIZE = 32      # Taille de clé (256 bits)
 
 # Clé FK statique
@@ -38,239 +56,257 @@ def initialize_file_key():
     if file_key is None:
         file_key = get_random_bytes(KEY_SIZE)
 
-def encrypt_file(input_file, output_file):
-    """Chiffre un fichier avec AES-256 en mode CBC."""
-    # Générer un vecteur d'initialisation (IV) de 16 octets
-    iv = get_random_bytes(16)
-
-    # Ouvrir les fichiers d'entrée et de sortie
-    with open(input_file, 'rb') as infile, open(output_file, 'wb') as outfile:
-        # Écrire le vecteur d'initialisation au début du fichier de sortie
-        outfile.write(iv)
-        
-        # Initialiser le chiffrement
-        cipher = AES.new(file_key, AES.MODE_CBC, iv)
-
-        # Lire et chiffrer les données par blocs
-        while True:
-            block = infile.read(BLOCK_SIZE)
-            if len(block) == 0:
-                break
-
-            if len(block) < BLOCK_SIZE:  # Dernier bloc -> on ajoute du padding
-                block = pad(block, BLOCK_SIZE)
-            
-            encrypted_block = cipher.encrypt(block)
-            outfile.write(encrypted_block)
-
-def divide_into_blocks(ciphertext_file):
-    """Divise le fichier chiffré en blocs de taille fixe."""
-    blocks = []
-    
-    with open(ciphertext_file, 'rb') as infile:
-        iv = infile.read(16)
-        
-        while True:
-            block = infile.read(BLOCK_SIZE)
-            if not block:
-                break
-            blocks.append(block)
-
-    return iv, blocks
-
-def identify_super_blocks(blocks, num_super_blocks):
-    """Sélectionne un nombre donné de super blocs de manière plus aléatoire."""
-    num_blocks = len(blocks)
-    
-    if num_super_blocks > num_blocks:
-        print(f"Erreur : Impossible de sélectionner {num_super_blocks} super blocs parmi {num_blocks} blocs.")
-        sys.exit(1)
-
-    # Générer tous les indices des blocs
-    indices = list(range(num_blocks))
-    
-    # Mélanger les indices
-    random.shuffle(indices)
-    
-    # Sélectionner les premiers `num_super_blocks` après mélange
-    return indices[:num_super_blocks]
-
-def encrypt_super_blocks(super_blocks, key, iv):
-    """Chiffre les super blocs sélectionnés avec AES-256-CBC."""
-    encrypted_super_blocks = []
-
-    for block in super_blocks:
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        if len(block) < BLOCK_SIZE:
-            padded = pad(block, BLOCK_SIZE)
-        else: 
-            padded = block
-        encrypted_block = cipher.encrypt(padded)
-        encrypted_super_blocks.append(encrypted_block)
-
-    return encrypted_super_blocks
-
-def adaptation_indices(num_blocks, super_block_indices) :
-    indices = ['0'] * num_blocks
-    for i in super_block_indices :
-        indices[i] = '1'
-    return indices
-
 def encrypt_superblock_index(indices, key):
-    indices_bytes = indices.encode()
+    indices_bytes = indices.encode() if isinstance(indices, str) else indices
 
     iv = get_random_bytes(16)  # IV unique pour chaque super bloc
     cipher = AES.new(key, AES.MODE_CBC, iv)
 
-    # Padding standard PKCS7
-    if len(indices_bytes) < AES.block_size:
-        padded_indices = pad(indices_bytes, AES.block_size)  
-    else: 
-        padded_indices = indices_bytes
+    # Padding standard PKCS7 (toujours appliqué : CBC exige un multiple de 16 octets)
+    padded_indices = pad(indices_bytes, AES.block_size)
 
     encrypted_index = cipher.encrypt(padded_indices)
 
     return iv + encrypted_index
 
-def remplace_super_block_file(file, indices, super_blocks, N_blocks):
-    """ Remplace les super blocs dans le fichier par les nouveaux super blocs """
-    with open(file, 'rb+') as f:
-        data = f.read()
-        new_data = data[:16] # On garde l'IV
-        for i in range(N_blocks):
-            if i in indices:
-                new_data += super_blocks[indices.index(i)]
-            else:
-                new_data += data[16 + i * BLOCK_SIZE : 16 + (i + 1) * BLOCK_SIZE]
-
-        # remplace les données dans le fichier
-        f.seek(0)
-        f.write(new_data)
+def compress_input(input_file, path, codec, level=None):
+    """
+    Compresse input_file dans un fichier temporaire (anonyme) de path.
+    Renvoie (fichier ouvert au début, taille), ou (None, taille d'origine) si
+    les données ne gagnent rien à être compressées.
+    """
+    size = os.path.getsize(input_file)
+    spool = tempfile.TemporaryFile(dir=path)
+    with instrumentation.stage("compress", size), open(input_file, "rb") as infile:
+        _, written = compress_stream(infile, spool, codec, level)
+    if written >= size:
+        spool.close()
+        return None, size
+    spool.seek(0)
+    return spool, written
+
+def encrypt_knob(input_file, path, gk_key, knob_pub_key, fk, legacy_dirs=False, output_file=None,
+                 block_size=None, num_super_blocks=None, rotation_budget=ROTATION_BUDGET,
+                 compression=None, compression_level=None, mode=None, workers=None, merkle=False, epoch=None,
+                 store=None, file_id=None):
+    """
+    Chiffre input_file avec KNOB : les blocs sont écrits dans path, et dans
+    output_file (dans l'ordre du fichier) s'il est donné. Renvoie les métadonnées.
+
+    La taille de bloc et le nombre de super blocs non donnés sont choisis
+    d'après la taille du fichier et le budget de rotation (voir knob_tuning).
+    Avec compression (zlib, zstd, lz4 ou auto), les données sont compressées
+    avant le chiffrement, sauf si elles n'y gagnent rien. Avec mode="ctr", la
+    couche FK est chiffrée en AES-CTR sur workers threads (voir knob_modes).
+    Avec merkle, l'arbre de Merkle des blocs stockés est écrit dans path et sa
+    racine ajoutée aux métadonnées (voir knob_merkle). Avec epoch (Epoch ou
+    EpochWrapper de knob_epoch), SK est chiffrée avec la clé d'époque au lieu
+    d'un RSA-OAEP par fichier. Avec store (BlockStore de block_storage), les
+    blocs sont écrits par lots directement dans store sous file_id, puis les
+    métadonnées ; path ne reçoit que les fichiers temporaires (et l'arbre).
+    """
+    os.makedirs(path, exist_ok=True)
+    codec = resolve_codec(compression)
+    mode = resolve_mode(mode)
+    spool = None
+    size = os.path.getsize(input_file)
+    if codec != "none":
+        spool, size = compress_input(input_file, path, codec, compression_level)
+        if spool is None:
+            codec = "none"
+
+    block_size, num_super_blocks, num_blocks = tune(size, block_size, num_super_blocks, rotation_budget)
+
+    # Étapes 1 à 4 et 6 en une seule passe : chiffrement avec FK, formation de
+    # metaFK, identification des super blocs et chiffrement avec GK
+    encryptor = StreamingEncryptor(fk, gk_key, num_blocks, num_super_blocks, block_size, mode=mode, workers=workers)
+    flags = codec_flags(codec) | mode_flags(mode)
+
+    # Sauvegarde des blocs et des super blocs dans le conteneur (ou un fichier par bloc, ou le stockage)
+    if store is not None:
+        writer = StoreBlockWriter(store, file_id, block_size, encryptor.iv, flags)
+    elif legacy_dirs:
+        writer = BlockDirectoryWriter(path, encryptor.iv, flags)
+    else:
+        writer = BlockContainerWriter(os.path.join(path, CONTAINER_NAME), block_size, encryptor.iv, flags)
+
+    outfile = open(output_file, "wb") if output_file else None
+    # Feuilles dans l'ordre de stockage : blocs ordinaires, puis super blocs
+    tree = MerkleTree.create(os.path.join(path, TREE_NAME), num_blocks) if merkle else None
+    num_regular = num_blocks - num_super_blocks
+    leaves = bytearray()
+    position = 0
+    try:
+        with spool or open(input_file, "rb") as infile, writer:
+            for i, block, is_super in encryptor.encrypt(infile):
+                with instrumentation.stage("write", len(block)):
+                    if is_super:
+                        writer.write_super_block(block)
+                    else:
+                        writer.write_block(block)
+                    if outfile:
+                        outfile.write(block)
+                if tree:
+                    with instrumentation.stage("merkle", len(block)):
+                        if is_super:
+                            tree.set_leaf(num_regular + len(encryptor.super_block_indices) - 1, block)
+                        else:
+                            leaves += leaf_hash(block)
+                            if len(leaves) >= BUILD_NODES * HASH_SIZE:
+                                tree.set_leaf_hashes(position, leaves)
+                                position += len(leaves) // HASH_SIZE
+                                leaves.clear()
+        if tree:
+            with instrumentation.stage("merkle"):
+                tree.set_leaf_hashes(position, leaves)
+                merkle_root = tree.build()
+    finally:
+        if outfile:
+            outfile.close()
+        if tree:
+            tree.close()
+    # Empreinte de GK : la rotation vérifie l'ancienne clé avant de réécrire les super blocs
+    if store is None:
+        write_group_key_tag(path, gk_key)
+
+    # Étape 5 : Chiffrement AES des indices des superblocs (index compact)
+    with instrumentation.stage("index_encrypt"):
+        se_index = encode_index(num_blocks, encryptor.super_block_indices)
+
+        sk_key = get_random_bytes(KEY_SIZE)  # Clé SK générée 
+        metaIndex = encrypt_superblock_index(se_index, sk_key)
+
+    # Ètape 7 : Chiffrement RSA de la clé SK avec knob-pub-key
+    with instrumentation.stage("rsa_wrap"):
+        if epoch is not None:
+            metaSGX = epoch.wrap(sk_key)
+        else:
+            cipher_rsa = default_keyring.oaep_cipher(knob_pub_key)
+            metaSGX = cipher_rsa.encrypt(sk_key)
+
+    meta = {
+        "metaFK": encryptor.meta_fk(),
+        # Pas de XOR ici : celui des empreintes des blocs avec FK est metaFK ; metaSK est la copie des
+        # super blocs chiffrés avec GK, réécrite avec eux par la rotation
+        "metaSK": b''.join(encryptor.encrypted_super_blocks),
+        "metaIndex": metaIndex,
+        "metaSGX": metaSGX,
+        "num_blocks": num_blocks,
+        "block_size": block_size,
+        "num_super_blocks": num_super_blocks,
+        "super_block_indices": encryptor.super_block_indices,
+        "compression": codec,
+        "mode": mode,
+    }
+    if merkle:
+        meta["metaMerkle"] = merkle_root
+    if store is not None:
+        # Métadonnées en dernier : un fichier qui en a est complet ; gk_tag y remplace gk.tag
+        store.put_metadata(file_id, dict(writer.record(meta), gk_tag=group_key_tag(gk_key)))
+    return meta
 
 # --- Fonction principale ---
 def main():
-    # Vérification des arguments
-    if len(sys.argv) < 3:
-        print("Usage: python knob_process.py <input_file> <path> <group key>")
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    path = sys.argv[2]
-    gk = sys.argv[3]
-    output_file = "output.bin"
+    parser = argparse.ArgumentParser(description="Chiffrement KNOB d'un fichier.")
+    parser.add_argument("input_file", help="Fichier à chiffrer")
+    parser.add_argument("path", help="Dossier de sortie des blocs (avec --store : fichiers temporaires et arbre de Merkle)")
+    parser.add_argument("gk", help="Fichier contenant la clé de groupe GK")
+    parser.add_argument("--legacy-dirs", action="store_true",
+                        help="Écrire un fichier par bloc dans blocks/ et super_blocks/ au lieu du conteneur " + CONTAINER_NAME)
+    parser.add_argument("--api-url", default=API_URL, help="Adresse de l'API de stockage")
+    parser.add_argument("--compression", choices=("none", "zlib", "zstd", "lz4", "auto"), default="none",
+                        help="Compresser les données avant le chiffrement")
+    parser.add_argument("--compression-level", type=int, default=None, help="Niveau de compression (par défaut, rapide)")
+    parser.add_argument("--mode", choices=("cbc", "ctr"), default="cbc",
+                        help="Mode de chiffrement de la couche FK (ctr : chiffrement parallèle)")
+    parser.add_argument("--workers", type=int, default=None, help="Threads de chiffrement en mode ctr (par défaut, un par cœur)")
+    parser.add_argument("--merkle", action="store_true",
+                        help="Écrire l'arbre de Merkle des blocs (vérification partielle de l'intégrité)")
+    parser.add_argument("--metadata-log", help="Ajouter les métadonnées à ce journal (voir knob_metadata.py), file_id = chemin absolu de path "
+                                               "(file_id du stockage avec --store)")
+    parser.add_argument("--store", help="Écrire les blocs et les métadonnées dans un stockage (sqlite://..., cassandra://..., dossier) au lieu de l'API")
+    parser.add_argument("--block-size", type=int, default=None, help="Taille de bloc (par défaut, selon la taille du fichier)")
+    parser.add_argument("--super-blocks", type=int, default=None, help="Nombre de super blocs (par défaut, selon le budget de rotation)")
+    parser.add_argument("--rotation-budget", type=int, default=ROTATION_BUDGET,
+                        help="Octets de super blocs par fichier visés pour le choix automatique")
+    args = parser.parse_args()
+
+    input_file = args.input_file
+    path = args.path
+    gk = args.gk
 
     # Initialiser la clé FK
     initialize_file_key()
-    
-    # Étape 1 : Chiffrement du fichier
-    encrypt_file(input_file, output_file)
-    
-    # Étape 2 : Division en blocs
-    iv, blocks = divide_into_blocks(output_file)
-
-    # Étape 3 : Formation de metaFK
-    metaFK = compute_xor_metadata(blocks, file_key)
-    
-    # Étape 4 : Identification des super blocs
-    super_block_indices = identify_super_blocks(blocks, 2)
-    super_block_indices.sort()
-    super_blocks = [blocks[i] for i in super_block_indices]
-    
-    # Étape 6 : Chiffrement des super blocs avec une clé GK
+
     # Récupération de GK
     with open(gk, "rb") as f:
         gk_key = f.read()
 
-    encrypted_super_blocks = encrypt_super_blocks(super_blocks, gk_key, iv)
-    for i, super_block in enumerate(encrypted_super_blocks):
-        blocks[super_block_indices[i]] = super_block
-    
-    # Remplace les super blocs dans le fichier par les nouveaux super blocs
-    remplace_super_block_file(output_file, super_block_indices, encrypted_super_blocks, len(blocks))
-
-    # Affichage des super blocs sélectionnés
-    print("Les super blocs sélectionnés sont :", super_block_indices)
-
-    # Étape 5 : Chiffrement AES des indices des superblocs
-    se_index = "".join(adaptation_indices(len(blocks), super_block_indices))
-    
-    sk_key = get_random_bytes(KEY_SIZE)  # Clé SK générée 
-    metaIndex = encrypt_superblock_index(se_index, sk_key)
-
-    # Ètape 7 : Chiffrement RSA de la clé SK avec knob-pub-key
-    with open("knob-pri-key", "rb") as f:
-        knob_pri_key = RSA.import_key(f.read())
-
-    knob_pub_key = knob_pri_key.publickey() 
-    cipher_rsa = PKCS1_OAEP.new(knob_pub_key)
-    metaSGX = cipher_rsa.encrypt(sk_key)
-    
-    # Sauvegarde de chaque bloc dans un dossier où chaque bloc est nommé par son indice
-    if not os.path.exists("blocks"):
-        os.makedirs("blocks") 
-
-    if not os.path.exists("super_blocks"):
-        os.makedirs("super_blocks")
-
-    """
-    i_block = 0
-    i_super_block = 0
-    for i in range(len(blocks)):
-        if i in super_block_indices:
-            file = "super_blocks/" + str(i_super_block) + ".bin"
-            i_super_block += 1
-        else: 
-            file = "blocks/" + str(i_block) + ".bin"
-            i_block += 1
-        with open(file, "wb") as f:
-            f.write(blocks[i])
-    """
+    knob_pub_key = default_keyring.rsa_key("knob-pri-key").publickey()
+
+    # Avec --store, les blocs sont écrits par lots dans le stockage au fil du chiffrement (voir block_storage.py)
+    store = None
+    file_id = None
+    if args.store:
+        try:
+            store = open_store(args.store)
+        except (ImportError, OSError) as e:
+            print(f"Erreur lors de l'ouverture de {args.store}: {e}")
+            sys.exit(1)
+        file_id = str(uuid.uuid4())
+
+    try:
+        # Mesures par étape si KNOB_INSTRUMENT est défini (voir instrumentation.py)
+        with instrumentation.instrument("encrypt"):
+            meta = encrypt_knob(input_file, path, gk_key, knob_pub_key, file_key, args.legacy_dirs,
+                                block_size=args.block_size, num_super_blocks=args.super_blocks,
+                                rotation_budget=args.rotation_budget, compression=args.compression,
+                                compression_level=args.compression_level, mode=args.mode, workers=args.workers,
+                                merkle=args.merkle, store=store, file_id=file_id)
+    except ValueError as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+    except OSError as e:
+        if store is None:
+            raise
+        print(f"Erreur lors de l'écriture dans {args.store}: {e}")
+        sys.exit(1)
+    finally:
+        if store is not None:
+            store.close()
 
-    i_block = 0
-    i_super_block = 0
-    with open(output_file, "rb") as f:
-        # Sauvegarde de l'IV dans le dossier blocks
-        with open("blocks/iv.bin", "wb") as f_iv:
-            f_iv.write(f.read(16)) # Lecture de l'IV
-        
-        # Sauvegarde de chaque bloc dans un fichier
-        for i in range(len(blocks)):
-            if i in super_block_indices:
-                file = "super_blocks/" + str(i_super_block) + ".bin"
-                i_super_block += 1
-            else: 
-                file = "blocks/" + str(i_block) + ".bin"
-                i_block += 1
-            
-            with open(file, "wb") as f_block:
-                block = f.read(BLOCK_SIZE)
-                f_block.write(block)
-
-    if (i_block + i_super_block) == len(blocks):
-        print("Les blocs ont été sauvegardés dans le dossier blocks et les super blocs dans le dossier super_blocks")
-
-    # Envoi du fichier chiffré à l'API et récupération du file_id
-    encrypted_data = b"".join(blocks)
-    response = send_to_api("/upload", {"file": ("encrypted_file.bin", encrypted_data)})
-    file_id = response["file_id"]
-
-    # Envoi des métadonnées à l’API
-    metadata = {
-        "file_id": file_id,
-        "metaFK": metaFK,
-        "metaSK": b''.join(encrypted_super_blocks), # TODO : ???? on est censé faire un XOR 
-        "metaIndex": metaIndex,
-        "metaSGX": metaSGX
-    }
+    print(f"Les {meta['num_blocks']} blocs de {meta['block_size']} octets ont été sauvegardés dans {args.store or path}")
+    if meta["compression"] != "none":
+        print(f"Données compressées avec {meta['compression']} : {os.path.getsize(input_file)} octets -> "
+              f"{meta['num_blocks'] * meta['block_size']} octets chiffrés")
 
-    send_to_api("/store_metadata", {"metadata": ("metadata.bin", str(metadata).encode())})
+    # Affichage des super blocs sélectionnés
+    print("Les super blocs sélectionnés sont :", meta["super_block_indices"])
+
+    if args.metadata_log:
+        try:
+            # Même clé que celle du déchiffrement : le file_id du stockage avec --store, sinon le dossier
+            with MetadataLog(args.metadata_log, writable=True) as log:
+                log.append(file_id or path_id(path), meta)
+        except (OSError, ValueError) as e:
+            print(f"Erreur lors de l'écriture dans {args.metadata_log}: {e}")
+            sys.exit(1)
+        print(f"Métadonnées ajoutées au journal {args.metadata_log}")
+
+    if args.store:
+        print(f"Fichier {input_file} chiffré et stocké avec succès. File ID: {file_id}")
+        return
+
+    # Envoi du fichier chiffré puis des métadonnées à l'API (en flux, sans fichier intermédiaire)
+    try:
+        with UploadClient(args.api_url, API_KEY) as client:
+            file_id = upload_knob(client, path, meta)
+    except requests.RequestException as e:
+        print(f"Erreur lors de l'envoi des données à {args.api_url}: {e}")
+        sys.exit(1)
 
     print(f"Fichier {input_file} chiffré et stocké avec succès. File ID: {file_id}")
 
-
-    # Suppression du fichier chiffré
-    os.remove(output_file)
-
 # Point d'entrée du programme
 if __name__ == "__main__":
     main()
@@ -0,0 +1,413 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from Crypto.Cipher import AES
+from block_container import (CONTAINER_NAME, GK_TAG_NAME, BlockContainer, BlockDirectory, group_key_tag,
+                             read_group_key_tag)
+from knob_merkle import META_NAME as META_MERKLE_NAME, TREE_NAME, MerkleTree
+from block_storage import open_store
+from knob_keyring import default_keyring
+from shard_coordinator import LEASE_TTL, NUM_SHARDS, WorkStream, open_coordinator
+
+# Rotation de la clé de groupe : seuls les super blocs (chiffrés avec GK) sont
+# lus, déchiffrés avec l'ancienne GK, rechiffrés avec la nouvelle et réécrits
+# sur place. Le coût dépend du nombre de super blocs, pas de la taille des
+# fichiers.
+#
+# Reprise après interruption :
+# 1. les anciens super blocs sont d'abord copiés dans path/rotation.journal
+#    (écrit puis renommé : un journal présent est toujours complet) ;
+# 2. les super blocs sont réécrits sur place (et metaSK.bin s'il existe ; les
+#    feuilles des super blocs dans l'arbre de Merkle et metaMerkle.bin aussi),
+#    puis gk.tag reçoit l'empreinte de la nouvelle clé ;
+# 3. le dossier est ajouté au fichier de reprise ;
+# 4. le journal est supprimé.
+# Un dossier absent du fichier de reprise mais avec un journal est restauré
+# depuis le journal puis traité à nouveau ; un dossier présent dans le fichier
+# de reprise n'est jamais traité deux fois.
+#
+# Le journal et le fichier de reprise commencent par l'empreinte de la nouvelle
+# clé : un journal resté d'une rotation terminée vers une autre clé (arrêt entre
+# l'étape 3 et l'étape 4) est ignoré au lieu d'être restauré, et le fichier de
+# reprise d'une rotation précédente ne fait sauter aucun dossier.
+#
+# Sans journal, gk.tag (écrit au chiffrement) doit être l'empreinte de
+# l'ancienne clé : une mauvaise ancienne clé est refusée avant toute écriture,
+# et un dossier déjà passé à la nouvelle clé (rotation relancée) est sauté.
+#
+# Fichiers d'un stockage (--store, voir block_storage) : les mêmes étapes avec
+# les métadonnées du fichier, réécrites en entier à chaque put_metadata. Le
+# journal est le champ rotation_journal (empreinte de la nouvelle clé, puis
+# anciens super blocs), gk_tag remplace gk.tag, et le dernier put_metadata
+# (nouveaux metaSK et gk_tag, sans journal) termine la rotation d'un coup.
+# L'arbre de Merkle d'un fichier stocké reste dans le dossier du chiffrement :
+# un fichier stocké avec metaMerkle est refusé.
+JOURNAL_NAME = "rotation.journal"
+JOURNAL_TAG_SIZE = 16
+META_SK_NAME = "metaSK.bin"
+
+def fsync_write(filename, data, mode="wb", offset=None):
+    with open(filename, mode) as f:
+        if offset is not None:
+            f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def atomic_write(filename, data):
+    """Écrit data dans un fichier temporaire puis le renomme en filename."""
+    tmp = filename + ".tmp"
+    fsync_write(tmp, data)
+    os.replace(tmp, filename)
+
+def is_knob_directory(path):
+    return (os.path.exists(os.path.join(path, CONTAINER_NAME))
+            or os.path.isdir(os.path.join(path, "super_blocks")))
+
+def read_super_blocks(path):
+    """Renvoie (iv, taille de bloc, super blocs chiffrés avec GK) sans lire les blocs ordinaires."""
+    container = os.path.join(path, CONTAINER_NAME)
+    if os.path.exists(container):
+        with BlockContainer(container) as source:
+            return source.iv, source.block_size, [bytes(source.super_block(j)) for j in range(source.num_super_blocks)]
+    with BlockDirectory(path) as source:
+        return source.iv, source.block_size, [source.super_block(j) for j in range(source.num_super_blocks)]
+
+def write_super_blocks(path, blocks):
+    """Réécrit sur place les super blocs de path (durablement : fsync)."""
+    container = os.path.join(path, CONTAINER_NAME)
+    if os.path.exists(container):
+        with BlockContainer(container) as source:
+            if len(blocks) != source.num_super_blocks:
+                raise ValueError(f"{path} : {source.num_super_blocks} super blocs attendus, {len(blocks)} donnés.")
+            offset = source.super_blocks_offset
+        fsync_write(container, b"".join(blocks), "r+b", offset)
+        return
+    for j, block in enumerate(blocks):
+        fsync_write(os.path.join(path, "super_blocks", str(j) + ".bin"), block, "r+b", 0)
+
+def reencrypt_super_blocks(blocks, iv, old_gk, new_gk):
+    """Déchiffre chaque super bloc avec old_gk et le rechiffre avec new_gk (même IV, comme au chiffrement)."""
+    return [AES.new(new_gk, AES.MODE_CBC, iv).encrypt(AES.new(old_gk, AES.MODE_CBC, iv).decrypt(block))
+            for block in blocks]
+
+def journal_tag(new_gk):
+    return group_key_tag(new_gk)
+
+def remove_journal(path):
+    journal = os.path.join(path, JOURNAL_NAME)
+    if os.path.exists(journal):
+        os.remove(journal)
+
+def rotate_directory(path, old_gk, new_gk):
+    """
+    Applique la rotation aux super blocs de path. Le journal est laissé en
+    place : il est supprimé par l'appelant une fois la reprise enregistrée.
+    Lève ValueError si les super blocs ne sont pas chiffrés avec old_gk
+    (d'après gk.tag) ; renvoie un bilan avec "already_rotated" s'ils le sont
+    déjà avec new_gk.
+    """
+    journal = os.path.join(path, JOURNAL_NAME)
+    tag = journal_tag(new_gk)
+    old_tag = group_key_tag(old_gk)
+    stored_tag = read_group_key_tag(path)
+    iv, block_size, blocks = read_super_blocks(path)
+
+    saved = None
+    if os.path.exists(journal):
+        with open(journal, "rb") as f:
+            data = f.read()
+        size = len(blocks) * block_size
+        if data[:JOURNAL_TAG_SIZE] == tag and len(data) == JOURNAL_TAG_SIZE + size:
+            saved = data[JOURNAL_TAG_SIZE:]
+        elif len(data) == size:
+            saved = data  # Journal sans empreinte (version précédente)
+        # Sinon : journal d'une rotation déjà terminée vers une autre clé
+
+    if saved is None and stored_tag == tag:
+        # Rotation déjà faite (relancée sans fichier de reprise) : rien à réécrire
+        return {"path": path, "super_blocks": 0, "bytes": 0, "already_rotated": True}
+    if stored_tag not in (None, old_tag) and (saved is None or stored_tag != tag):
+        raise ValueError(f"{path} : les super blocs ne sont pas chiffrés avec l'ancienne clé de groupe donnée.")
+
+    if saved is not None:
+        # Rotation interrompue : retour à l'état d'avant, connu par le journal
+        blocks = [saved[i:i + block_size] for i in range(0, len(saved), block_size)]
+        write_super_blocks(path, blocks)
+    else:
+        atomic_write(journal, tag + b"".join(blocks))
+
+    new_blocks = reencrypt_super_blocks(blocks, iv, old_gk, new_gk)
+    write_super_blocks(path, new_blocks)
+
+    # metaSK (concaténation des super blocs) suit les super blocs
+    meta_sk = os.path.join(path, META_SK_NAME)
+    if os.path.exists(meta_sk):
+        atomic_write(meta_sk, b"".join(new_blocks))
+
+    # Arbre de Merkle : seules les feuilles des super blocs (les dernières) et leurs chemins changent
+    tree_file = os.path.join(path, TREE_NAME)
+    if os.path.exists(tree_file):
+        with MerkleTree(tree_file, writable=True) as tree:
+            first = tree.num_leaves - len(new_blocks)
+            root = tree.update({first + j: block for j, block in enumerate(new_blocks)})
+        atomic_write(os.path.join(path, META_MERKLE_NAME), root)
+
+    atomic_write(os.path.join(path, GK_TAG_NAME), tag)
+    return {"path": path, "super_blocks": len(new_blocks), "bytes": len(new_blocks) * block_size}
+
+def rotate_store_file(store, file_id, old_gk, new_gk):
+    """
+    Applique la rotation aux super blocs du fichier file_id de store (BlockStore
+    de block_storage), comme rotate_directory. Lève ValueError si les super
+    blocs ne sont pas chiffrés avec old_gk (d'après gk_tag), si une rotation
+    vers une autre clé a été interrompue ou si le fichier a un arbre de Merkle.
+    """
+    meta = store.get_metadata(file_id)
+    tag = journal_tag(new_gk)
+    stored_tag = meta.get("gk_tag")
+    journal = meta.get("rotation_journal")
+    if journal is not None and journal[:JOURNAL_TAG_SIZE] != tag:
+        raise ValueError(f"{file_id} : rotation vers une autre clé de groupe interrompue, à terminer d'abord.")
+    if journal is None and stored_tag == tag:
+        return {"path": file_id, "super_blocks": 0, "bytes": 0, "already_rotated": True}
+    if journal is None and stored_tag not in (None, group_key_tag(old_gk)):
+        raise ValueError(f"{file_id} : les super blocs ne sont pas chiffrés avec l'ancienne clé de groupe donnée.")
+    if "metaMerkle" in meta:
+        raise ValueError(f"{file_id} : l'arbre de Merkle n'est pas dans le stockage, rotation impossible.")
+
+    block_size = meta["block_size"]
+    if journal is not None:
+        # Rotation interrompue : les super blocs d'avant sont dans le journal
+        saved = journal[JOURNAL_TAG_SIZE:]
+        blocks = [saved[i:i + block_size] for i in range(0, len(saved), block_size)]
+    else:
+        blocks = store.get_super_blocks(file_id)
+        store.put_metadata(file_id, dict(meta, rotation_journal=tag + b"".join(blocks)))
+
+    new_blocks = reencrypt_super_blocks(blocks, meta["iv"], old_gk, new_gk)
+    store.put_super_blocks(file_id, new_blocks)
+    meta.pop("rotation_journal", None)
+    store.put_metadata(file_id, dict(meta, metaSK=b"".join(new_blocks), gk_tag=tag))
+    return {"path": file_id, "super_blocks": len(new_blocks), "bytes": len(new_blocks) * block_size}
+
+class Checkpoint:
+    """
+    Fichier de reprise : l'empreinte de la nouvelle clé (première ligne), puis
+    un dossier terminé par ligne, ajouté et synchronisé un à un. Un fichier
+    d'une rotation vers une autre clé est recommencé.
+    """
+
+    def __init__(self, filename, tag=b""):
+        self.filename = filename
+        self.done = set()
+        self._file = None
+        if not filename:
+            return
+        header = "#" + tag.hex()
+        lines = []
+        if os.path.exists(filename):
+            with open(filename) as f:
+                lines = [line.rstrip("\n") for line in f if line.endswith("\n")]
+        if lines and lines[0] == header:
+            self.done = set(lines[1:])
+            self._file = open(filename, "a")
+        else:
+            self._file = open(filename, "w")
+            self._file.write(header + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def mark_done(self, path):
+        self.done.add(path)
+        if self._file:
+            self._file.write(path + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def list_directories(source):
+    """Dossiers KNOB d'une arborescence, d'un manifeste (un dossier par ligne) ou de '-' (stdin)."""
+    if os.path.isdir(source) and not is_knob_directory(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            if is_knob_directory(root):
+                dirs[:] = []  # blocks/ et super_blocks/ ne sont pas des fichiers KNOB
+                yield root
+        return
+    if os.path.isdir(source):
+        yield source
+        return
+    yield from read_manifest(source)
+
+def read_manifest(source):
+    """Éléments d'un manifeste (un par ligne) ou de '-' (stdin)."""
+    lines = sys.stdin if source == "-" else open(source)
+    try:
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+def run_rotation(paths, old_gk, new_gk, checkpoint_file=None, workers=None, max_in_flight=None, work=None,
+                 store=None):
+    """
+    Applique la rotation à tous les dossiers de paths, en parallèle. Renvoie le
+    bilan. Avec work (WorkStream de shard_coordinator), les dossiers viennent
+    des tranches attribuées à ce nœud et sont déclarés terminés auprès du
+    coordinateur au lieu du fichier de reprise. Avec store, paths (ou work)
+    donne des file_id de ce stockage au lieu de dossiers.
+    """
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    max_in_flight = max_in_flight or 2 * workers
+    summary = {"rotated": 0, "skipped": 0, "already_rotated": [], "failed": [], "super_blocks": 0, "bytes": 0}
+    pending = {}
+    submitted = set()  # Un dossier donné deux fois n'est jamais traité par deux threads à la fois
+    start_time = time.perf_counter()
+
+    with Checkpoint(checkpoint_file, journal_tag(new_gk)) as checkpoint:
+        def collect(futures):
+            for future in futures:
+                path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Non déclaré terminé : retraité à la prochaine exécution
+                    summary["failed"].append({"path": path, "error": f"{type(e).__name__}: {e}"})
+                    continue
+                if work is not None:
+                    if not work.complete(path):
+                        # Bail perdu : le dossier sera repris (et restauré) ailleurs, journal compris, ou
+                        # redonné à ce nœud s'il reprend la tranche ; il doit alors être traité à nouveau
+                        submitted.discard(path)
+                        continue
+                else:
+                    checkpoint.mark_done(path)
+                if store is None:
+                    remove_journal(path)
+                if result.get("already_rotated"):
+                    summary["skipped"] += 1
+                    summary["already_rotated"].append(path)
+                    continue
+                summary["rotated"] += 1
+                summary["super_blocks"] += result["super_blocks"]
+                summary["bytes"] += result["bytes"]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path in (work if work is not None else paths):
+                if store is None:
+                    path = os.path.normpath(path)
+                if path in submitted:
+                    # Redonné par work pendant son traitement (tranche reprise par ce nœud) : complete()
+                    # le déclare terminé sous le nouveau bail, ce n'est pas un doublon
+                    if work is None:
+                        summary["skipped"] += 1
+                    continue
+                submitted.add(path)
+                if path in checkpoint.done:
+                    # Terminé avant l'interruption : il peut rester le journal
+                    if store is None:
+                        remove_journal(path)
+                    summary["skipped"] += 1
+                    continue
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if store is not None:
+                    future = executor.submit(rotate_store_file, store, path, old_gk, new_gk)
+                else:
+                    future = executor.submit(rotate_directory, path, old_gk, new_gk)
+                pending[future] = path
+            collect(list(pending))
+
+    summary["seconds"] = time.perf_counter() - start_time
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotation de la clé de groupe : réécriture des seuls super blocs.")
+    parser.add_argument("source", help="Dossier KNOB, arborescence de dossiers KNOB, manifeste ou '-' (stdin) ; "
+                                       "avec --store, manifeste de file_id ou '-'")
+    parser.add_argument("old_gk", help="Fichier contenant l'ancienne clé de groupe")
+    parser.add_argument("new_gk", help="Fichier contenant la nouvelle clé de groupe")
+    parser.add_argument("--checkpoint", default="rotation.checkpoint", help="Fichier de reprise")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de threads")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Nombre maximal de dossiers en cours")
+    parser.add_argument("--summary", help="Fichier JSON où écrire le bilan")
+    parser.add_argument("--store", help="Fichiers d'un stockage (sqlite://..., cassandra://..., dossier) au lieu de dossiers KNOB")
+    parser.add_argument("--coordinator", help="Répartir les dossiers entre plusieurs nœuds (zk://..., sqlite://...)")
+    parser.add_argument("--job", help="Nom du travail réparti (par défaut, dérivé de la nouvelle clé)")
+    parser.add_argument("--worker-id", help="Identifiant de ce nœud (par défaut, hôte et pid)")
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS, help="Nombre de tranches du travail réparti")
+    parser.add_argument("--lease-ttl", type=float, default=LEASE_TTL, help="Durée des baux en secondes")
+    args = parser.parse_args()
+
+    old_gk = default_keyring.group_key(args.old_gk)
+    new_gk = default_keyring.group_key(args.new_gk)
+    if old_gk == new_gk:
+        print("Erreur : l'ancienne et la nouvelle clé de groupe sont identiques.")
+        sys.exit(1)
+
+    store = None
+    if args.store:
+        try:
+            store = open_store(args.store)
+        except (ImportError, OSError) as e:
+            print(f"Erreur lors de l'ouverture de {args.store}: {e}")
+            sys.exit(1)
+        items = read_manifest(args.source)
+    else:
+        items = (os.path.normpath(path) for path in list_directories(args.source))
+
+    try:
+        if args.coordinator:
+            # Chaque nœud lance la même commande : le premier crée le travail, tous se partagent les tranches
+            job = args.job or "rotation-" + journal_tag(new_gk).hex()
+            try:
+                with open_coordinator(args.coordinator, args.lease_ttl) as coordinator:
+                    coordinator.create_job(job, items, args.shards)
+                    with WorkStream(coordinator, job, args.worker_id) as work:
+                        summary = run_rotation(None, old_gk, new_gk, None, args.workers, args.max_in_flight, work,
+                                               store)
+                    summary["job"] = coordinator.status(job)
+            except ImportError as e:
+                print(f"Erreur : {e}")
+                sys.exit(1)
+        else:
+            summary = run_rotation(items, old_gk, new_gk, args.checkpoint, args.workers, args.max_in_flight,
+                                   store=store)
+    finally:
+        if store is not None:
+            store.close()
+
+    print(f"{summary['rotated']} fichiers traités ({summary['super_blocks']} super blocs) en "
+          f"{summary['seconds']:.2f} secondes, {summary['skipped']} déjà faits, {len(summary['failed'])} échecs.")
+    if "job" in summary:
+        status = summary["job"]
+        print(f"Travail réparti : {status['completed']}/{status['items']} dossiers terminés, "
+              f"nœuds encore actifs : {', '.join(sorted(status['workers'])) or 'aucun'}.")
+    for failure in summary["failed"]:
+        print(f"Échec : {failure['path']} -> {failure['error']}")
+
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import contextvars
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Mesures par étape des chaînes de chiffrement et de déchiffrement : temps réel,
+# temps CPU, octets traités et, si demandé, allocations (blocs alloués et octets
+# via tracemalloc, coûteux). Désactivé par défaut : stage() renvoie alors un
+# contexte vide, pour un coût négligeable.
+#
+# Activation sans toucher au code, par variables d'environnement :
+#   KNOB_INSTRUMENT=json|prometheus  format du rapport
+#   KNOB_INSTRUMENT_FILE=chemin      destination (stderr par défaut) ; le JSON
+#                                    est ajouté en fin de fichier (une ligne par
+#                                    exécution), le texte Prometheus remplace
+#                                    le fichier (collecteur textfile)
+#   KNOB_TRACEMALLOC=1               blocs et octets alloués par étape (plus lent)
+#   KNOB_PROFILE=chemin              profil cProfile de l'exécution (pstats)
+#
+# L'exécution en cours est une ContextVar : chaque thread (et chaque tâche
+# asyncio) voit la sienne, deux exécutions simultanées ne se mélangent pas.
+# Un thread de pool démarre sans exécution en cours ; pour qu'il mesure dans
+# celle de l'appelant, lui passer contextvars.copy_context().run.
+ENV_FORMAT = "KNOB_INSTRUMENT"
+ENV_FILE = "KNOB_INSTRUMENT_FILE"
+ENV_TRACEMALLOC = "KNOB_TRACEMALLOC"
+ENV_PROFILE = "KNOB_PROFILE"
+
+_NULL_STAGE = nullcontext()
+
+class _Stage:
+    __slots__ = ("owner", "name", "nbytes", "wall", "cpu", "blocks", "traced")
+
+    def __init__(self, owner, name, nbytes):
+        self.owner = owner
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        if self.owner.trace_malloc:
+            self.blocks = sys.getallocatedblocks()
+            self.traced = tracemalloc.get_traced_memory()[0]
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        blocks = traced = 0
+        if self.owner.trace_malloc:
+            blocks = sys.getallocatedblocks() - self.blocks
+            traced = tracemalloc.get_traced_memory()[0] - self.traced
+        self.owner._record(self.name, wall, cpu, self.nbytes, blocks, traced)
+
+class Instrumentation:
+    """Compteurs par étape d'une exécution (pipeline : 'encrypt', 'decrypt'...)."""
+
+    enabled = True
+
+    def __init__(self, pipeline, trace_malloc=False):
+        self.pipeline = pipeline
+        self.trace_malloc = trace_malloc
+        self.stages = {}  # Dans l'ordre de première apparition
+        self.observers = []  # Appelés avec (pipeline, étape, durée) à la fin de chaque étape
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def stage(self, name, nbytes=0):
+        """Contexte mesurant une étape ; une même étape peut être mesurée plusieurs fois (cumul)."""
+        return _Stage(self, name, nbytes)
+
+    def add_bytes(self, name, nbytes):
+        """Ajoute des octets traités à une étape sans la chronométrer."""
+        self._record(name, 0.0, 0.0, nbytes, 0, 0, calls=0)
+
+    def _record(self, name, wall, cpu, nbytes, blocks, traced, calls=1):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "bytes": 0,
+                                             "allocated_blocks": 0, "allocated_bytes": 0}
+            stats["calls"] += calls
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+            stats["bytes"] += nbytes
+            stats["allocated_blocks"] += blocks
+            stats["allocated_bytes"] += traced
+        for observer in self.observers:
+            observer(self.pipeline, name, wall)
+
+    def report(self):
+        return {"pipeline": self.pipeline, "started": self.started, "pid": os.getpid(),
+                "tracemalloc": self.trace_malloc, "stages": self.stages}
+
+    def to_json(self):
+        return json.dumps(self.report(), sort_keys=True)
+
+    def to_prometheus(self):
+        """Texte au format d'exposition Prometheus."""
+        lines = []
+        for metric, kind, help_text in (("calls", "counter", "Nombre de passages dans l'étape"),
+                                        ("wall_seconds", "counter", "Temps réel passé dans l'étape"),
+                                        ("cpu_seconds", "counter", "Temps CPU du processus pendant l'étape"),
+                                        ("bytes", "counter", "Octets traités par l'étape"),
+                                        ("allocated_blocks", "gauge", "Blocs mémoire alloués et non libérés (tracemalloc)"),
+                                        ("allocated_bytes", "gauge", "Octets alloués et non libérés (tracemalloc)")):
+            name = f"knob_stage_{metric}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, stats in self.stages.items():
+                lines.append(f'{name}{{pipeline="{self.pipeline}",stage="{stage}"}} {stats[metric]}')
+        return "\n".join(lines) + "\n"
+
+class NullInstrumentation:
+    """Instrumentation désactivée."""
+
+    enabled = False
+
+    def stage(self, name, nbytes=0):
+        return _NULL_STAGE
+
+    def add_bytes(self, name, nbytes):
+        pass
+
+NULL = NullInstrumentation()
+_current = contextvars.ContextVar("knob_instrumentation", default=NULL)
+
+def current():
+    """Instrumentation de l'exécution en cours (NULL si aucune)."""
+    return _current.get()
+
+def stage(name, nbytes=0):
+    return _current.get().stage(name, nbytes)
+
+def write_report(instrumentation, fmt, filename=None):
+    text = instrumentation.to_prometheus() if fmt == "prometheus" else instrumentation.to_json() + "\n"
+    if filename is None:
+        sys.stderr.write(text)
+        return
+    with open(filename, "w" if fmt == "prometheus" else "a") as f:
+        f.write(text)
+
+@contextmanager
+def instrument(pipeline, fmt=None, filename=None, trace_malloc=None, profile=None):
+    """
+    Mesure une exécution complète. Les paramètres non donnés sont lus dans
+    l'environnement ; sans format, rien n'est mesuré.
+    """
+    fmt = fmt or os.environ.get(ENV_FORMAT)
+    profile = profile or os.environ.get(ENV_PROFILE)
+    if not fmt and not profile:
+        yield NULL
+        return
+    if fmt and fmt not in ("json", "prometheus"):
+        raise ValueError(f"Format d'instrumentation inconnu : {fmt}")
+
+    filename = filename or os.environ.get(ENV_FILE)
+    if trace_malloc is None:
+        trace_malloc = os.environ.get(ENV_TRACEMALLOC, "") not in ("", "0")
+    started_tracemalloc = trace_malloc and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+
+    instrumentation = Instrumentation(pipeline, trace_malloc) if fmt else NULL
+    profiler = cProfile.Profile() if profile else None
+    token = _current.set(instrumentation)
+    try:
+        with profiler if profiler else nullcontext():
+            yield instrumentation
+    finally:
+        _current.reset(token)
+        if started_tracemalloc:
+            tracemalloc.stop()
+        if profiler:
+            profiler.dump_stats(profile)
+        if fmt:
+            write_report(instrumentation, fmt, filename)
@@ -0,0 +1,121 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import sys
+
+# Client du service KNOB (knob_daemon.py) : bibliothèque standard uniquement,
+# pour que chaque appel ne coûte que le démarrage de l'interpréteur et un
+# aller-retour sur le socket. Les chemins sont envoyés en absolu (le service
+# ne partage pas le dossier courant du client).
+SOCKET_PATH = os.environ.get("KNOB_SOCKET", "/tmp/knob.sock")
+
+class KnobError(Exception):
+    """Erreur renvoyée par le service."""
+
+class KnobClient:
+    def __init__(self, socket_path=SOCKET_PATH, timeout=None):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(socket_path)
+        self._reader = self._socket.makefile("rb")
+        self._ids = itertools.count()
+
+    def call_many(self, requests):
+        """
+        Envoie toutes les requêtes sans attendre (le service peut les regrouper),
+        puis renvoie les réponses dans l'ordre des requêtes.
+        """
+        ids = []
+        lines = []
+        for request in requests:
+            request_id = next(self._ids)
+            ids.append(request_id)
+            lines.append(json.dumps(dict(request, id=request_id)).encode() + b"\n")
+        self._socket.sendall(b"".join(lines))
+
+        responses = {}
+        while len(responses) < len(ids):
+            line = self._reader.readline()
+            if not line:
+                raise ConnectionError("Connexion fermée par le service.")
+            response = json.loads(line)
+            responses[response["id"]] = response
+        return [responses[request_id] for request_id in ids]
+
+    def call(self, op, **params):
+        """Exécute une requête et renvoie son résultat (KnobError en cas d'échec)."""
+        response = self.call_many([dict(params, op=op)])[0]
+        if not response["ok"]:
+            raise KnobError(response["error"])
+        return response["result"]
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Client du service KNOB local.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Chemin du socket Unix du service")
+    parser.add_argument("--gk", help="Clé de groupe à utiliser (par défaut, celle du service)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    encrypt = commands.add_parser("encrypt", help="Chiffrer un fichier")
+    encrypt.add_argument("input_file")
+    encrypt.add_argument("path", help="Dossier de sortie des blocs (et des métadonnées)")
+    encrypt.add_argument("--mode", choices=("cbc", "ctr"))
+    encrypt.add_argument("--compression", choices=("none", "zlib", "zstd", "lz4", "auto"))
+    encrypt.add_argument("--block-size", type=int)
+    encrypt.add_argument("--super-blocks", type=int)
+    encrypt.add_argument("--merkle", action="store_true")
+    encrypt.add_argument("--legacy-dirs", action="store_true")
+
+    decrypt = commands.add_parser("decrypt", help="Déchiffrer un fichier")
+    decrypt.add_argument("path", help="Dossier contenant les blocs et les métadonnées")
+    decrypt.add_argument("output_file")
+    decrypt.add_argument("--range", nargs=2, type=int, metavar=("OFFSET", "LENGTH"))
+
+    rotate = commands.add_parser("rotate", help="Rotation de la clé de groupe")
+    rotate.add_argument("new_gk", help="Fichier contenant la nouvelle clé de groupe")
+    rotate.add_argument("paths", nargs="+", help="Dossiers KNOB")
+    rotate.add_argument("--old-gk", help="Ancienne clé (par défaut, celle du service)")
+
+    commands.add_parser("stats", help="Compteurs du service")
+    args = parser.parse_args()
+
+    if args.command == "encrypt":
+        request = {"op": "encrypt", "input": os.path.abspath(args.input_file), "path": os.path.abspath(args.path),
+                   "mode": args.mode, "compression": args.compression, "block_size": args.block_size,
+                   "num_super_blocks": args.super_blocks, "merkle": args.merkle, "legacy_dirs": args.legacy_dirs}
+    elif args.command == "decrypt":
+        request = {"op": "decrypt", "path": os.path.abspath(args.path), "output": os.path.abspath(args.output_file),
+                   "range": args.range}
+    elif args.command == "rotate":
+        request = {"op": "rotate", "new_gk": os.path.abspath(args.new_gk),
+                   "old_gk": os.path.abspath(args.old_gk) if args.old_gk else None,
+                   "paths": [os.path.abspath(path) for path in args.paths]}
+    else:
+        request = {"op": "stats"}
+    if args.gk and args.command in ("encrypt", "decrypt"):
+        request["gk"] = os.path.abspath(args.gk)
+
+    try:
+        with KnobClient(args.socket) as client:
+            result = client.call(**request)
+    except OSError as e:
+        print(f"Service KNOB injoignable sur {args.socket} : {e}")
+        sys.exit(1)
+    except KnobError as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstandard absent : codec zstd indisponible
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # lz4 absent : codec lz4 indisponible
+    lz4 = None
+
+# Compression (facultative) avant le chiffrement : les données compressibles
+# (journaux, JSON) coûtent moins de blocs, donc moins de AES, de hachage, de
+# stockage et d'envoi. La compression se fait en flux, morceau par morceau.
+#
+# Le codec est enregistré dans les métadonnées ("compression") et dans
+# l'octet de poids faible du champ flags de l'en-tête du conteneur, où le
+# déchiffrement le retrouve.
+CHUNK_SIZE = 256 * 1024
+CODECS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+CODEC_NAMES = {number: name for name, number in CODECS.items()}
+CODEC_MASK = 0x00FF
+DEFAULT_LEVELS = {"zlib": 1, "zstd": 3, "lz4": 0}  # Niveaux rapides : la compression ne doit pas freiner le chiffrement
+
+def available_codecs():
+    """Codecs utilisables dans cet environnement."""
+    codecs = ["none", "zlib"]
+    if zstandard is not None:
+        codecs.append("zstd")
+    if lz4 is not None:
+        codecs.append("lz4")
+    return codecs
+
+def resolve_codec(name):
+    """Nom du codec à utiliser : "auto" choisit zstd s'il est disponible, sinon zlib."""
+    if name in (None, ""):
+        return "none"
+    if name == "auto":
+        return "zstd" if zstandard is not None else "zlib"
+    if name not in CODECS:
+        raise ValueError(f"Codec de compression inconnu : {name} (choix : {', '.join(CODECS)}).")
+    if name not in available_codecs():
+        raise ValueError(f"Codec {name} indisponible : module Python manquant.")
+    return name
+
+def codec_flags(name):
+    return CODECS[name]
+
+def codec_from_flags(flags):
+    number = flags & CODEC_MASK
+    if number not in CODEC_NAMES:
+        raise ValueError(f"Codec de compression inconnu dans l'en-tête : {number}.")
+    return CODEC_NAMES[number]
+
+class Lz4Compressor:
+    """Même interface que zlib.compressobj (compress/flush) pour un cadre LZ4."""
+
+    def __init__(self, level):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        header, self._header = self._header, b""
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+class Lz4Decompressor:
+    def __init__(self):
+        self._decompressor = lz4.frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+class ZstdStreamDecompressor:
+    def __init__(self):
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+def compressor(name, level=None):
+    """Objet compress(données)/flush() du codec name."""
+    level = DEFAULT_LEVELS[name] if level is None else level
+    if name == "zlib":
+        return zlib.compressobj(level)
+    if name == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if name == "lz4":
+        return Lz4Compressor(level)
+    raise ValueError(f"Pas de compresseur pour le codec {name}.")
+
+def decompressor(name):
+    """Objet decompress(données)/flush() du codec name."""
+    if name == "zlib":
+        return zlib.decompressobj()
+    if name == "zstd":
+        return ZstdStreamDecompressor()
+    if name == "lz4":
+        return Lz4Decompressor()
+    raise ValueError(f"Pas de décompresseur pour le codec {name}.")
+
+def compress_stream(infile, outfile, name, level=None, chunk_size=CHUNK_SIZE):
+    """Compresse infile dans outfile, morceau par morceau. Renvoie (octets lus, octets écrits)."""
+    codec = compressor(name, level)
+    read = written = 0
+    while chunk := infile.read(chunk_size):
+        read += len(chunk)
+        data = codec.compress(chunk)
+        outfile.write(data)
+        written += len(data)
+    data = codec.flush()
+    outfile.write(data)
+    return read, written + len(data)
+
+def decompress_stream(infile, outfile, name, chunk_size=CHUNK_SIZE):
+    """Décompresse infile dans outfile, morceau par morceau. Renvoie le nombre d'octets écrits."""
+    codec = decompressor(name)
+    written = 0
+    while chunk := infile.read(chunk_size):
+        data = codec.decompress(chunk)
+        outfile.write(data)
+        written += len(data)
+    data = codec.flush()
+    outfile.write(data)
+    return written + len(data)
@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from batch_encryption import META_FILES
+from block_container import CONTAINER_NAME, open_block_source
+from decryption_service import decrypt_to_file
+from encryption_service import KEY_SIZE, encrypt_knob
+from group_key_rotation import run_rotation
+from knob_epoch import EpochWrapper
+from knob_keyring import default_keyring
+from knob_metadata import MetadataLog, path_id
+from knob_reader import KnobReader
+from knob_unwrap import get_sk, get_super_blocks_indices
+from Crypto.Random import get_random_bytes
+
+# Service KNOB local sur un socket Unix : l'interpréteur, PyCryptodome et les
+# clés (GK, clé RSA, contextes OAEP, SK et FK déjà récupérées : voir
+# knob_keyring) restent chargés entre les requêtes. Le client (knob_client.py)
+# n'importe que la bibliothèque standard.
+#
+# Protocole : une requête JSON par ligne, une réponse JSON par ligne
+# ({"id", "ok", "result"} ou {"id", "ok": false, "error"}). Plusieurs requêtes
+# peuvent être envoyées sur une connexion sans attendre les réponses, qui
+# arrivent dans l'ordre où elles se terminent (l'id les associe).
+#
+# Les petites requêtes (fichiers de moins de SMALL_SIZE octets) sont regroupées
+# par lots (au plus BATCH_MAX, pendant au plus BATCH_WINDOW secondes) traités
+# d'un seul tenant par un thread du pool ; les rotations d'un même lot vers la
+# même clé sont faites en une seule passe. Les grosses requêtes vont directement
+# au pool.
+SOCKET_PATH = os.environ.get("KNOB_SOCKET", "/tmp/knob.sock")
+SMALL_SIZE = 1024 * 1024
+BATCH_MAX = 64
+BATCH_WINDOW = 0.002
+ENCRYPT_OPTIONS = ("legacy_dirs", "block_size", "num_super_blocks", "compression", "mode", "merkle")
+
+def write_meta_files(path, meta):
+    """Métadonnées à côté des blocs, comme batch_encryption (metaMerkle.bin si l'arbre existe)."""
+    for name in META_FILES + ("metaMerkle",):
+        if name in meta:
+            with open(os.path.join(path, name + ".bin"), "wb") as f:
+                f.write(meta[name])
+
+def read_meta_files(path):
+    meta = {}
+    for name in META_FILES:
+        with open(os.path.join(path, name + ".bin"), "rb") as f:
+            meta[name] = f.read()
+    return meta
+
+class KnobService:
+    """
+    Opérations du service, avec les clés par défaut chargées une fois au
+    démarrage. Avec metadata_log, les métadonnées sont ajoutées à ce journal
+    (knob_metadata) et y sont cherchées, au lieu des fichiers meta*.bin. Avec
+    epoch, les SK sont chiffrées avec une clé d'époque renouvelée toutes les
+    heures (voir knob_epoch) au lieu d'un RSA-OAEP par fichier.
+    """
+
+    def __init__(self, gk_file, knob_key_file, workers=1, metadata_log=None, epoch=False):
+        self.gk_file = gk_file
+        self.knob_key_file = knob_key_file
+        self.workers = workers  # Threads par opération (chiffrement CTR, déchiffrement)
+        self.batches = 0  # Lots formés (compté par le seul thread de regroupement)
+        self.group_key(None)
+        self.knob_key()
+        self.metadata = MetadataLog(metadata_log, writable=True) if metadata_log else None
+        self.epoch = EpochWrapper(self.knob_key().publickey()) if epoch else None
+
+    def group_key(self, filename):
+        return default_keyring.group_key(filename or self.gk_file)
+
+    def knob_key(self):
+        return default_keyring.rsa_key(self.knob_key_file)
+
+    def size(self, request):
+        """Taille du fichier à traiter, pour choisir entre lot et pool (0 si inconnue)."""
+        try:
+            if request.get("op") == "encrypt":
+                return os.path.getsize(request["input"])
+            if request.get("op") == "decrypt":
+                return os.path.getsize(os.path.join(request["path"], CONTAINER_NAME))
+        except (OSError, TypeError, KeyError):
+            pass
+        return 0
+
+    def encrypt(self, request):
+        options = {name: request[name] for name in ENCRYPT_OPTIONS if request.get(name) is not None}
+        legacy_dirs = options.pop("legacy_dirs", False)
+        start_time = time.perf_counter()
+        meta = encrypt_knob(request["input"], request["path"], self.group_key(request.get("gk")),
+                            self.knob_key().publickey(), get_random_bytes(KEY_SIZE), legacy_dirs,
+                            workers=self.workers, epoch=self.epoch, **options)
+        if self.metadata is not None:
+            self.metadata.append(path_id(request["path"]), meta)
+        else:
+            write_meta_files(request["path"], meta)
+        return {"path": request["path"], "num_blocks": meta["num_blocks"], "block_size": meta["block_size"],
+                "compression": meta["compression"], "mode": meta["mode"],
+                "seconds": time.perf_counter() - start_time}
+
+    def decrypt(self, request):
+        path = request["path"]
+        if self.metadata is not None and not request.get("meta_dir"):
+            meta = self.metadata.get(path_id(path))
+        else:
+            meta = read_meta_files(request.get("meta_dir") or path)
+        group_key = self.group_key(request.get("gk"))
+        start_time = time.perf_counter()
+        sk = get_sk(self.knob_key(), meta["metaSGX"])
+        super_block_indices, num_blocks = get_super_blocks_indices(meta["metaIndex"], sk)
+        with open_block_source(path) as source:
+            if request.get("range"):
+                reader = KnobReader(source, meta["metaFK"], super_block_indices, num_blocks, group_key)
+                data = reader.decrypt_range(*request["range"])
+                with open(request["output"], "wb") as f:
+                    f.write(data)
+            else:
+                decrypt_to_file(source, super_block_indices, num_blocks, group_key, meta["metaFK"],
+                                request["output"], self.workers)
+        return {"output": request["output"], "seconds": time.perf_counter() - start_time}
+
+    def rotate(self, requests):
+        """
+        Rotations d'un lot : une seule passe par couple (ancienne clé, nouvelle
+        clé). Une requête rejouée (client qui réessaie) ne réécrit rien : les
+        dossiers déjà passés à la nouvelle clé sont sautés (gk.tag, voir
+        group_key_rotation), ceux d'une autre clé sont en échec.
+        """
+        groups = {}
+        for request in requests:
+            groups.setdefault((request.get("old_gk") or self.gk_file, request["new_gk"]), []).append(request)
+        results = []
+        for (old_gk_file, new_gk_file), group in groups.items():
+            paths = [path for request in group for path in request["paths"]]
+            summary = run_rotation(paths, self.group_key(old_gk_file), self.group_key(new_gk_file))
+            failed = {entry["path"]: entry["error"] for entry in summary["failed"]}
+            skipped = set(summary["already_rotated"])
+            for request in group:
+                errors = {path: failed[os.path.normpath(path)] for path in request["paths"]
+                          if os.path.normpath(path) in failed}
+                # Même dossier dans plusieurs requêtes du lot : la rotation compte pour la première
+                done = [path for path in request["paths"] if os.path.normpath(path) in skipped]
+                skipped.update(os.path.normpath(path) for path in request["paths"] if os.path.normpath(path) not in failed)
+                results.append((request, {"rotated": len(request["paths"]) - len(errors) - len(done),
+                                          "skipped": done, "failed": errors}))
+        return results
+
+    def stats(self, request):
+        stats = {"keyring": default_keyring.stats(), "pid": os.getpid(), "batches": self.batches}
+        if self.metadata is not None:
+            stats["metadata_records"] = self.metadata.count
+        if self.epoch is not None:
+            stats["epochs"] = self.epoch.epochs
+        return stats
+
+    def close(self):
+        if self.metadata is not None:
+            self.metadata.close()
+        if self.epoch is not None:
+            self.epoch.close()
+
+    def run_batch(self, items):
+        """Exécute un lot de (requête, Future) à la suite ; les rotations sont regroupées."""
+        rotations = [(request, future) for request, future in items if request.get("op") == "rotate"]
+        for request, future in items:
+            if request.get("op") != "rotate":
+                self.run_one(request, future)
+        if rotations:
+            futures = {id(request): future for request, future in rotations}
+            try:
+                for request, result in self.rotate([request for request, _ in rotations]):
+                    futures[id(request)].set_result(result)
+            except Exception as e:
+                for _, future in rotations:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def run_one(self, request, future):
+        operations = {"encrypt": self.encrypt, "decrypt": self.decrypt, "stats": self.stats}
+        try:
+            operation = operations.get(request.get("op"))
+            if operation is None:
+                raise ValueError(f"Opération inconnue : {request.get('op')}.")
+            future.set_result(operation(request))
+        except Exception as e:
+            future.set_exception(e)
+
+class Batcher:
+    """Regroupe les petites requêtes en lots exécutés sur le pool ; les grosses y vont directement."""
+
+    def __init__(self, service, pool_size, batch_max=BATCH_MAX, batch_window=BATCH_WINDOW, small_size=SMALL_SIZE):
+        self.service = service
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self.small_size = small_size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        future = Future()
+        if self.service.size(request) >= self.small_size:
+            self.executor.submit(self.service.run_one, request, future)
+        else:
+            self._queue.put((request, future))
+        return future
+
+    def _collect(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_max:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            self.service.batches += 1
+            self.executor.submit(self.service.run_batch, batch)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.executor.shutdown()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lock = threading.Lock()
+        replies = []  # Une Future par requête, terminée une fois la réponse écrite
+
+        def reply(request_id, future, replied=None):
+            try:
+                response = {"id": request_id, "ok": True, "result": future.result()}
+            except Exception as e:
+                response = {"id": request_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+            with lock:
+                try:
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+                    self.wfile.flush()
+                except (OSError, ValueError):
+                    pass  # Client parti
+            if replied is not None:
+                replied.set_result(None)
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                future = Future()
+                future.set_exception(ValueError("Requête JSON invalide."))
+                reply(None, future)
+                continue
+            replied = Future()
+            replies.append(replied)
+            self.server.batcher.submit(request).add_done_callback(
+                lambda future, request_id=request.get("id"), replied=replied: reply(request_id, future, replied))
+
+        # Fin des requêtes (le client peut fermer son côté écriture) : les réponses restent à envoyer
+        wait(replies)
+
+class KnobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(socket_path, service, pool_size):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # Socket laissé par un service arrêté
+    umask = os.umask(0o177)  # Socket accessible au seul propriétaire
+    try:
+        server = KnobServer(socket_path, RequestHandler)
+    finally:
+        os.umask(umask)
+    server.batcher = Batcher(service, pool_size)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Service KNOB local (socket Unix) gardant les clés en mémoire.")
+    parser.add_argument("gk", help="Fichier contenant la clé de groupe GK (par défaut des requêtes)")
+    parser.add_argument("--knob-key", default="knob-pri-key", help="Clé privée RSA knob")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Chemin du socket Unix")
+    parser.add_argument("--pool", type=int, default=os.cpu_count() or 1, help="Requêtes (ou lots) traitées en parallèle")
+    parser.add_argument("--workers", type=int, default=1, help="Threads par opération (chiffrement CTR, déchiffrement)")
+    parser.add_argument("--metadata-log", help="Journal de métadonnées (knob_metadata.py) au lieu des fichiers meta*.bin")
+    parser.add_argument("--epoch", action="store_true", help="Chiffrer les SK avec une clé d'époque (une opération RSA par heure)")
+    args = parser.parse_args()
+
+    try:
+        service = KnobService(args.gk, args.knob_key, args.workers, args.metadata_log, args.epoch)
+    except (OSError, ValueError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+
+    server = make_server(args.socket, service, args.pool)
+    print(f"Service KNOB sur {args.socket} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        service.close()
+        os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import struct
+import threading
+import time
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Random import get_random_bytes
+
+# Enveloppe par époque pour metaSGX : au lieu d'un chiffrement RSA-OAEP de SK
+# par fichier, une clé d'époque (AES-256) est chiffrée une seule fois avec
+# knob-pub-key pour tout un lot (ou une fenêtre de temps), et la SK de chaque
+# fichier est chiffrée avec elle (AES-GCM). Au déchiffrement, la clé d'époque
+# n'est déchiffrée (RSA) qu'une fois puis gardée dans le trousseau.
+#
+#   en-tête (ENVELOPE) | RSA-OAEP(clé d'époque) | nonce | tag | AES-GCM(SK)
+#
+# L'en-tête est authentifié (données associées de GCM). Chaque enveloppe
+# contient la clé d'époque chiffrée : metaSGX reste autonome. Une metaSGX
+# historique (RSA-OAEP de SK) a exactement la taille du module RSA ; une
+# enveloppe est plus longue et commence par MAGIC.
+MAGIC = b"KNEP"
+VERSION = 1
+ENVELOPE = struct.Struct("<4sB16sH")  # magic, version, identifiant d'époque, taille de la clé d'époque chiffrée
+EPOCH_KEY_SIZE = 32
+NONCE_SIZE = 12
+TAG_SIZE = 16
+EPOCH_LIFETIME = 3600.0      # Secondes avant de changer de clé d'époque (service)
+EPOCH_MAX_FILES = 1 << 20    # SK chiffrées au plus par clé d'époque (nonces GCM aléatoires)
+
+def rsa_size(key):
+    return (key.n.bit_length() + 7) // 8
+
+def is_envelope(metaSGX, knob_key):
+    """Vrai si metaSGX est une enveloppe par époque (et non un RSA-OAEP de SK)."""
+    return len(metaSGX) != rsa_size(knob_key) and metaSGX[:len(MAGIC)] == MAGIC
+
+def parse_envelope(metaSGX):
+    """(en-tête, clé d'époque chiffrée, nonce, tag, SK chiffrée) ; ValueError si l'enveloppe est invalide."""
+    try:
+        magic, version, _, wrapped_size = ENVELOPE.unpack_from(metaSGX)
+    except struct.error:
+        raise ValueError("metaSGX invalide : enveloppe tronquée.") from None
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("metaSGX invalide : enveloppe par époque inconnue.")
+    offset = ENVELOPE.size + wrapped_size
+    if len(metaSGX) <= offset + NONCE_SIZE + TAG_SIZE:
+        raise ValueError("metaSGX invalide : enveloppe tronquée.")
+    return (metaSGX[:ENVELOPE.size], metaSGX[ENVELOPE.size:offset], metaSGX[offset:offset + NONCE_SIZE],
+            metaSGX[offset + NONCE_SIZE:offset + NONCE_SIZE + TAG_SIZE], metaSGX[offset + NONCE_SIZE + TAG_SIZE:])
+
+def epoch_cache_id(wrapped_epoch_key):
+    """Identifiant de la clé d'époque dans le trousseau : empreinte de sa forme chiffrée."""
+    return hashlib.sha256(wrapped_epoch_key).hexdigest()
+
+def open_envelope(metaSGX, unwrap_epoch_key):
+    """
+    SK contenue dans l'enveloppe metaSGX. unwrap_epoch_key(clé chiffrée)
+    renvoie la clé d'époque (déchiffrement RSA, ou trousseau). Lève ValueError
+    si l'enveloppe a été altérée ou ne correspond pas à la clé.
+    """
+    header, wrapped_epoch_key, nonce, tag, wrapped_sk = parse_envelope(metaSGX)
+    epoch_key = unwrap_epoch_key(wrapped_epoch_key)
+    cipher = AES.new(epoch_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(header)
+    try:
+        return cipher.decrypt_and_verify(wrapped_sk, tag)
+    except ValueError:
+        raise ValueError("metaSGX invalide : enveloppe altérée ou mauvaise clé knob.") from None
+
+class Epoch:
+    """
+    Clé d'époque : une opération RSA à la création, puis un AES-GCM par SK.
+    Sérialisable (pickle), pour être partagée par les processus d'un lot.
+    """
+
+    def __init__(self, knob_pub_key):
+        self.epoch_id = get_random_bytes(16)
+        self.key = bytearray(get_random_bytes(EPOCH_KEY_SIZE))
+        self.wrapped = PKCS1_OAEP.new(knob_pub_key).encrypt(bytes(self.key))
+        self.files = 0
+
+    def wrap(self, sk):
+        """metaSGX de SK : enveloppe chiffrée avec la clé d'époque."""
+        header = ENVELOPE.pack(MAGIC, VERSION, self.epoch_id, len(self.wrapped))
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(bytes(self.key), AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        wrapped_sk, tag = cipher.encrypt_and_digest(sk)
+        self.files += 1
+        return header + self.wrapped + nonce + tag + wrapped_sk
+
+    def close(self):
+        """Efface la clé d'époque."""
+        self.key[:] = bytes(len(self.key))
+
+class EpochWrapper:
+    """
+    Pour un processus de longue durée (service) : change de clé d'époque
+    après lifetime secondes ou max_files SK. Sûr entre threads.
+    """
+
+    def __init__(self, knob_pub_key, lifetime=EPOCH_LIFETIME, max_files=EPOCH_MAX_FILES, clock=time.monotonic):
+        self.knob_pub_key = knob_pub_key
+        self.lifetime = lifetime
+        self.max_files = max_files
+        self.clock = clock
+        self.epochs = 0
+        self._epoch = None
+        self._created = None
+        self._lock = threading.Lock()
+
+    def wrap(self, sk):
+        with self._lock:
+            epoch = self._epoch
+            if epoch is None or epoch.files >= self.max_files or self.clock() - self._created >= self.lifetime:
+                if epoch is not None:
+                    epoch.close()
+                epoch = self._epoch = Epoch(self.knob_pub_key)
+                self._created = self.clock()
+                self.epochs += 1
+            return epoch.wrap(sk)
+
+    def close(self):
+        with self._lock:
+            if self._epoch is not None:
+                self._epoch.close()
+                self._epoch = None
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from knob_epoch import epoch_cache_id, is_envelope, open_envelope
+
+# Trousseau en mémoire du processus : clés RSA déjà analysées, contextes OAEP
+# et clés déjà déchiffrées ou reconstituées (SK, clés d'époque, GK, FK). Un
+# déchiffrement RSA-OAEP 4096 bits coûte bien plus cher que la lecture d'un
+# petit fichier, et reconstituer FK demande de hacher tous les blocs : relire
+# un fichier déjà ouvert ne le refait pas.
+#
+# Les entrées sont évincées par LRU (au plus max_entries) et par durée de vie
+# (ttl secondes). Les clés secrètes sont gardées dans des bytearray remis à zéro
+# à l'éviction ; les appelants reçoivent une copie.
+MAX_ENTRIES = 256
+TTL = 300.0
+
+def key_fingerprint(key):
+    """Empreinte SHA-256 du module d'une clé RSA (identique pour la clé privée et la clé publique)."""
+    return hashlib.sha256(key.n.to_bytes((key.n.bit_length() + 7) // 8, "big")).hexdigest()
+
+def file_signature(filename):
+    """Chemin absolu, date de modification et taille : une clé modifiée sur disque est relue."""
+    st = os.stat(filename)
+    return os.path.realpath(filename), st.st_mtime_ns, st.st_size
+
+def zeroize(value):
+    if isinstance(value, bytearray):
+        value[:] = bytes(len(value))
+
+class Keyring:
+    """Cache LRU + TTL, sûr entre threads, avec compteurs de succès et d'échecs."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # clé -> (valeur, date d'expiration)
+        self._lock = threading.RLock()
+
+    def get_or_create(self, key, factory, ttl=None):
+        """Valeur associée à key, calculée par factory() en cas d'absence ou d'expiration."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Le calcul (RSA) se fait hors du verrou : deux threads peuvent le faire
+        # en même temps pour la même clé, le second résultat remplace le premier
+        value = factory()
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+            self._evict()
+        return value
+
+    def get_secret(self, key, factory, ttl=None):
+        """Comme get_or_create pour une clé secrète : copie d'un bytearray effacé à l'éviction."""
+        return bytes(self.get_or_create(key, lambda: bytearray(factory()), ttl))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            zeroize(entry[0])
+            self.evictions += 1
+
+    def _evict(self):
+        now = self.clock()
+        for key in [key for key, (_, expires) in self._entries.items() if expires <= now]:
+            self._discard(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        """Efface toutes les entrées."""
+        with self._lock:
+            for key in list(self._entries):
+                self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries)}
+
+    # --- Clés KNOB ---
+
+    def rsa_key(self, filename):
+        """Clé RSA (privée ou publique) lue depuis filename."""
+        def load():
+            with open(filename, "rb") as f:
+                return RSA.import_key(f.read())
+        return self.get_or_create(("rsa",) + file_signature(filename), load)
+
+    def oaep_cipher(self, key):
+        """Contexte PKCS1_OAEP associé à une clé RSA."""
+        kind = "oaep-private" if key.has_private() else "oaep-public"
+        return self.get_or_create((kind, key_fingerprint(key)), lambda: PKCS1_OAEP.new(key))
+
+    def unwrap_sk(self, knob_priv_key, metaSGX):
+        """
+        SK déchiffrée depuis metaSGX, par empreinte de metaSGX (jamais par nom de
+        fichier : un fichier rechiffré sous le même nom a une autre SK). metaSGX
+        est un RSA-OAEP de SK ou une enveloppe par époque (knob_epoch), dont la
+        clé d'époque n'est déchiffrée qu'une fois.
+        """
+        fingerprint = key_fingerprint(knob_priv_key)
+        cipher = self.oaep_cipher(knob_priv_key)
+
+        def unwrap():
+            if not is_envelope(metaSGX, knob_priv_key):
+                return cipher.decrypt(metaSGX)
+            return open_envelope(metaSGX, lambda wrapped: self.get_secret(
+                ("epoch", fingerprint, epoch_cache_id(wrapped)), lambda: cipher.decrypt(wrapped)))
+
+        return self.get_secret(("sk", fingerprint, hashlib.sha256(metaSGX).hexdigest()), unwrap)
+
+    def unwrap_group_keys(self, knob_priv_key, admin_key, meta_task, unwrap):
+        """
+        Clés de groupe déchiffrées par unwrap() depuis meta_task, par empreinte
+        de meta_task et de la clé admin (clé RSA ou son fichier) qui le signe :
+        la signature est vérifiée à nouveau pour une autre clé admin.
+        """
+        admin = key_fingerprint(admin_key) if hasattr(admin_key, "n") else hashlib.sha256(admin_key).hexdigest()
+        key = ("group-keys", key_fingerprint(knob_priv_key), admin, hashlib.sha256(meta_task).hexdigest())
+        return self.get_secret(key, unwrap)
+
+    def file_key(self, metaFK, recover, file_id=None):
+        """FK reconstituée par recover() (hachage de tous les blocs), par file_id et empreinte de metaFK."""
+        return self.get_secret(("fk", file_id, hashlib.sha256(metaFK).hexdigest()), recover)
+
+    def group_key(self, filename):
+        """Clé de groupe GK lue depuis filename."""
+        def load():
+            with open(filename, "rb") as f:
+                return f.read()
+        return self.get_secret(("gk",) + file_signature(filename), load)
+
+# Trousseau partagé par les modules du processus
+default_keyring = Keyring()
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import hmac
+import os
+import struct
+import sys
+from block_container import open_block_source
+
+# Arbre de Merkle (facultatif) sur les blocs stockés, pour vérifier un bloc ou
+# une plage avec O(log n) hashes au lieu de rehacher tout le fichier.
+#
+# Les feuilles suivent l'ordre de stockage : blocs ordinaires, puis super blocs
+# (tels que stockés, chiffrés avec GK). Une vérification de fond n'a donc
+# besoin d'aucune clé ni des indices des super blocs (secrets). Les hashes sont
+# séparés par domaine (0x00 feuille, 0x01 nœud) : ils diffèrent des hashes des
+# blocs dont le XOR forme metaFK, l'arbre ne révèle donc rien de FK.
+#
+# Chaque niveau apparie les nœuds consécutifs ; un dernier nœud sans voisin
+# remonte tel quel. La racine (32 octets) est enregistrée avec les
+# métadonnées ("metaMerkle") ; l'arbre complet est stocké à côté des blocs :
+#
+#   en-tête | niveau 0 (feuilles) | niveau 1 | ... | racine
+#
+# L'arbre n'est pas une source de confiance : tout y est vérifié par rapport à
+# la racine des métadonnées.
+TREE_NAME = "merkle.tree"
+META_NAME = "metaMerkle.bin"
+MAGIC = b"KNOBMRKL"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQ")  # magic, version, réservé, réservé, nombre de feuilles
+HASH_SIZE = 32
+BUILD_NODES = 64 * 1024  # Nœuds lus par lot pour construire un niveau
+SCRUB_BATCH = 256         # Blocs vérifiés ensemble
+
+def leaf_hash(block):
+    return hashlib.sha256(b"\x00" + bytes(block)).digest()
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def level_sizes(num_leaves):
+    """Nombre de nœuds de chaque niveau, des feuilles à la racine."""
+    sizes = [num_leaves]
+    while sizes[-1] > 1:
+        sizes.append(-(-sizes[-1] // 2))
+    return sizes
+
+def merkle_root(leaves):
+    """Racine calculée en flux à partir des hashes des feuilles (mémoire en O(log n))."""
+    pending = []  # Nœud en attente de son voisin droit, par niveau (ou None)
+    for node in leaves:
+        level = 0
+        while level < len(pending) and pending[level] is not None:
+            node = node_hash(pending[level], node)
+            pending[level] = None
+            level += 1
+        if level == len(pending):
+            pending.append(None)
+        pending[level] = node
+
+    # Fin : chaque nœud sans voisin remonte et se combine avec le nœud en attente du niveau supérieur
+    carry = None
+    for node in pending:
+        if node is not None:
+            carry = node if carry is None else node_hash(node, carry)
+    if carry is None:
+        raise ValueError("Arbre de Merkle vide.")
+    return carry
+
+class MerkleTree:
+    """Arbre stocké dans un fichier : lecture, vérification et mise à jour de quelques nœuds."""
+
+    def __init__(self, filename, writable=False):
+        self.filename = filename
+        self._file = open(filename, "r+b" if writable else "rb")
+        magic, version, _, _, self.num_leaves = HEADER.unpack(self._file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            self._file.close()
+            raise ValueError(f"{filename} n'est pas un arbre de Merkle KNOB.")
+        self._init_levels()
+
+    def _init_levels(self):
+        self.sizes = level_sizes(self.num_leaves)
+        self.offsets = []
+        offset = HEADER.size
+        for size in self.sizes:
+            self.offsets.append(offset)
+            offset += size * HASH_SIZE
+
+    @classmethod
+    def create(cls, filename, num_leaves):
+        """Crée un arbre vide de num_leaves feuilles, à remplir avec set_leaf puis build."""
+        if num_leaves < 1:
+            raise ValueError("Un arbre de Merkle a au moins une feuille.")
+        tree = cls.__new__(cls)
+        tree.filename = filename
+        tree._file = open(filename, "w+b")
+        tree.num_leaves = num_leaves
+        tree._init_levels()
+        tree._file.write(HEADER.pack(MAGIC, VERSION, 0, 0, num_leaves))
+        tree._file.truncate(tree.offsets[-1] + HASH_SIZE)
+        return tree
+
+    def _read(self, level, index, count=1):
+        return os.pread(self._file.fileno(), count * HASH_SIZE, self.offsets[level] + index * HASH_SIZE)
+
+    def _write(self, level, index, data):
+        os.pwrite(self._file.fileno(), data, self.offsets[level] + index * HASH_SIZE)
+
+    def set_leaf(self, position, block):
+        self._write(0, position, leaf_hash(block))
+
+    def set_leaf_hashes(self, position, hashes):
+        """Écrit des hashes de feuilles consécutives (concaténés) à partir de position."""
+        self._write(0, position, bytes(hashes))
+
+    def build(self):
+        """Calcule les niveaux supérieurs à partir des feuilles. Renvoie la racine."""
+        for level in range(len(self.sizes) - 1):
+            size = self.sizes[level]
+            for start in range(0, size, BUILD_NODES):
+                data = self._read(level, start, min(BUILD_NODES, size - start))
+                parents = bytearray()
+                for offset in range(0, len(data), 2 * HASH_SIZE):
+                    pair = data[offset:offset + 2 * HASH_SIZE]
+                    parents += node_hash(pair[:HASH_SIZE], pair[HASH_SIZE:]) if len(pair) == 2 * HASH_SIZE else pair
+                self._write(level + 1, start // 2, bytes(parents))
+        self._file.flush()
+        return self.root()
+
+    def root(self):
+        return self._read(len(self.sizes) - 1, 0)
+
+    def leaf(self, position):
+        return self._read(0, position)
+
+    def _climb(self, leaves, write):
+        """
+        Remonte des feuilles données ({position: hash}) jusqu'à la racine, en
+        lisant dans l'arbre les voisins inconnus (O(k log n) lectures pour k
+        feuilles). Avec write, les nœuds recalculés sont écrits. Renvoie la racine.
+        """
+        nodes = dict(leaves)
+        for level, size in enumerate(self.sizes):
+            if write:
+                for index, node in nodes.items():
+                    self._write(level, index, node)
+            if level == len(self.sizes) - 1:
+                return nodes[0]
+            parents = {}
+            for index in sorted(nodes):
+                parent = index // 2
+                if parent in parents:
+                    continue
+                left, right = parent * 2, parent * 2 + 1
+                if right >= size:
+                    parents[parent] = nodes[index]  # Dernier nœud sans voisin : il remonte
+                    continue
+                left_node = nodes[left] if left in nodes else self._read(level, left)
+                right_node = nodes[right] if right in nodes else self._read(level, right)
+                parents[parent] = node_hash(left_node, right_node)
+            nodes = parents
+
+    def verify(self, blocks, root):
+        """Vérifie des blocs stockés ({position: bloc}) par rapport à la racine de confiance root."""
+        if not blocks:
+            return True
+        if not all(0 <= position < self.num_leaves for position in blocks):
+            raise IndexError("Position hors de l'arbre de Merkle.")
+        computed = self._climb({position: leaf_hash(block) for position, block in blocks.items()}, write=False)
+        return hmac.compare_digest(computed, root)
+
+    def update(self, blocks):
+        """Remplace les feuilles des blocs modifiés ({position: bloc}) et renvoie la nouvelle racine."""
+        root = self._climb({position: leaf_hash(block) for position, block in blocks.items()}, write=True)
+        self._file.flush()
+        return root
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stored_block(source, position):
+    """Bloc stocké à la position position (blocs ordinaires puis super blocs)."""
+    if position < source.num_blocks:
+        return source.block(position)
+    return source.super_block(position - source.num_blocks)
+
+def iter_stored_blocks(source):
+    for j in range(source.num_blocks):
+        yield source.block(j)
+    for j in range(source.num_super_blocks):
+        yield source.super_block(j)
+
+def build_tree(source, filename):
+    """Construit l'arbre des blocs de source dans filename. Renvoie la racine."""
+    with MerkleTree.create(filename, source.num_blocks + source.num_super_blocks) as tree:
+        hashes = bytearray()
+        position = 0
+        for block in iter_stored_blocks(source):
+            hashes += leaf_hash(block)
+            if len(hashes) >= BUILD_NODES * HASH_SIZE:
+                tree.set_leaf_hashes(position, hashes)
+                position += len(hashes) // HASH_SIZE
+                hashes.clear()
+        tree.set_leaf_hashes(position, hashes)
+        return tree.build()
+
+def verify_source(source, root):
+    """Vérifie tous les blocs de source (sans l'arbre : la racine est recalculée en flux)."""
+    return hmac.compare_digest(merkle_root(leaf_hash(block) for block in iter_stored_blocks(source)), root)
+
+def scrub(source, tree, root, start=0, count=None, batch=SCRUB_BATCH):
+    """
+    Vérifie les blocs stockés [start, start + count) par lots, sans lire les
+    autres. Renvoie les positions des blocs altérés (un lot en échec est
+    vérifié bloc par bloc pour les localiser).
+    """
+    end = tree.num_leaves if count is None else min(tree.num_leaves, start + count)
+    bad = []
+    for first in range(start, end, batch):
+        blocks = {position: bytes(stored_block(source, position)) for position in range(first, min(first + batch, end))}
+        if not tree.verify(blocks, root):
+            bad.extend(position for position, block in blocks.items() if not tree.verify({position: block}, root))
+    return bad
+
+def main():
+    parser = argparse.ArgumentParser(description="Arbre de Merkle d'un fichier KNOB : construction et vérification.")
+    parser.add_argument("path", help="Dossier KNOB (conteneur ou blocks/ et super_blocks/)")
+    parser.add_argument("--root", help=f"Racine de confiance (par défaut, path/{META_NAME})")
+    parser.add_argument("--build", action="store_true", help="Construire l'arbre d'un fichier déjà chiffré et écrire sa racine")
+    parser.add_argument("--start", type=int, default=0, help="Premier bloc stocké vérifié")
+    parser.add_argument("--count", type=int, default=None, help="Nombre de blocs vérifiés (par défaut, jusqu'à la fin)")
+    args = parser.parse_args()
+
+    root_file = args.root or os.path.join(args.path, META_NAME)
+    tree_file = os.path.join(args.path, TREE_NAME)
+    try:
+        with open_block_source(args.path) as source:
+            if args.build:
+                root = build_tree(source, tree_file)
+                with open(root_file, "wb") as f:
+                    f.write(root)
+                print(f"Arbre de {source.num_blocks + source.num_super_blocks} blocs écrit dans {tree_file}, "
+                      f"racine dans {root_file}")
+                return
+
+            with open(root_file, "rb") as f:
+                root = f.read()
+            with MerkleTree(tree_file) as tree:
+                bad = scrub(source, tree, root, args.start, args.count)
+    except (FileNotFoundError, ValueError, IndexError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+
+    if bad:
+        print(f"{len(bad)} blocs altérés (positions de stockage) : {bad}")
+        sys.exit(1)
+    print("Blocs vérifiés : aucune altération.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from knob_compression import codec_flags, codec_from_flags
+from knob_modes import mode_flags, mode_from_flags
+
+# Métadonnées KNOB en enregistrements binaires compacts, rangés dans un
+# journal en ajout seul avec un index par file_id : une recherche coûte
+# quelques lectures, quel que soit le nombre de fichiers, au lieu d'ouvrir
+# quatre fichiers meta*.bin par dossier.
+#
+# Enregistrement (versionné) :
+#
+#   en-tête (RECORD) | file_id | iv | metaFK | metaSK | metaIndex | metaSGX | metaMerkle
+#
+# chaque champ variable précédé de sa longueur (32 bits, 0 : absent). Le codec
+# et le mode sont dans flags, comme dans l'en-tête du conteneur. Les indices
+# des super blocs (secrets) ne sont jamais enregistrés.
+#
+# Journal : en-tête, puis des trames longueur | CRC32 | enregistrement. Un
+# nouvel enregistrement d'un file_id remplace le précédent ; compact() réécrit
+# le journal sans les enregistrements remplacés. Un export est un journal
+# compacté (il s'ouvre tel quel).
+#
+# Index (<journal>.idx, projeté en mémoire) : table de hachage à adressage
+# ouvert (sondage linéaire, taux de remplissage au plus MAX_LOAD), chaque case
+# contenant le hash 64 bits du file_id et la position de la trame. Il est
+# dérivé du journal : l'en-tête indique la taille de journal couverte, la
+# suite est rejouée à l'ouverture, et un index absent ou invalide est
+# reconstruit. Un seul processus écrit (verrou sur le journal) ; les lecteurs
+# voient les ajouts postérieurs à leur index en relisant la fin du journal.
+LOG_MAGIC = b"KNOBMLOG"
+INDEX_MAGIC = b"KNOBMIDX"
+RECORD_MAGIC = b"KNMR"
+VERSION = 1
+LOG_HEADER = struct.Struct("<8sI")          # magic, version
+RECORD = struct.Struct("<4sBBHIQI")        # magic, version, réservé, flags, block_size, num_blocks, num_super_blocks
+LENGTH = struct.Struct("<I")
+FRAME = struct.Struct("<II")               # longueur de l'enregistrement, CRC32
+INDEX_HEADER = struct.Struct("<8sIIQQQ")   # magic, version, réservé, capacité, entrées, taille de journal couverte
+SLOT = struct.Struct("<QQ")                # hash du file_id (0 : case vide), position de la trame
+FIELDS = ("iv", "metaFK", "metaSK", "metaIndex", "metaSGX", "metaMerkle")
+MIN_CAPACITY = 1024
+MAX_LOAD = 0.5
+READ_SIZE = 4096     # Octets lus d'un coup pour une trame (la plupart tiennent dans une lecture)
+IMPORT_BATCH = 4096  # Enregistrements ajoutés par écriture lors d'un import
+
+def path_id(path):
+    """file_id d'un dossier KNOB local : son chemin absolu."""
+    return os.path.abspath(path)
+
+def pack_record(file_id, meta):
+    """Enregistrement binaire des métadonnées meta du fichier file_id."""
+    flags = meta.get("flags")
+    if flags is None:
+        flags = codec_flags(meta.get("compression") or "none") | mode_flags(meta.get("mode") or "cbc")
+    parts = [RECORD.pack(RECORD_MAGIC, VERSION, 0, flags, meta["block_size"], meta["num_blocks"],
+                         meta["num_super_blocks"])]
+    for value in [str(file_id).encode()] + [meta.get(name) or b"" for name in FIELDS]:
+        parts.append(LENGTH.pack(len(value)))
+        parts.append(value)
+    return b"".join(parts)
+
+def unpack_record(data):
+    """(file_id, métadonnées) d'un enregistrement ; ValueError s'il est invalide."""
+    try:
+        magic, version, _, flags, block_size, num_blocks, num_super_blocks = RECORD.unpack_from(data)
+        if magic != RECORD_MAGIC:
+            raise ValueError("Enregistrement de métadonnées KNOB invalide.")
+        if version != VERSION:
+            raise ValueError(f"Version d'enregistrement de métadonnées inconnue : {version}.")
+        offset = RECORD.size
+        values = []
+        for _ in range(1 + len(FIELDS)):
+            (length,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            values.append(bytes(data[offset:offset + length]))
+            offset += length
+    except struct.error:
+        raise ValueError("Enregistrement de métadonnées KNOB tronqué.") from None
+    if offset != len(data):
+        raise ValueError("Enregistrement de métadonnées KNOB invalide.")
+
+    meta = {"block_size": block_size, "num_blocks": num_blocks, "num_super_blocks": num_super_blocks,
+            "num_regular_blocks": num_blocks - num_super_blocks, "flags": flags,
+            "compression": codec_from_flags(flags), "mode": mode_from_flags(flags)}
+    for name, value in zip(FIELDS, values[1:]):
+        if value:
+            meta[name] = value
+    return values[0].decode(), meta
+
+def record_file_id(data):
+    """file_id d'un enregistrement, sans décoder le reste."""
+    (length,) = LENGTH.unpack_from(data, RECORD.size)
+    start = RECORD.size + LENGTH.size
+    return bytes(data[start:start + length]).decode()
+
+def key_hash(file_id):
+    return int.from_bytes(hashlib.blake2b(file_id.encode(), digest_size=8).digest(), "little") or 1
+
+def frame(record):
+    return FRAME.pack(len(record), zlib.crc32(record)) + record
+
+def iter_records(filename):
+    """Enregistrements d'un journal (ou d'un export), dans l'ordre, lus séquentiellement."""
+    with open(filename, "rb") as f:
+        magic, version = LOG_HEADER.unpack(f.read(LOG_HEADER.size).ljust(LOG_HEADER.size, b"\0"))
+        if magic != LOG_MAGIC or version != VERSION:
+            raise ValueError(f"{filename} n'est pas un journal de métadonnées KNOB.")
+        while header := f.read(FRAME.size):
+            if len(header) < FRAME.size:
+                raise ValueError(f"{filename} : trame tronquée à la fin.")
+            length, crc = FRAME.unpack(header)
+            record = f.read(length)
+            if len(record) != length or zlib.crc32(record) != crc:
+                raise ValueError(f"{filename} : enregistrement tronqué ou altéré.")
+            yield record
+
+class MetadataLog:
+    """Journal de métadonnées avec index par file_id (writable : seul écrivain, verrouillé)."""
+
+    def __init__(self, filename, writable=False, sync=False):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self.writable = writable
+        self.sync = sync  # fsync du journal après chaque ajout
+        self._lock = threading.RLock()
+        self._index = None
+        self._map = None
+        self._tail = {}  # Lecteur : file_id -> trame, pour les ajouts postérieurs à l'index
+        self._log = self._open_log()
+        try:
+            self._open_index()
+            self._catch_up()
+        except Exception:
+            self.close()
+            raise
+
+    def _open_log(self):
+        if not self.writable:
+            fd = os.open(self.filename, os.O_RDONLY)
+        else:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                raise ValueError(f"{self.filename} est déjà ouvert en écriture par un autre processus.") from None
+            if os.fstat(fd).st_size == 0:
+                os.pwrite(fd, LOG_HEADER.pack(LOG_MAGIC, VERSION), 0)
+        magic, version = LOG_HEADER.unpack(os.pread(fd, LOG_HEADER.size, 0).ljust(LOG_HEADER.size, b"\0"))
+        if magic != LOG_MAGIC or version != VERSION:
+            os.close(fd)
+            raise ValueError(f"{self.filename} n'est pas un journal de métadonnées KNOB.")
+        return fd
+
+    # --- Index ---
+
+    def _open_index(self):
+        try:
+            self._map_index(self.index_filename)
+            magic, version, _, self.capacity, self.count, self._end = INDEX_HEADER.unpack_from(self._map)
+            if (magic != INDEX_MAGIC or version != VERSION or self.capacity & (self.capacity - 1)
+                    or len(self._map) != INDEX_HEADER.size + self.capacity * SLOT.size
+                    or not LOG_HEADER.size <= self._end <= os.fstat(self._log).st_size):
+                raise ValueError("index invalide")
+        except (OSError, ValueError, struct.error):
+            self._unmap_index()
+            if not self.writable:
+                # Lecteur sans index utilisable : tout le journal est relu en mémoire
+                self.capacity, self.count, self._end = 0, 0, LOG_HEADER.size
+                return
+            self._create_index(MIN_CAPACITY)
+
+    def _map_index(self, filename):
+        self._index = open(filename, "r+b" if self.writable else "rb")
+        self._map = mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+
+    def _unmap_index(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def _create_index(self, capacity, slots=(), end=LOG_HEADER.size):
+        """
+        Nouvel index de capacity cases, puis remplacement atomique. slots :
+        (hash, trame) à reprendre ; end : taille de journal qu'ils couvrent.
+        """
+        temporary = self.index_filename + ".tmp"
+        with open(temporary, "w+b") as f:
+            f.truncate(INDEX_HEADER.size + capacity * SLOT.size)
+            with mmap.mmap(f.fileno(), 0) as new_map:
+                count = 0
+                mask = capacity - 1
+                for h, position in slots:
+                    i = h & mask
+                    while SLOT.unpack_from(new_map, INDEX_HEADER.size + i * SLOT.size)[0]:
+                        i = (i + 1) & mask
+                    SLOT.pack_into(new_map, INDEX_HEADER.size + i * SLOT.size, h, position)
+                    count += 1
+                INDEX_HEADER.pack_into(new_map, 0, INDEX_MAGIC, VERSION, 0, capacity, count, end)
+        os.replace(temporary, self.index_filename)
+        self._unmap_index()
+        self._map_index(self.index_filename)
+        self.capacity, self.count, self._end = capacity, count, end
+
+    def _slots(self):
+        """(hash, trame) des cases occupées de l'index."""
+        if self._map is None:
+            return
+        for h, position in SLOT.iter_unpack(self._map[INDEX_HEADER.size:]):
+            if h:
+                yield h, position
+
+    def _find(self, file_id):
+        """(case, trame) de file_id dans l'index, ou (première case vide, None)."""
+        h = key_hash(file_id)
+        mask = self.capacity - 1
+        i = h & mask
+        while True:
+            slot_hash, position = SLOT.unpack_from(self._map, INDEX_HEADER.size + i * SLOT.size)
+            if not slot_hash:
+                return i, None
+            if slot_hash == h and record_file_id(self._read_frame(position)[0]) == file_id:
+                return i, position
+            i = (i + 1) & mask
+
+    def _insert(self, file_id, position):
+        if not self.writable:
+            self._tail[file_id] = position
+            return
+        if (self.count + 1) > self.capacity * MAX_LOAD:
+            self._create_index(self.capacity * 2, list(self._slots()), self._end)
+        i, previous = self._find(file_id)
+        SLOT.pack_into(self._map, INDEX_HEADER.size + i * SLOT.size, key_hash(file_id), position)
+        if previous is None:
+            self.count += 1
+
+    def _write_index_header(self):
+        INDEX_HEADER.pack_into(self._map, 0, INDEX_MAGIC, VERSION, 0, self.capacity, self.count, self._end)
+
+    # --- Journal ---
+
+    def _read_frame(self, position):
+        """(enregistrement, position de la trame suivante) ; EOFError si la trame est incomplète."""
+        data = os.pread(self._log, READ_SIZE, position)
+        if len(data) < FRAME.size:
+            raise EOFError(position)
+        length, crc = FRAME.unpack_from(data)
+        record = data[FRAME.size:FRAME.size + length]
+        if len(record) < length:
+            record += os.pread(self._log, length - len(record), position + FRAME.size + len(record))
+        if len(record) < length:
+            raise EOFError(position)
+        if zlib.crc32(record) != crc:
+            raise ValueError(f"{self.filename} : enregistrement altéré à l'octet {position}.")
+        return record, position + FRAME.size + length
+
+    def _catch_up(self):
+        """Indexe les trames ajoutées après la fin couverte par l'index."""
+        size = os.fstat(self._log).st_size
+        position = self._end
+        while position < size:
+            try:
+                record, following = self._read_frame(position)
+            except EOFError:
+                if self.writable:
+                    os.ftruncate(self._log, position)  # Ajout interrompu : la trame incomplète est retirée
+                break
+            self._insert(record_file_id(record), position)
+            position = following
+        if position != self._end:
+            self._end = position
+            if self.writable:
+                self._write_index_header()
+
+    def append_records(self, records):
+        """Ajoute des enregistrements (pack_record) en une seule écriture."""
+        if not self.writable:
+            raise ValueError(f"{self.filename} est ouvert en lecture seule.")
+        if not records:
+            return
+        with self._lock:
+            data = b"".join(frame(record) for record in records)
+            os.pwrite(self._log, data, self._end)
+            if self.sync:
+                os.fsync(self._log)
+            position = self._end
+            for record in records:
+                self._insert(record_file_id(record), position)
+                position += FRAME.size + len(record)
+            self._end = position
+            self._write_index_header()
+
+    def append(self, file_id, meta):
+        self.append_records([pack_record(file_id, meta)])
+
+    def append_many(self, items):
+        """Ajoute des (file_id, meta) en une seule écriture."""
+        self.append_records([pack_record(file_id, meta) for file_id, meta in items])
+
+    def _lookup(self, file_id):
+        if file_id in self._tail:
+            return self._tail[file_id]
+        if self._map is None:
+            return None
+        return self._find(file_id)[1]
+
+    def get_record(self, file_id):
+        """Enregistrement binaire de file_id, KeyError s'il est inconnu."""
+        file_id = str(file_id)
+        with self._lock:
+            position = self._lookup(file_id)
+            if position is None and not self.writable:
+                self._catch_up()  # Ajouté depuis l'ouverture par l'écrivain ?
+                position = self._lookup(file_id)
+            if position is None:
+                raise KeyError(file_id)
+            return self._read_frame(position)[0]
+
+    def get(self, file_id):
+        """Métadonnées de file_id, KeyError s'il est inconnu."""
+        return unpack_record(self.get_record(file_id))[1]
+
+    def __contains__(self, file_id):
+        try:
+            self.get_record(file_id)
+        except KeyError:
+            return False
+        return True
+
+    def positions(self):
+        """Positions des trames en vigueur (une par file_id), dans l'ordre du journal."""
+        with self._lock:
+            self._catch_up()
+            positions = {position for _, position in self._slots()}
+            if self._tail:
+                # Lecteur : un ajout postérieur à l'index remplace la trame indexée du même file_id
+                if self._map is not None:
+                    positions.difference_update(filter(None, (self._find(file_id)[1] for file_id in self._tail)))
+                positions.update(self._tail.values())
+            return sorted(positions)
+
+    def records(self):
+        """Enregistrements en vigueur, dans l'ordre du journal."""
+        for position in self.positions():
+            with self._lock:
+                record = self._read_frame(position)[0]
+            yield record
+
+    def items(self):
+        for record in self.records():
+            yield unpack_record(record)
+
+    def __len__(self):
+        return len(self.positions())
+
+    def stats(self):
+        live = len(self)
+        return {"records": live, "log_bytes": self._end, "index_capacity": self.capacity,
+                "superseded": self._count_frames() - live}
+
+    def _count_frames(self):
+        count = 0
+        position = LOG_HEADER.size
+        with self._lock:
+            while position < self._end:
+                position = self._read_frame(position)[1]
+                count += 1
+        return count
+
+    def export(self, filename):
+        """Écrit les enregistrements en vigueur dans un nouveau journal (compacté). Renvoie leur nombre."""
+        count = 0
+        with open(filename, "wb") as f:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, VERSION))
+            for record in self.records():
+                f.write(frame(record))
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        return count
+
+    def import_file(self, filename, batch=IMPORT_BATCH):
+        """Ajoute les enregistrements d'un journal ou d'un export (les plus récents l'emportent). Renvoie leur nombre."""
+        count = 0
+        records = []
+        for record in iter_records(filename):
+            unpack_record(record)  # Validation avant tout ajout du lot
+            records.append(record)
+            if len(records) >= batch:
+                self.append_records(records)
+                count += len(records)
+                records = []
+        self.append_records(records)
+        return count + len(records)
+
+    def compact(self):
+        """Réécrit le journal sans les enregistrements remplacés, puis reconstruit l'index."""
+        if not self.writable:
+            raise ValueError(f"{self.filename} est ouvert en lecture seule.")
+        temporary = self.filename + ".compact"
+        with self._lock:
+            count = self.export(temporary)
+            os.replace(temporary, self.filename)
+            os.close(self._log)
+            self._log = self._open_log()
+            self._create_index(max(MIN_CAPACITY, 1 << max(0, int(count / MAX_LOAD)).bit_length()))
+            self._catch_up()
+        return count
+
+    def reindex(self):
+        """Reconstruit l'index à partir du journal."""
+        if not self.writable:
+            raise ValueError(f"{self.filename} est ouvert en lecture seule.")
+        with self._lock:
+            self._create_index(MIN_CAPACITY)
+            self._catch_up()
+
+    def close(self):
+        self._unmap_index()
+        if self._log is not None:
+            os.close(self._log)
+            self._log = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def import_knob_dirs(log, root, batch=IMPORT_BATCH):
+    """
+    Ajoute au journal les métadonnées des dossiers KNOB de root (fichiers
+    meta*.bin à côté des blocs), avec leur chemin absolu comme file_id.
+    Renvoie le nombre de dossiers importés.
+    """
+    from batch_encryption import META_FILES
+    from block_container import open_block_source
+
+    count = 0
+    records = []
+    for directory, _, files in os.walk(root):
+        if not all(name + ".bin" in files for name in META_FILES):
+            continue
+        meta = {}
+        for name in META_FILES + ("metaMerkle",):
+            if name + ".bin" in files:
+                with open(os.path.join(directory, name + ".bin"), "rb") as f:
+                    meta[name] = f.read()
+        with open_block_source(directory) as source:
+            meta.update(iv=source.iv, flags=source.flags, block_size=source.block_size,
+                        num_blocks=source.num_blocks + source.num_super_blocks,
+                        num_super_blocks=source.num_super_blocks)
+        records.append(pack_record(path_id(directory), meta))
+        if len(records) >= batch:
+            log.append_records(records)
+            count += len(records)
+            records = []
+    log.append_records(records)
+    return count + len(records)
+
+def main():
+    parser = argparse.ArgumentParser(description="Journal de métadonnées KNOB indexé par file_id.")
+    parser.add_argument("log", help="Fichier journal (créé si besoin ; l'index est <journal>.idx)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get = commands.add_parser("get", help="Afficher les métadonnées d'un fichier (JSON, champs binaires en base64)")
+    get.add_argument("file_id", help="file_id (chemin d'un dossier KNOB : son chemin absolu, voir --path)")
+    get.add_argument("--path", action="store_true", help="file_id est le chemin d'un dossier KNOB")
+    get.add_argument("--write-files", metavar="DIR", help="Écrire aussi les fichiers meta*.bin dans DIR")
+
+    export = commands.add_parser("export", help="Exporter les enregistrements en vigueur (journal compacté)")
+    export.add_argument("output")
+
+    import_ = commands.add_parser("import", help="Importer un export ou un autre journal")
+    import_.add_argument("inputs", nargs="+")
+
+    import_dirs = commands.add_parser("import-dirs", help="Importer les fichiers meta*.bin des dossiers KNOB d'une arborescence")
+    import_dirs.add_argument("root")
+
+    commands.add_parser("compact", help="Réécrire le journal sans les enregistrements remplacés")
+    commands.add_parser("reindex", help="Reconstruire l'index")
+    commands.add_parser("stats", help="Nombre d'enregistrements et taille du journal")
+    args = parser.parse_args()
+
+    writable = args.command in ("import", "import-dirs", "compact", "reindex")
+    try:
+        with MetadataLog(args.log, writable=writable) as log:
+            if args.command == "get":
+                from block_storage import encode_metadata
+                meta = log.get(path_id(args.file_id) if args.path else args.file_id)
+                if args.write_files:
+                    os.makedirs(args.write_files, exist_ok=True)
+                    for name in ("metaFK", "metaSK", "metaIndex", "metaSGX", "metaMerkle"):
+                        if name in meta:
+                            with open(os.path.join(args.write_files, name + ".bin"), "wb") as f:
+                                f.write(meta[name])
+                print(encode_metadata(meta))
+            elif args.command == "export":
+                print(f"{log.export(args.output)} enregistrements exportés dans {args.output}")
+            elif args.command == "import":
+                count = sum(log.import_file(filename) for filename in args.inputs)
+                print(f"{count} enregistrements importés dans {args.log}")
+            elif args.command == "import-dirs":
+                print(f"{import_knob_dirs(log, args.root)} dossiers KNOB importés dans {args.log}")
+            elif args.command == "compact":
+                print(f"Journal compacté : {log.compact()} enregistrements")
+            elif args.command == "reindex":
+                log.reindex()
+                print(f"Index reconstruit : {log.count} enregistrements")
+            else:
+                print(json.dumps(log.stats()))
+    except KeyError as e:
+        print(f"Fichier inconnu : {e.args[0]}")
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
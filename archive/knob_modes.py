@@ -0,0 +1,39 @@
+from Crypto.Cipher import AES
+
+# Mode de chiffrement de la couche FK. CBC (historique) enchaîne les blocs :
+# le chiffrement est strictement séquentiel. En CTR, le flux de clé d'un
+# bloc ne dépend que de FK, de l'IV du fichier et de la position du bloc :
+# des plages indépendantes se chiffrent en parallèle et un bloc quelconque se
+# déchiffre (ou se rechiffre) seul.
+#
+# Compteur CTR : nonce = 8 premiers octets de l'IV, compteur de 64 bits = position
+# dans le fichier / 16. Le padding et le découpage en blocs sont inchangés.
+#
+# Le mode est enregistré dans les métadonnées ("mode") et dans l'octet de
+# poids fort du champ flags (l'octet de poids faible est le codec de
+# compression) : flags = 0 désigne toujours un fichier CBC.
+MODES = {"cbc": 0, "ctr": 1}
+MODE_NAMES = {number: name for name, number in MODES.items()}
+MODE_SHIFT = 8
+MODE_MASK = 0xFF00
+NONCE_SIZE = 8
+
+def resolve_mode(name):
+    if name in (None, ""):
+        return "cbc"
+    if name not in MODES:
+        raise ValueError(f"Mode de chiffrement inconnu : {name} (choix : {', '.join(MODES)}).")
+    return name
+
+def mode_flags(name):
+    return MODES[name] << MODE_SHIFT
+
+def mode_from_flags(flags):
+    number = (flags & MODE_MASK) >> MODE_SHIFT
+    if number not in MODE_NAMES:
+        raise ValueError(f"Mode de chiffrement inconnu dans l'en-tête : {number}.")
+    return MODE_NAMES[number]
+
+def ctr_cipher(key, iv, offset):
+    """Chiffreur AES-CTR positionné à l'octet offset du fichier (multiple de 16)."""
+    return AES.new(key, AES.MODE_CTR, nonce=iv[:NONCE_SIZE], initial_value=offset // AES.block_size)
@@ -0,0 +1,25 @@
+from Crypto.Util.Padding import pad, unpad
+
+# PKCS7 ne peut pas coder plus de 255 octets de padding : avec des blocs de
+# 1 Ko, le dernier bloc est complété en ISO/IEC 7816-4 (0x80 puis des zéros)
+# dès que le padding dépasse cette limite. Un padding PKCS7 ne se termine
+# jamais par 0x00, les deux formats ne peuvent donc pas être confondus.
+PKCS7_MAX_PADDING = 255
+
+def pad_block(data, block_size):
+    """Complète le dernier bloc jusqu'à block_size (toujours au moins un octet)."""
+    padding_len = block_size - len(data) % block_size
+    if padding_len <= PKCS7_MAX_PADDING:
+        return pad(data, block_size)
+    return pad(data, block_size, style='iso7816')
+
+def unpad_block(data, block_size):
+    """Retire le padding ajouté par pad_block (ou par l'ancien pad PKCS7)."""
+    if data[-1] == 0:
+        return unpad(data, block_size, style='iso7816')
+    return unpad(data, block_size)
+
+def count_blocks(file_size, block_size):
+    """Nombre de blocs chiffrés produits pour un fichier de file_size octets."""
+    # Le padding ajoute toujours au moins un octet, d'où le +1
+    return file_size // block_size + 1
@@ -0,0 +1,114 @@
+from bisect import bisect_left
+from Crypto.Cipher import AES
+from block_prefetch import BlockFetcher
+from knob_compression import codec_from_flags
+from knob_modes import ctr_cipher, mode_from_flags
+from knob_padding import unpad_block
+from knob_unwrap import aes_decrypt, get_sk, get_super_blocks_indices
+from xor_metadata import compute_xor_metadata_batched
+
+class KnobReader:
+    """
+    Accès aléatoire à un fichier KNOB : seuls les blocs couvrant la plage
+    demandée sont lus et déchiffrés (CBC : l'IV d'un bloc est le bloc chiffré
+    qui le précède ; CTR : le compteur se déduit de la position du bloc). FK
+    n'est reconstituée qu'une fois, au premier accès.
+
+    Avec merkle = (arbre, racine) (voir knob_merkle), les blocs stockés lus
+    sont vérifiés avant d'être déchiffrés (ValueError s'ils sont altérés).
+    Lève ValueError si les données ont été compressées avant le chiffrement :
+    une plage du fichier compressé ne correspond à aucune plage du fichier.
+    """
+
+    def __init__(self, source, metaFK, super_block_indices, num_blocks, group_key, merkle=None):
+        if codec_from_flags(getattr(source, "flags", 0)) != "none":
+            raise ValueError("Lecture partielle impossible : les données ont été compressées avant le chiffrement.")
+        self.source = source
+        self.block_size = source.block_size
+        self.mode = mode_from_flags(getattr(source, "flags", 0))
+        self.metaFK = metaFK
+        self.group_key = group_key
+        self.super_block_indices = sorted(super_block_indices)
+        self.num_blocks = num_blocks
+        self.merkle = merkle
+        self._super_blocks = {}  # Super blocs déchiffrés avec GK, par indice
+        self._fk = None
+        self._size = None
+
+    def encrypted_block(self, i):
+        """Bloc i chiffré avec FK (les super blocs sont d'abord déchiffrés avec GK)."""
+        if not 0 <= i < self.num_blocks:
+            raise IndexError(i)
+        rank = bisect_left(self.super_block_indices, i)
+        if rank < len(self.super_block_indices) and self.super_block_indices[rank] == i:
+            if i not in self._super_blocks:
+                self._super_blocks[i] = aes_decrypt(self.source.super_block(rank), self.group_key,
+                                                    self.source.iv, self.block_size, False)
+            return self._super_blocks[i]
+        return self.source.block(i - rank)
+
+    def stored_block(self, i):
+        """(Position de stockage, bloc stocké) du bloc i : blocs ordinaires, puis super blocs."""
+        rank = bisect_left(self.super_block_indices, i)
+        if rank < len(self.super_block_indices) and self.super_block_indices[rank] == i:
+            return self.num_blocks - len(self.super_block_indices) + rank, self.source.super_block(rank)
+        return i - rank, self.source.block(i - rank)
+
+    def verify_blocks(self, first, end):
+        """Vérifie les blocs first à end - 1 avec l'arbre de Merkle (O(log n) hashes lus)."""
+        tree, root = self.merkle
+        if not tree.verify(dict(self.stored_block(i) for i in range(first, end)), root):
+            raise ValueError(f"Blocs {first} à {end - 1} altérés (arbre de Merkle).")
+
+    def file_key(self):
+        """Reconstitue FK (hachage de tous les blocs) une seule fois."""
+        if self._fk is None:
+            with BlockFetcher(self.source) as fetcher:
+                regular_blocks = fetcher.regular_blocks(0, self.num_blocks - len(self.super_block_indices))
+                super_blocks = [self.encrypted_block(i) for i in self.super_block_indices]
+                self._fk = compute_xor_metadata_batched(regular_blocks, self.metaFK, super_blocks)
+        return self._fk
+
+    def size(self):
+        """Taille du fichier déchiffré (le dernier bloc est déchiffré pour lire le padding)."""
+        if self._size is None:
+            last = self._decrypt_blocks(self.num_blocks - 1, self.num_blocks)
+            self._size = (self.num_blocks - 1) * self.block_size + len(unpad_block(last, self.block_size))
+        return self._size
+
+    def _decrypt_blocks(self, first, end):
+        """Déchiffre les blocs first à end - 1."""
+        bs = self.block_size
+        data = bytearray((end - first) * bs)
+        for i in range(first, end):
+            data[(i - first) * bs:(i - first + 1) * bs] = self.encrypted_block(i)
+        if self.mode == "ctr":
+            ctr_cipher(self.file_key(), self.source.iv, first * bs).decrypt(data, output=data)
+        else:
+            iv = self.source.iv if first == 0 else bytes(self.encrypted_block(first - 1)[-AES.block_size:])
+            AES.new(self.file_key(), AES.MODE_CBC, iv).decrypt(data, output=data)
+        return data
+
+    def decrypt_range(self, offset, length):
+        """Renvoie les octets [offset, offset + length) du fichier déchiffré."""
+        if offset < 0 or length < 0:
+            raise ValueError("offset et length doivent être positifs.")
+        if self.merkle and length:
+            # Blocs de la plage et dernier bloc (padding) vérifiés avant de reconstituer FK
+            first = min(offset // self.block_size, self.num_blocks - 1)
+            self.verify_blocks(first, min(self.num_blocks, (offset + length - 1) // self.block_size + 1))
+            self.verify_blocks(self.num_blocks - 1, self.num_blocks)
+        end = min(offset + length, self.size())
+        if offset >= end:
+            return b""
+
+        bs = self.block_size
+        first = offset // bs
+        data = self._decrypt_blocks(first, (end - 1) // bs + 1)
+        return bytes(data[offset - first * bs:end - first * bs])
+
+def open_reader(source, metaFK, metaIndex, metaSGX, group_key, knob_priv_key, merkle=None):
+    """Récupère SK (RSA) et les indices des super blocs, puis ouvre un KnobReader."""
+    sk = get_sk(knob_priv_key, metaSGX)
+    super_block_indices, num_blocks = get_super_blocks_indices(metaIndex, sk)
+    return KnobReader(source, metaFK, super_block_indices, num_blocks, group_key, merkle)
@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from Crypto.Cipher import AES
+from block_prefetch import FETCH_WORKERS, BlockFetcher
+from block_storage import StoreBlockSource
+from knob_compression import codec_from_flags, decompressor
+from knob_keyring import default_keyring
+from knob_modes import ctr_cipher, mode_from_flags
+from knob_padding import unpad_block
+from knob_unwrap import aes_decrypt, get_super_blocks_indices
+from xor_metadata import compute_xor_metadata_batched
+
+# Déchiffrement en flux, pour servir un fichier (HTTP, tube) sans fichier
+# temporaire : decrypt_stream génère les morceaux du fichier déchiffré, dans
+# l'ordre. Les blocs sont lus par fenêtres de CHUNK_SIZE octets, au plus
+# READ_AHEAD fenêtres à l'avance (lues par plusieurs threads pendant le
+# déchiffrement de la fenêtre courante, voir block_prefetch) ; les super blocs
+# sont déchiffrés avec GK au passage et le padding n'est retiré que sur le
+# dernier bloc.
+#
+# FK ne se reconstitue qu'en hachant tous les blocs (AONT) : elle est gardée
+# dans le trousseau (par file_id et empreinte de metaFK), les lectures
+# suivantes du même fichier commencent donc dès la première fenêtre.
+CHUNK_SIZE = 256 * 1024
+READ_AHEAD = 4
+
+def read_window(source, super_block_indices, first, end, group_key):
+    """Blocs first à end - 1 chiffrés avec FK (les super blocs sont déchiffrés avec GK au passage)."""
+    bs = source.block_size
+    data = bytearray((end - first) * bs)
+    view = memoryview(data)
+    rank = bisect_left(super_block_indices, first)
+    i = first
+    while i < end:
+        if rank < len(super_block_indices) and super_block_indices[rank] == i:
+            view[(i - first) * bs:(i - first + 1) * bs] = aes_decrypt(source.super_block(rank), group_key,
+                                                                      source.iv, bs, False)
+            rank += 1
+            i += 1
+            continue
+        # Blocs ordinaires jusqu'au prochain super bloc : une seule lecture
+        stop = min(end, super_block_indices[rank]) if rank < len(super_block_indices) else end
+        dst = view[(i - first) * bs:(stop - first) * bs]
+        dst[:] = source.read_blocks(i - rank, stop - i, dst)
+        i = stop
+    return data
+
+def decrypt_window(fk, iv, mode, offset, data, previous):
+    """
+    Déchiffre avec FK les blocs chiffrés data, situés à l'octet offset du
+    fichier. previous : bloc AES chiffré qui précède data (CBC seulement).
+    """
+    if mode == "ctr":
+        return ctr_cipher(fk, iv, offset).decrypt(data)
+    return AES.new(fk, AES.MODE_CBC, previous).decrypt(data)
+
+def recover_file_key(source, super_block_indices, num_blocks, group_key, metaFK, file_id=None, keyring=default_keyring):
+    """
+    FK du fichier, depuis le trousseau ou reconstituée (tous les blocs sont
+    hachés). Une FK qui ne déchiffre pas le dernier bloc en un padding valide
+    (blocs altérés, mauvaise GK) lève ValueError et n'est pas gardée.
+    """
+    bs = source.block_size
+    mode = mode_from_flags(getattr(source, "flags", 0))
+
+    def recover():
+        with BlockFetcher(source) as fetcher:
+            regular_blocks = fetcher.regular_blocks(0, num_blocks - len(super_block_indices))
+            super_blocks = [aes_decrypt(block, group_key, source.iv, bs, False)
+                            for block in fetcher.super_blocks().result()]
+            fk = compute_xor_metadata_batched(regular_blocks, metaFK, super_blocks)
+
+        # Contrôle sur le dernier bloc (en CBC, son IV est la fin du bloc précédent)
+        first = max(0, num_blocks - 2)
+        data = read_window(source, super_block_indices, first, num_blocks, group_key)
+        previous = source.iv if num_blocks == 1 else bytes(data[bs - AES.block_size:bs])
+        last = decrypt_window(fk, source.iv, mode, (num_blocks - 1) * bs, bytes(data[-bs:]), previous)
+        try:
+            unpad_block(last, bs)
+        except ValueError:
+            raise ValueError("FK reconstituée invalide : blocs altérés ou mauvaise clé de groupe.")
+        return fk
+
+    return keyring.file_key(metaFK, recover, file_id)
+
+def decrypted_chunks(source, super_block_indices, num_blocks, group_key, fk, chunk_size=CHUNK_SIZE,
+                     read_ahead=READ_AHEAD, workers=FETCH_WORKERS):
+    """Morceaux du fichier déchiffré (avant décompression), fenêtre par fenêtre, padding retiré à la fin."""
+    bs = source.block_size
+    iv = source.iv
+    mode = mode_from_flags(getattr(source, "flags", 0))
+    window = max(1, chunk_size // bs)
+    windows = [(first, min(first + window, num_blocks)) for first in range(0, num_blocks, window)]
+
+    # Lecture anticipée bornée : au plus read_ahead fenêtres en attente, lues sur workers threads.
+    # Générateur abandonné (client déconnecté) : les lectures en attente sont annulées à la fermeture.
+    with BlockFetcher(source, depth=read_ahead, workers=workers) as fetcher:
+        reads = fetcher.prefetch(lambda first=first, end=end: read_window(source, super_block_indices, first, end,
+                                                                          group_key)
+                                 for first, end in windows)
+        previous = iv
+        for (first, end), data in zip(windows, reads):
+            plain = decrypt_window(fk, iv, mode, first * bs, data, previous)
+            previous = bytes(data[-AES.block_size:])
+            if end == num_blocks:
+                plain = plain[:-bs] + unpad_block(plain[-bs:], bs)
+            if plain:
+                yield plain
+
+def decrypt_stream(source, super_block_indices, num_blocks, group_key, metaFK, file_id=None, chunk_size=CHUNK_SIZE,
+                   read_ahead=READ_AHEAD, keyring=default_keyring):
+    """
+    Génère les morceaux du fichier déchiffré (décompressé si besoin), pour
+    l'envoyer au fur et à mesure. super_block_indices doit être trié. La
+    source doit rester ouverte jusqu'à la fin de l'itération.
+    """
+    super_block_indices = sorted(super_block_indices)
+    fk = recover_file_key(source, super_block_indices, num_blocks, group_key, metaFK, file_id, keyring)
+    chunks = decrypted_chunks(source, super_block_indices, num_blocks, group_key, fk, chunk_size, read_ahead)
+
+    codec = codec_from_flags(getattr(source, "flags", 0))
+    if codec == "none":
+        yield from chunks
+        return
+    decompress = decompressor(codec)
+    for chunk in chunks:
+        data = decompress.decompress(chunk)
+        if data:
+            yield data
+    data = decompress.flush()
+    if data:
+        yield data
+
+def stream_file(store, file_id, group_key, knob_priv_key, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD,
+                keyring=default_keyring):
+    """
+    Génère les morceaux du fichier file_id d'un BlockStore (voir block_storage),
+    métadonnées comprises : SK (RSA) et FK sont gardées dans le trousseau.
+    Lève KeyError si le fichier est inconnu.
+    """
+    meta = store.get_metadata(file_id)
+    sk = keyring.unwrap_sk(knob_priv_key, meta["metaSGX"])
+    super_block_indices, num_blocks = get_super_blocks_indices(meta["metaIndex"], sk)
+    with StoreBlockSource(store, file_id) as source:
+        yield from decrypt_stream(source, super_block_indices, num_blocks, group_key, meta["metaFK"], file_id,
+                                  chunk_size, read_ahead, keyring)
@@ -0,0 +1,47 @@
+from knob_padding import count_blocks
+
+# Choix de la taille de bloc et du nombre de super blocs d'un fichier.
+#
+# - Taille de bloc : la plus petite puissance de deux (au moins MIN_BLOCK_SIZE)
+#   qui garde le fichier sous MAX_BLOCKS blocs. Chaque bloc coûte un hachage
+#   et un objet : des blocs de 1 Ko pour un fichier de plusieurs Go en font des
+#   millions.
+# - Nombre de super blocs : autant que le budget de rotation le permet (octets
+#   rechiffrés par fichier lors d'un changement de GK), au moins
+#   MIN_SUPER_BLOCKS et au plus le nombre de blocs du fichier.
+#
+# Avec les valeurs par défaut, les fichiers de moins de 64 Mo gardent les
+# paramètres historiques : blocs de 1 Ko et 2 super blocs.
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+MAX_BLOCKS = 65536
+MIN_SUPER_BLOCKS = 2
+ROTATION_BUDGET = 2 * 1024  # Octets de super blocs par fichier
+
+def choose_block_size(file_size, max_blocks=MAX_BLOCKS):
+    block_size = MIN_BLOCK_SIZE
+    while block_size < MAX_BLOCK_SIZE and count_blocks(file_size, block_size) > max_blocks:
+        block_size *= 2
+    return block_size
+
+def choose_super_blocks(num_blocks, block_size, rotation_budget=ROTATION_BUDGET):
+    return min(num_blocks, max(MIN_SUPER_BLOCKS, rotation_budget // block_size))
+
+def check_parameters(block_size, num_super_blocks, num_blocks):
+    """Vérifie des paramètres donnés explicitement."""
+    if block_size <= 0 or block_size % 16:
+        raise ValueError(f"Taille de bloc invalide : {block_size} (multiple de 16 octets attendu).")
+    if not 1 <= num_super_blocks <= num_blocks:
+        raise ValueError(f"Impossible de sélectionner {num_super_blocks} super blocs parmi {num_blocks} blocs.")
+
+def tune(file_size, block_size=None, num_super_blocks=None, rotation_budget=ROTATION_BUDGET):
+    """
+    Renvoie (taille de bloc, nombre de super blocs, nombre de blocs) ; les
+    paramètres non donnés sont choisis à partir de la taille du fichier.
+    """
+    block_size = block_size or choose_block_size(file_size)
+    num_blocks = count_blocks(file_size, block_size)
+    if num_super_blocks is None:
+        num_super_blocks = choose_super_blocks(num_blocks, block_size, rotation_budget)
+    check_parameters(block_size, num_super_blocks, num_blocks)
+    return block_size, num_super_blocks, num_blocks
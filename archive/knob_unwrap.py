@@ -0,0 +1,38 @@
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+from knob_keyring import default_keyring
+from superblock_index import decode_index
+
+# Déchiffrement des métadonnées d'un fichier KNOB (SK, index des super blocs)
+# et des super blocs, commun à decryption_service, knob_reader, knob_stream
+# et knob_daemon. Module sans dépendance vers eux : knob_reader peut être
+# importé par decryption_service sans import circulaire.
+
+def aes_decrypt(encrypted_data, key, iv=None, block_size=AES.block_size, unpadd=True, cipher=None):
+    # Extraire l'IV des premiers 16 octets
+    if (iv is None):
+        iv = encrypted_data[:16]
+        cipher_text = encrypted_data[16:]  # Le reste est le texte chiffré
+    else:
+        cipher_text = encrypted_data
+    
+    # Initialiser le déchiffreur AES en mode CBC
+    if cipher is None:
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+
+    decrypted_data = cipher.decrypt(cipher_text)
+    if unpadd:
+        return unpad(decrypted_data, block_size)
+    return decrypted_data
+
+def get_sk(knob_priv_key, metaSGX):
+    """ Utilise RSA pour récupérer SK (gardée dans le trousseau : un fichier relu ne refait pas le RSA)"""
+    return default_keyring.unwrap_sk(knob_priv_key, metaSGX)
+
+def get_super_blocks_indices(metaIndex, sk):
+    """ Récupère les indices des super blocs (triés) et le nombre de blocs"""
+    try:
+        index = aes_decrypt(metaIndex, sk)
+    except ValueError: # Anciens index dont la longueur était déjà un multiple de 16 : pas de padding
+        index = aes_decrypt(metaIndex, sk, unpadd=False)
+    return decode_index(index)
@@ -0,0 +1,268 @@
+import hashlib
+import mmap
+import os
+import struct
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import unpad
+from parallel_decryption import decrypt_cbc_sharded
+
+# Mix&Slice sur un fichier chiffré en AES-CBC classique (IV de 16 octets puis
+# chiffré). Révoquer un mini-bloc de 64 octets revient à lui ajouter une couche
+# de chiffrement avec la nouvelle clé, sur place : XOR avec le flux AES-CTR de
+# la nouvelle clé à la position du mini-bloc (même longueur, seuls ces octets
+# sont réécrits). Sans la nouvelle clé, le mini-bloc, et donc le fichier, n'est
+# plus lisible. Chaque lot tire un nonce aléatoire : le flux n'est jamais
+# réutilisé d'un lot ou d'un fichier à l'autre avec la même clé. Un mini-bloc
+# déjà révoqué avec une clé ne l'est pas une seconde fois avec elle.
+#
+# Les mini-blocs révoqués sont enregistrés dans un fichier annexe
+# (<fichier>.mixslice), ajouté par lots :
+#
+#   MAGIC | lot* où lot = nombre (4 o) | enregistrements | COMMIT
+#   enregistrement = indice du mini-bloc (8 o) | identifiant de clé (8 o) | nonce du lot (8 o)
+#                    | octets d'avant (64 o)
+#
+# Le lot est écrit avant de modifier le fichier et validé après. Un lot non
+# validé (interruption) est annulé à la réouverture grâce aux octets d'avant.
+# Une fois le lot validé, ses octets d'avant sont mis à zéro dans l'annexe :
+# gardés, ils rendraient le chiffré d'avant la révocation, lisible avec
+# l'ancienne clé seule. Une interruption entre la validation et la remise à
+# zéro est rattrapée à la réouverture.
+MACRO_BLOCK_SIZE = 4096
+MINI_BLOCK_SIZE = 64
+IV_SIZE = 16
+READ_BLOCK_SIZE = 1024  # Taille de lecture de encrypt_classic (règle du padding)
+
+SIDECAR_SUFFIX = ".mixslice"
+MAGIC = b"KNOBMSX2"
+COMMIT = b"MSCOMMIT"
+BATCH_HEADER = struct.Struct("<I")
+NONCE_SIZE = 8
+RECORD = struct.Struct(f"<Q8s{NONCE_SIZE}s{MINI_BLOCK_SIZE}s")
+BEFORE_OFFSET = RECORD.size - MINI_BLOCK_SIZE
+ZERO_BEFORE = bytes(MINI_BLOCK_SIZE)
+
+def key_id(key):
+    """Identifiant d'une clé de couche (8 premiers octets de son SHA-256)."""
+    return hashlib.sha256(key).digest()[:8]
+
+def layer(data, key, nonce, offset):
+    """XOR de data avec le flux AES-CTR (key, nonce) à la position offset (dans le chiffré) : involutif."""
+    return AES.new(key, AES.MODE_CTR, nonce=nonce, initial_value=offset // AES.block_size).encrypt(data)
+
+def mini_block_range(index, body_size):
+    """Position (dans le chiffré, après l'IV) et longueur du mini-bloc index."""
+    start = index * MINI_BLOCK_SIZE
+    if not 0 <= start < body_size:
+        raise IndexError(f"Mini-bloc {index} hors du fichier.")
+    return start, min(MINI_BLOCK_SIZE, body_size - start)
+
+def sidecar_name(filename):
+    return filename + SIDECAR_SUFFIX
+
+def read_sidecar(filename):
+    """
+    Renvoie (lots validés, lot non validé ou None, longueur validée). Chaque
+    lot est une liste de (indice, identifiant de clé, nonce, octets d'avant).
+    """
+    try:
+        with open(sidecar_name(filename), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], None, 0
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{sidecar_name(filename)} n'est pas un fichier Mix&Slice.")
+
+    batches = []
+    pos = len(MAGIC)
+    while pos < len(data):
+        start = pos
+        if pos + BATCH_HEADER.size > len(data):
+            return batches, [], start
+        (count,) = BATCH_HEADER.unpack_from(data, pos)
+        pos += BATCH_HEADER.size
+        records = []
+        for _ in range(count):
+            if pos + RECORD.size > len(data):
+                return batches, records, start
+            records.append(RECORD.unpack_from(data, pos))
+            pos += RECORD.size
+        if data[pos:pos + len(COMMIT)] != COMMIT:
+            return batches, records, start
+        pos += len(COMMIT)
+        batches.append(records)
+    return batches, None, pos
+
+class MixSliceFile:
+    """Fichier AES-CBC classique ouvert pour des révocations de mini-blocs sur place (mmap)."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._sidecar = None
+        self._file = open(filename, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self.body_size = len(self._mmap) - IV_SIZE
+        if self.body_size <= 0 or self.body_size % AES.block_size:
+            self.close()
+            raise ValueError(f"{filename} n'est pas un fichier AES-CBC classique.")
+
+        batches, pending, committed = read_sidecar(filename)
+        if pending is not None:
+            self._rollback(pending, committed)
+        self.revoked = {}  # indice -> identifiants des couches, dans l'ordre d'application
+        for records in batches:
+            for index, kid, _, _ in records:
+                self.revoked.setdefault(index, []).append(kid)
+
+        # Annexe gardée ouverte : un lot ne coûte que ses écritures (pas de mode
+        # ajout : la remise à zéro des octets d'avant écrit au milieu du fichier)
+        name = sidecar_name(filename)
+        self._sidecar = open(name, "r+b" if os.path.exists(name) else "w+b")
+        if self._sidecar.seek(0, os.SEEK_END) == 0:
+            self._sidecar.write(MAGIC)
+        if any(before != ZERO_BEFORE for records in batches for _, _, _, before in records):
+            # Interruption après une validation : octets d'avant encore présents
+            self._erase_undo(len(MAGIC), [len(records) for records in batches])
+            os.fsync(self._sidecar.fileno())
+
+    def _rollback(self, records, committed):
+        """Annule un lot interrompu : les octets d'avant sont remis, le lot est retiré de l'annexe."""
+        for index, _, _, before in reversed(records):
+            start, length = mini_block_range(index, self.body_size)
+            self._mmap[IV_SIZE + start:IV_SIZE + start + length] = before[:length]
+        self._mmap.flush()
+        with open(sidecar_name(self.filename), "r+b") as f:
+            f.truncate(committed)
+            os.fsync(f.fileno())
+
+    def _erase_undo(self, position, counts):
+        """Met à zéro les octets d'avant des lots validés, à partir de position (en-tête du premier lot)."""
+        f = self._sidecar
+        for count in counts:
+            for k in range(count):
+                f.seek(position + BATCH_HEADER.size + k * RECORD.size + BEFORE_OFFSET)
+                f.write(ZERO_BEFORE)
+            position += BATCH_HEADER.size + count * RECORD.size + len(COMMIT)
+        f.seek(0, os.SEEK_END)
+        f.flush()
+
+    def revoke(self, indices, new_key, durable=True):
+        """
+        Ajoute la couche new_key aux mini-blocs indices, en un seul lot : seuls
+        leurs octets sont réécrits. Les mini-blocs déjà révoqués avec new_key
+        sont ignorés (une seconde couche de la même clé ne doit pas être
+        appliquée). Renvoie le nombre de mini-blocs révoqués. Avec
+        durable=False, pas de fsync : le lot ne coûte que ses écritures, mais
+        une panne du système peut perdre le lot.
+        """
+        kid = key_id(new_key)
+        indices = [index for index in dict.fromkeys(indices) if kid not in self.revoked.get(index, ())]
+        if not indices:
+            return 0
+        ranges = [mini_block_range(index, self.body_size) for index in indices]
+        nonce = get_random_bytes(NONCE_SIZE)
+
+        # 1. Lot (avec les octets d'avant) écrit durablement dans l'annexe
+        f = self._sidecar
+        position = f.tell()
+        batch = bytearray(BATCH_HEADER.pack(len(indices)))
+        for index, (start, length) in zip(indices, ranges):
+            before = self._mmap[IV_SIZE + start:IV_SIZE + start + length]
+            batch += RECORD.pack(index, kid, nonce, before)
+        f.write(batch)
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+
+        # 2. Couche appliquée sur place
+        for index, (start, length) in zip(indices, ranges):
+            offset = IV_SIZE + start
+            self._mmap[offset:offset + length] = layer(self._mmap[offset:offset + length], new_key, nonce, start)
+            self.revoked.setdefault(index, []).append(kid)
+        if durable:
+            self._mmap.flush()
+
+        # 3. Lot validé
+        f.write(COMMIT)
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+
+        # 4. Octets d'avant effacés : la révocation ne peut plus être défaite
+        self._erase_undo(position, [len(indices)])
+        if durable:
+            os.fsync(f.fileno())
+        return len(indices)
+
+    def close(self):
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def revoke_mini_blocks(filename, indices, new_key):
+    with MixSliceFile(filename) as f:
+        return f.revoke(indices, new_key)
+
+def decrypt_file(input_file, output_file, key, layer_keys=(), workers=1):
+    """
+    Déchiffre un fichier Mix&Slice : déchiffrement CBC de tout le fichier, puis
+    correction des seuls blocs AES touchés par une couche, dont les positions
+    sont lues dans l'annexe (aucun essai de clé). Lève KeyError si une clé de
+    couche manque.
+    """
+    keys = {key_id(k): k for k in layer_keys}
+    batches, pending, _ = read_sidecar(input_file)
+    if pending is not None:
+        raise ValueError(f"{input_file} : révocation interrompue, rouvrir le fichier avec MixSliceFile pour l'annuler.")
+    revoked = {}
+    for records in batches:
+        for index, kid, nonce, _ in records:
+            if kid not in keys:
+                raise KeyError(f"Mini-bloc {index} révoqué : clé {kid.hex()} manquante.")
+            revoked.setdefault(index, []).append((keys[kid], nonce))
+
+    with open(input_file, "rb") as infile, open(output_file, "w+b") as outfile:
+        size = os.fstat(infile.fileno()).st_size - IV_SIZE
+        if size <= 0:
+            return
+        outfile.truncate(size)
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as src, mmap.mmap(outfile.fileno(), size) as dst:
+            iv = src[:IV_SIZE]
+            src_view, dst_view = memoryview(src), memoryview(dst)
+            try:
+                decrypt_cbc_sharded(key, iv, src_view[IV_SIZE:], dst_view, workers)
+            finally:
+                src_view.release()
+                dst_view.release()
+
+            # Un mini-bloc modifié fausse ses propres blocs AES et le bloc qui le
+            # suit (CBC) : ils sont déchiffrés à nouveau à partir du chiffré corrigé
+            def ciphertext(start, end):
+                data = bytearray(src[IV_SIZE + start:IV_SIZE + end])
+                for index in range(start // MINI_BLOCK_SIZE, (end - 1) // MINI_BLOCK_SIZE + 1):
+                    for layer_key, nonce in reversed(revoked.get(index, ())):
+                        m_start, m_length = mini_block_range(index, size)
+                        lo, hi = max(m_start, start), min(m_start + m_length, end)
+                        data[lo - start:hi - start] = layer(data[lo - start:hi - start], layer_key, nonce, lo)
+                return data
+
+            for index in sorted(revoked):
+                start, length = mini_block_range(index, size)
+                end = min(start + length + AES.block_size, size)
+                previous = ciphertext(start - AES.block_size, start) if start else iv
+                dst[start:end] = AES.new(key, AES.MODE_CBC, bytes(previous)).decrypt(bytes(ciphertext(start, end)))
+            last_block = dst[size - AES.block_size:size]
+
+        if size % READ_BLOCK_SIZE:  # Dernier bloc incomplet → retirer le padding (comme decrypt_classic)
+            outfile.truncate(size - AES.block_size + len(unpad(last_block, AES.block_size)))
@@ -0,0 +1,120 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from Crypto.Cipher import AES
+from knob_modes import ctr_cipher
+
+# En CBC, chaque bloc AES ne dépend que de son chiffré et du chiffré précédent
+# (qui sert d'IV) : le déchiffrement se découpe en tranches indépendantes.
+# PyCryptodome relâche le GIL pendant les appels AES, les threads suffisent
+# donc pour occuper plusieurs cœurs.
+MIN_SHARD_SIZE = 1024 * 1024  # Pas de tranche de moins de 1 Mo
+
+def shard_ranges(length, workers, min_shard_size=None):
+    """
+    Découpe [0, length) en tranches alignées sur AES.block_size, au plus une
+    par worker. Sans min_shard_size, MIN_SHARD_SIZE est lu à chaque appel.
+    """
+    if length == 0:
+        return []
+    min_shard_size = min_shard_size or MIN_SHARD_SIZE
+    num_shards = max(1, min(workers, length // min_shard_size))
+    shard_size = -(-length // num_shards)
+    shard_size += -shard_size % AES.block_size
+    return [(start, min(start + shard_size, length)) for start in range(0, length, shard_size)]
+
+def shard_ivs(iv, ciphertext, ranges):
+    """IV de chaque tranche : le dernier bloc chiffré de la tranche précédente (copié)."""
+    return [iv if start == 0 else bytes(ciphertext[start - AES.block_size:start]) for start, _ in ranges]
+
+def decrypt_shard(key, iv, ciphertext, output):
+    AES.new(key, AES.MODE_CBC, iv).decrypt(ciphertext, output=output)
+
+def decrypt_cbc_sharded(key, iv, ciphertext, output, workers=None):
+    """
+    Déchiffre ciphertext dans output (tampon inscriptible de même taille) sur un
+    pool de threads. ciphertext et output peuvent être le même tampon : les IV
+    des tranches sont copiés avant de lancer le déchiffrement.
+    """
+    workers = workers or os.cpu_count() or 1
+    ciphertext = memoryview(ciphertext)
+    output = memoryview(output)
+    ranges = shard_ranges(len(ciphertext), workers)
+    ivs = shard_ivs(iv, ciphertext, ranges)
+
+    if len(ranges) <= 1:
+        if ranges:
+            decrypt_shard(key, iv, ciphertext, output)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(decrypt_shard, key, shard_iv, ciphertext[start:end], output[start:end])
+                   for shard_iv, (start, end) in zip(ivs, ranges)]
+        for future in futures:
+            future.result()
+
+def decrypt_file_shard(key, iv, src_file, src_offset, dst_file, dst_offset, length):
+    """Déchiffre length octets de src_file vers dst_file (exécuté dans un processus du pool)."""
+    with open(src_file, "rb") as fsrc, open(dst_file, "r+b") as fdst:
+        with mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ) as src, mmap.mmap(fdst.fileno(), 0) as dst:
+            src_view, dst_view = memoryview(src), memoryview(dst)
+            try:
+                decrypt_shard(key, iv, src_view[src_offset:src_offset + length], dst_view[dst_offset:dst_offset + length])
+            finally:
+                src_view.release()
+                dst_view.release()
+
+def decrypt_file_sharded(key, iv, src_file, src_offset, dst_file, dst_offset, length, workers=None):
+    """
+    Même découpage que decrypt_cbc_sharded, mais sur un pool de processus : chaque
+    processus projette lui-même les fichiers en mémoire. dst_file doit déjà
+    avoir sa taille finale.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = shard_ranges(length, workers)
+
+    if len(ranges) <= 1:
+        if ranges:
+            decrypt_file_shard(key, iv, src_file, src_offset, dst_file, dst_offset, length)
+        return
+
+    ivs = []
+    with open(src_file, "rb") as f:
+        for start, _ in ranges:
+            if start == 0:
+                ivs.append(iv)
+            else:
+                f.seek(src_offset + start - AES.block_size)
+                ivs.append(f.read(AES.block_size))
+
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(decrypt_file_shard, key, shard_iv, src_file, src_offset + start,
+                                   dst_file, dst_offset + start, end - start)
+                   for shard_iv, (start, end) in zip(ivs, ranges)]
+        for future in futures:
+            future.result()
+
+def crypt_ctr_shard(key, iv, offset, data, output):
+    ctr_cipher(key, iv, offset).encrypt(data, output=output)
+
+def crypt_ctr_sharded(key, iv, offset, data, output, workers=None, min_shard_size=None):
+    """
+    Chiffre ou déchiffre (c'est la même opération) en AES-CTR data, situé à
+    l'octet offset du fichier, dans output. Les tranches sont indépendantes :
+    aucun IV à copier, data et output peuvent être le même tampon.
+    """
+    workers = workers or os.cpu_count() or 1
+    data = memoryview(data)
+    output = memoryview(output)
+    ranges = shard_ranges(len(data), workers, min_shard_size)
+
+    if len(ranges) <= 1:
+        if ranges:
+            crypt_ctr_shard(key, iv, offset, data, output)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(crypt_ctr_shard, key, iv, offset + start, data[start:end], output[start:end])
+                   for start, end in ranges]
+        for future in futures:
+            future.result()
@@ -1,84 +1,68 @@
+import argparse
 import os
+import shutil
 import sys
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from mixslice_engine import MACRO_BLOCK_SIZE, MINI_BLOCK_SIZE, IV_SIZE, MixSliceFile, sidecar_name
 import time
 
 # Constantes
 BLOCK_SIZE = 1024  # Taille d'un bloc en octets (1 Ko)
-MACRO_BLOCK_SIZE = 4096  # Taille d'un macro-bloc
-MINI_BLOCK_SIZE = 64  # Taille d'un mini-bloc
 KEY_SIZE = 32  # Clé AES-256
 
-def reencrypt_mixslice(input_file, output_file, old_key, new_key, mini_block_index=0):
+def reencrypt_mixslice(input_file, output_file, new_key, mini_block_index=0, mini_blocks=None):
     """
-    Déchiffre un fichier avec old_key, modifie un mini-bloc, et rechiffre avec new_key.
+    Révoque des mini-blocs avec new_key, sur place dans output_file (copie de
+    input_file s'il est différent). Par défaut, le mini-bloc mini_block_index
+    du macro-bloc central ; mini_blocks donne directement les indices de
+    mini-blocs à révoquer en un seul lot. L'ancienne clé n'est pas nécessaire :
+    la couche s'ajoute au chiffré existant. Les mini-blocs déjà révoqués avec
+    new_key sont laissés tels quels.
     """
     start_time = time.time()
 
-    with open(input_file, "rb") as infile:
-        iv = infile.read(16)  # Lire l'IV stocké au début du fichier
-        encrypted_data = infile.read()
+    body_size = os.path.getsize(input_file) - IV_SIZE
+    num_macro_blocks = body_size // MACRO_BLOCK_SIZE
 
-    num_macro_blocks = len(encrypted_data) // MACRO_BLOCK_SIZE
+    if mini_blocks is None:
+        if num_macro_blocks == 0:
+            print("Erreur : Fichier trop petit pour Mix&Slice.")
+            sys.exit(1)
 
-    if num_macro_blocks == 0:
-        print("Erreur : Fichier trop petit pour Mix&Slice.")
-        sys.exit(1)
-
-    # Sélection d'un macro-bloc aléatoire
-    macro_index = num_macro_blocks // 2  # On prend le bloc central pour l'exemple
-    macro_offset = macro_index * MACRO_BLOCK_SIZE
-
-    # Déchiffrement du macro-bloc avec la clé classique
-    cipher = AES.new(old_key, AES.MODE_CBC, iv)
-    decrypted_macro = cipher.decrypt(encrypted_data[macro_offset:macro_offset + MACRO_BLOCK_SIZE])
-
-    # Sélection du mini-bloc à rechiffrer
-    mini_offset = mini_block_index * MINI_BLOCK_SIZE
-    mini_block = decrypted_macro[mini_offset:mini_offset + MINI_BLOCK_SIZE]
-
-    # Rechiffrement avec la nouvelle clé
-    cipher_new = AES.new(new_key, AES.MODE_CBC, iv)
-    new_encrypted_mini_block = cipher_new.encrypt(pad(mini_block, MINI_BLOCK_SIZE))
+        # Sélection d'un macro-bloc (on prend le bloc central pour l'exemple)
+        macro_index = num_macro_blocks // 2
+        mini_blocks = [macro_index * (MACRO_BLOCK_SIZE // MINI_BLOCK_SIZE) + mini_block_index]
 
-    # Mise à jour du macro-bloc
-    modified_macro = (
-        decrypted_macro[:mini_offset] +
-        new_encrypted_mini_block +
-        decrypted_macro[mini_offset + MINI_BLOCK_SIZE:]
-    )
+    if os.path.abspath(output_file) != os.path.abspath(input_file):
+        shutil.copyfile(input_file, output_file)
+        if os.path.exists(sidecar_name(input_file)):
+            shutil.copyfile(sidecar_name(input_file), sidecar_name(output_file))
 
-    # Réinsertion dans les données finales
-    modified_data = (
-        encrypted_data[:macro_offset] +
-        modified_macro +
-        encrypted_data[macro_offset + MACRO_BLOCK_SIZE:]
-    )
-
-    # Écriture du fichier modifié
-    with open(output_file, "wb") as outfile:
-        outfile.write(iv)  # Réécriture de l'IV
-        outfile.write(modified_data)
+    try:
+        with MixSliceFile(output_file) as f:
+            count = f.revoke(mini_blocks, new_key)
+    except (IndexError, ValueError) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
 
     end_time = time.time()
-    print(f"Rechiffrement Mix&Slice terminé en {end_time - start_time:.4f} secondes.")
+    skipped = len(set(mini_blocks)) - count
+    if skipped:
+        print(f"{skipped} mini-blocs déjà révoqués avec cette clé : ignorés.")
+    print(f"Rechiffrement Mix&Slice de {count} mini-blocs terminé en {end_time - start_time:.6f} secondes.")
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: python reencrypt_mixslice.py <input_file> <output_file>")
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Révocation de mini-blocs Mix&Slice (sur place).")
+    parser.add_argument("input_file", help="Fichier chiffré (e.g. test_encrypted.bin)")
+    parser.add_argument("output_file", help="Fichier de sortie (le même que input_file pour modifier sur place)")
+    parser.add_argument("--mini-blocks", help="Indices des mini-blocs à révoquer, séparés par des virgules")
+    args = parser.parse_args()
 
-    # Chargement des clés
-    with open("classic_key.bin", "rb") as key_file:
-        old_key = key_file.read()
+    # Chargement de la nouvelle clé
     with open("mixslice_new_key.bin", "rb") as key_file:
         new_key = key_file.read()
 
-    reencrypt_mixslice(input_file, output_file, old_key, new_key)
+    mini_blocks = [int(i) for i in args.mini_blocks.split(",")] if args.mini_blocks else None
+    reencrypt_mixslice(args.input_file, args.output_file, new_key, mini_blocks=mini_blocks)
 
 if __name__ == "__main__":
     main()
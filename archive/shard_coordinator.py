@@ -0,0 +1,502 @@
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    from kazoo.client import KazooClient
+    from kazoo.exceptions import BadVersionError, NodeExistsError, NoNodeError
+except ImportError:  # kazoo absent : seule la coordination SQLite est disponible
+    KazooClient = None
+
+# Répartition d'un travail de masse (rotation, chiffrement par lots) entre
+# plusieurs nœuds.
+#
+# Les éléments d'un travail (chemins, file_id) sont triés puis découpés en
+# tranches contiguës (shards). Un nœud prend un bail sur une tranche, réclame
+# ses éléments un à un et les déclare terminés ; le bail est renouvelé par des
+# battements de cœur. Une tranche dont le bail expire (nœud arrêté) est reprise
+# par un autre nœud, qui retraite les éléments réclamés mais non terminés : les
+# traitements doivent pouvoir être rejoués (la rotation l'est grâce à son
+# journal). Un nœud sans tranche libre vole la seconde moitié du reste de la
+# tranche la plus chargée : les retardataires sont soulagés.
+#
+# L'état d'une tranche est un petit document JSON versionné, modifié par
+# comparaison-échange : la même logique sert pour SQLite (stockage local de
+# référence) et pour ZooKeeper. Les expirations sont des dates absolues : les
+# horloges des nœuds doivent être synchronisées (NTP), TTL ≫ décalage.
+LEASE_TTL = 30.0  # Secondes
+NUM_SHARDS = 64
+MIN_STEAL = 2     # Éléments restants au-dessous desquels une tranche n'est pas volée
+CAS_RETRIES = 32
+
+class LeaseLost(Exception):
+    """Le bail a expiré ou a été repris par un autre nœud."""
+
+class Lease:
+    def __init__(self, job, shard, worker, token):
+        self.job = job
+        self.shard = shard
+        self.worker = worker
+        self.token = token
+
+    def __repr__(self):
+        return f"Lease({self.job!r}, {self.shard}, {self.worker!r}, {self.token})"
+
+def new_shard(start, end, owner=None, token=0, expires=0.0):
+    return {"start": start, "end": end, "cursor": start, "pending": [], "retry": [],
+            "owner": owner, "token": token, "expires": expires}
+
+def has_work(state):
+    return bool(state["retry"] or state["pending"] or state["cursor"] < state["end"])
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class Coordinator:
+    """
+    Logique commune. Les sous-classes fournissent le stockage : _create_job,
+    _item, _shards, _shard, _update (comparaison-échange) et _split (mise à
+    jour d'une tranche et création d'une autre, atomiquement).
+    """
+
+    def __init__(self, ttl=LEASE_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+
+    def create_job(self, job, items, num_shards=NUM_SHARDS):
+        """Crée le travail s'il n'existe pas (chaque nœud peut l'appeler). Renvoie True s'il a été créé."""
+        items = sorted(set(items))
+        num_shards = max(1, min(num_shards, len(items)))
+        bounds = [len(items) * n // num_shards for n in range(num_shards + 1)]
+        shards = [new_shard(bounds[n], bounds[n + 1]) for n in range(num_shards)]
+        return self._create_job(job, items, shards)
+
+    def acquire(self, job, worker):
+        """Bail sur une tranche libre (ou expirée), sinon sur une moitié volée. None s'il n'y a rien à prendre."""
+        for _ in range(CAS_RETRIES):
+            now = self.clock()
+            shards = self._shards(job)
+
+            free = [(shard, state, version) for shard, state, version in shards
+                    if has_work(state) and (state["owner"] is None or state["expires"] < now)]
+            if free:
+                # Choix au hasard : moins de conflits entre nœuds qui démarrent ensemble
+                shard, state, version = random.choice(free)
+                state["retry"] += state["pending"]  # Réclamés par l'ancien titulaire, peut-être non traités
+                state["pending"] = []
+                state.update(owner=worker, token=state["token"] + 1, expires=now + self.ttl)
+                if self._update(job, shard, state, version):
+                    return Lease(job, shard, worker, state["token"])
+                continue
+
+            victims = [(state["end"] - state["cursor"], shard, state, version) for shard, state, version in shards
+                       if state["owner"] not in (None, worker) and state["expires"] >= now
+                       and state["end"] - state["cursor"] >= MIN_STEAL]
+            if not victims:
+                return None
+            _, shard, state, version = max(victims, key=lambda victim: victim[0])
+            mid = state["cursor"] + (state["end"] - state["cursor"]) // 2
+            stolen = new_shard(mid, state["end"], worker, 1, now + self.ttl)
+            state["end"] = mid
+            new_id = max(shard for shard, _, _ in shards) + 1
+            if self._split(job, shard, state, version, new_id, stolen):
+                return Lease(job, new_id, worker, 1)
+        return None
+
+    def _modify(self, lease, change):
+        """Applique change(état) à la tranche du bail (renouvelé au passage). LeaseLost si le bail n'est plus valide."""
+        for _ in range(CAS_RETRIES):
+            state, version = self._shard(lease.job, lease.shard)
+            now = self.clock()
+            if state["owner"] != lease.worker or state["token"] != lease.token or state["expires"] < now:
+                raise LeaseLost(lease)
+            result = change(state)
+            if state["owner"] is not None:
+                state["expires"] = now + self.ttl
+            if self._update(lease.job, lease.shard, state, version):
+                return result
+        raise LeaseLost(lease)
+
+    def claim(self, lease):
+        """Élément suivant de la tranche : (indice, élément), ou None si elle n'a plus rien à distribuer."""
+        def change(state):
+            if state["retry"]:
+                index = state["retry"].pop(0)
+            elif state["cursor"] < state["end"]:
+                index = state["cursor"]
+                state["cursor"] += 1
+            else:
+                return None
+            state["pending"].append(index)
+            return index
+
+        index = self._modify(lease, change)
+        return None if index is None else (index, self._item(lease.job, index))
+
+    def complete(self, lease, index):
+        """Déclare l'élément terminé. Une tranche vidée est libérée ; renvoie True dans ce cas."""
+        def change(state):
+            if index in state["pending"]:
+                state["pending"].remove(index)
+            if not has_work(state):
+                state["owner"] = None
+                return True
+            return False
+        return self._modify(lease, change)
+
+    def heartbeat(self, lease):
+        """Renouvelle le bail. LeaseLost s'il a été perdu."""
+        self._modify(lease, lambda state: None)
+
+    def release(self, lease):
+        """Rend la tranche : ses éléments réclamés non terminés seront redistribués."""
+        def change(state):
+            state["retry"] += state["pending"]
+            state["pending"] = []
+            state["owner"] = None
+        try:
+            self._modify(lease, change)
+        except LeaseLost:
+            pass
+
+    def status(self, job):
+        """
+        Bilan du travail : éléments terminés, en cours, restants, tranches, et
+        éléments restants par nœud actif (workers).
+        """
+        now = self.clock()
+        summary = {"items": 0, "completed": 0, "pending": 0, "remaining": 0, "shards": 0, "workers": {}}
+        for _, state, _ in self._shards(job):
+            remaining = len(state["retry"]) + state["end"] - state["cursor"]
+            summary["shards"] += 1
+            summary["items"] += state["end"] - state["start"]
+            summary["pending"] += len(state["pending"])
+            summary["remaining"] += remaining
+            if state["owner"] is not None and state["expires"] >= now:
+                summary["workers"][state["owner"]] = summary["workers"].get(state["owner"], 0) + remaining
+        summary["completed"] = summary["items"] - summary["pending"] - summary["remaining"]
+        return summary
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SQLiteCoordinator(Coordinator):
+    """Coordination par une base SQLite partagée (une machine, ou un système de fichiers qui gère les verrous)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (job TEXT PRIMARY KEY, num_items INTEGER);
+        CREATE TABLE IF NOT EXISTS items (job TEXT, item_index INTEGER, item TEXT, PRIMARY KEY (job, item_index));
+        CREATE TABLE IF NOT EXISTS shards (job TEXT, shard INTEGER, version INTEGER, state TEXT,
+                                           PRIMARY KEY (job, shard));
+    """
+
+    def __init__(self, filename, ttl=LEASE_TTL, clock=time.time):
+        super().__init__(ttl, clock)
+        self.filename = filename
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions explicites (BEGIN IMMEDIATE) : pas de verrou pris en lecture puis promu
+            connection = sqlite3.connect(self.filename, check_same_thread=False, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _create_job(self, job, items, shards):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT 1 FROM jobs WHERE job = ?", (job,)).fetchone():
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("INSERT INTO jobs VALUES (?, ?)", (job, len(items)))
+            connection.executemany("INSERT INTO items VALUES (?, ?, ?)", ((job, n, item) for n, item in enumerate(items)))
+            connection.executemany("INSERT INTO shards VALUES (?, ?, 0, ?)",
+                                   ((job, n, json.dumps(state)) for n, state in enumerate(shards)))
+            connection.execute("COMMIT")
+            return True
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _item(self, job, index):
+        return self._connection().execute("SELECT item FROM items WHERE job = ? AND item_index = ?",
+                                          (job, index)).fetchone()[0]
+
+    def _shards(self, job):
+        rows = self._connection().execute("SELECT shard, state, version FROM shards WHERE job = ? ORDER BY shard", (job,))
+        return [(shard, json.loads(state), version) for shard, state, version in rows]
+
+    def _shard(self, job, shard):
+        state, version = self._connection().execute("SELECT state, version FROM shards WHERE job = ? AND shard = ?",
+                                                     (job, shard)).fetchone()
+        return json.loads(state), version
+
+    def _update(self, job, shard, state, version):
+        cursor = self._connection().execute(
+            "UPDATE shards SET state = ?, version = version + 1 WHERE job = ? AND shard = ? AND version = ?",
+            (json.dumps(state), job, shard, version))
+        return cursor.rowcount == 1
+
+    def _split(self, job, shard, state, version, new_shard_id, new_state):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._update(job, shard, state, version):
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("INSERT INTO shards VALUES (?, ?, 0, ?)", (job, new_shard_id, json.dumps(new_state)))
+            connection.execute("COMMIT")
+            return True
+        except sqlite3.IntegrityError:
+            connection.execute("ROLLBACK")
+            return False
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+class ZooKeeperCoordinator(Coordinator):
+    """
+    Coordination par ZooKeeper (voir Zookeeper.md) :
+
+      <root>/<travail>                  b"creating" puis b"ready"
+      <root>/<travail>/items/<n>        éléments n * ITEMS_PER_NODE et suivants (JSON)
+      <root>/<travail>/shards/<n>       état de la tranche n (JSON, version ZooKeeper)
+    """
+
+    ITEMS_PER_NODE = 2000  # Nœuds bien au-dessous de la limite de 1 Mo
+
+    def __init__(self, hosts, root="/knob/jobs", ttl=LEASE_TTL, clock=time.time, client=None):
+        super().__init__(ttl, clock)
+        if client is None:
+            if KazooClient is None:
+                raise ImportError("ZooKeeperCoordinator nécessite kazoo (pip install kazoo).")
+            client = KazooClient(hosts=hosts)
+            client.start()
+            self._owns_client = True
+        else:
+            self._owns_client = False
+        self.client = client
+        self.root = root.rstrip("/")
+        self._items = {}
+
+    def _path(self, job, *parts):
+        return "/".join((self.root, job) + tuple(str(part) for part in parts))
+
+    def _create_job(self, job, items, shards):
+        try:
+            self.client.create(self._path(job), b"creating", makepath=True)
+        except NodeExistsError:
+            # Créé par un autre nœud : attendre qu'il soit complet
+            while self.client.get(self._path(job))[0] != b"ready":
+                time.sleep(0.1)
+            return False
+        for n in range(0, len(items), self.ITEMS_PER_NODE):
+            self.client.create(self._path(job, "items", n // self.ITEMS_PER_NODE),
+                               json.dumps(items[n:n + self.ITEMS_PER_NODE]).encode(), makepath=True)
+        for n, state in enumerate(shards):
+            self.client.create(self._path(job, "shards", f"{n:08d}"), json.dumps(state).encode(), makepath=True)
+        self.client.set(self._path(job), b"ready")
+        return True
+
+    def _item(self, job, index):
+        node = index // self.ITEMS_PER_NODE
+        items = self._items.get((job, node))
+        if items is None:
+            items = json.loads(self.client.get(self._path(job, "items", node))[0])
+            self._items[(job, node)] = items
+        return items[index % self.ITEMS_PER_NODE]
+
+    def _shards(self, job):
+        shards = []
+        for name in sorted(self.client.get_children(self._path(job, "shards"))):
+            try:
+                data, stat = self.client.get(self._path(job, "shards", name))
+            except NoNodeError:
+                continue
+            shards.append((int(name), json.loads(data), stat.version))
+        return shards
+
+    def _shard(self, job, shard):
+        data, stat = self.client.get(self._path(job, "shards", f"{shard:08d}"))
+        return json.loads(data), stat.version
+
+    def _update(self, job, shard, state, version):
+        try:
+            self.client.set(self._path(job, "shards", f"{shard:08d}"), json.dumps(state).encode(), version=version)
+            return True
+        except BadVersionError:
+            return False
+
+    def _split(self, job, shard, state, version, new_shard_id, new_state):
+        transaction = self.client.transaction()
+        transaction.set_data(self._path(job, "shards", f"{shard:08d}"), json.dumps(state).encode(), version=version)
+        transaction.create(self._path(job, "shards", f"{new_shard_id:08d}"), json.dumps(new_state).encode())
+        return not any(isinstance(result, Exception) for result in transaction.commit())
+
+    def close(self):
+        if self._owns_client:
+            self.client.stop()
+            self.client.close()
+            self._owns_client = False
+
+def open_coordinator(url, ttl=LEASE_TTL):
+    """Coordinateur désigné par url : zk://<hôte:port>[,...][/racine], sinon sqlite://<fichier> ou un fichier SQLite."""
+    if url.startswith("zk://"):
+        hosts, _, root = url[len("zk://"):].partition("/")
+        return ZooKeeperCoordinator(hosts, "/" + root if root else "/knob/jobs", ttl)
+    if url.startswith("sqlite://"):
+        url = url[len("sqlite://"):]
+    return SQLiteCoordinator(url, ttl)
+
+class WorkStream:
+    """
+    Éléments d'un travail attribués à ce nœud, à parcourir comme une liste :
+    les baux sont pris, renouvelés (thread de battements de cœur) et rendus au
+    fil de l'eau. Chaque élément traité est signalé par complete(). decode
+    transforme l'élément stocké (chaîne) en valeur produite.
+    """
+
+    def __init__(self, coordinator, job, worker=None, decode=None, poll=1.0):
+        self.coordinator = coordinator
+        self.job = job
+        self.worker = worker or default_worker_id()
+        self.decode = decode or (lambda item: item)
+        self.poll = poll
+        self.claimed = 0
+        self.lost = 0
+        self._leases = {}     # shard -> bail actif
+        self._in_flight = {}  # valeur -> (bail, indice)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.coordinator.ttl / 3):
+            with self._lock:
+                leases = list(self._leases.values())
+            for lease in leases:
+                try:
+                    self.coordinator.heartbeat(lease)
+                except LeaseLost:
+                    self._drop(lease)
+
+    def __iter__(self):
+        lease = None
+        while True:
+            if lease is None:
+                lease = self.coordinator.acquire(self.job, self.worker)
+                if lease is None:
+                    # Rien à prendre : attendre tant que d'autres nœuds ont des éléments
+                    # non réclamés (leur bail peut expirer). Les éléments seulement en
+                    # cours ailleurs ne retiennent pas ce nœud : un nœud arrêté avant de
+                    # les terminer les laisse à la prochaine exécution.
+                    workers = self.coordinator.status(self.job)["workers"]
+                    if not any(remaining for worker, remaining in workers.items() if worker != self.worker):
+                        return
+                    time.sleep(self.poll)
+                    continue
+                with self._lock:
+                    self._leases[lease.shard] = lease
+            try:
+                claimed = self.coordinator.claim(lease)
+            except LeaseLost:
+                self._drop(lease)
+                lease = None
+                continue
+            if claimed is None:
+                lease = None  # Tranche épuisée : gardée jusqu'à la fin des éléments en cours
+                continue
+            index, item = claimed
+            value = self.decode(item)
+            with self._lock:
+                self._in_flight[value] = (lease, index)
+            self.claimed += 1
+            yield value
+
+    def _drop(self, lease):
+        """
+        Bail perdu (une tranche libérée par complete() n'est pas comptée). Un
+        ancien bail de la tranche, reprise depuis par ce nœud, laisse le
+        nouveau en place.
+        """
+        with self._lock:
+            if self._leases.get(lease.shard) is lease:
+                del self._leases[lease.shard]
+                self.lost += 1
+
+    def complete(self, value):
+        """
+        Élément terminé. Renvoie False si le bail a été perdu : un autre nœud
+        le retraitera. Un élément en échec n'est pas signalé : il est rendu
+        avec la tranche (close) et retraité plus tard.
+        """
+        with self._lock:
+            lease, index = self._in_flight.pop(value)
+        try:
+            if self.coordinator.complete(lease, index):
+                with self._lock:
+                    self._leases.pop(lease.shard, None)
+            return True
+        except LeaseLost:
+            self._drop(lease)
+            return False
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat.join()
+        with self._lock:
+            leases = list(self._leases.values())
+            self._leases = {}
+        for lease in leases:
+            self.coordinator.release(lease)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="État d'un travail réparti (tranches, baux, avancement).")
+    parser.add_argument("coordinator", help="zk://<hôtes>[/racine], sqlite://<fichier> ou fichier SQLite")
+    parser.add_argument("job", help="Nom du travail")
+    args = parser.parse_args()
+
+    try:
+        with open_coordinator(args.coordinator) as coordinator:
+            status = coordinator.status(args.job)
+    except (ImportError, sqlite3.Error) as e:
+        print(f"Erreur : {e}")
+        sys.exit(1)
+    print(json.dumps(status, indent=2))
+
+if __name__ == "__main__":
+    main()
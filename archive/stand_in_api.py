@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serveur local qui imite l'API de stockage (/upload et /store_metadata) pour
+# les essais et les bancs d'essai du client d'envoi. Les corps (chunked ou non)
+# sont lus en flux et écrits directement sur disque.
+API_KEY = "1234567890abcdef"
+READ_SIZE = 256 * 1024
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def body_chunks(self):
+        """Corps de la requête, en Transfer-Encoding: chunked ou Content-Length."""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                while size:
+                    chunk = self.rfile.read(min(size, READ_SIZE))
+                    if not chunk:
+                        raise ValueError("Corps tronqué.")
+                    size -= len(chunk)
+                    yield chunk
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, READ_SIZE))
+                if not chunk:
+                    raise ValueError("Corps tronqué.")
+                remaining -= len(chunk)
+                yield chunk
+
+    def receive_part(self, destination):
+        """Écrit dans destination le contenu de l'unique partie multipart de la requête."""
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get("Content-Type", ""))
+        if not match:
+            raise ValueError("Requête multipart attendue.")
+        trailer = f"\r\n--{match.group(1)}--\r\n".encode()
+
+        head = b""
+        tail = b""  # Derniers octets écrits, pour vérifier la fin de la partie
+        size = 0
+        with open(destination, "wb") as f:
+            for chunk in self.body_chunks():
+                if head is not None:
+                    head += chunk
+                    end = head.find(b"\r\n\r\n")
+                    if end == -1:
+                        continue
+                    chunk, head = head[end + 4:], None
+                f.write(chunk)
+                size += len(chunk)
+                tail = (tail + chunk[-len(trailer):])[-len(trailer):]
+
+            # La fin de la partie n'est connue qu'une fois le corps entièrement lu
+            if head is not None or tail != trailer:
+                raise ValueError("Corps multipart invalide.")
+            f.truncate(size - len(trailer))
+        return size - len(trailer)
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        if self.headers.get("X-API-KEY") != server.api_key:
+            self.close_connection = True
+            return self.reply(401, {"error": "Clé d'API invalide"})
+        if random.random() < server.fail_rate:
+            # Panne simulée : le corps est lu puis ignoré
+            for _ in self.body_chunks():
+                pass
+            return self.reply(503, {"error": "Indisponible"})
+
+        try:
+            if self.path == "/upload":
+                file_id = uuid.uuid4().hex
+                size = self.receive_part(os.path.join(server.storage_dir, file_id + ".bin"))
+                with server.lock:
+                    server.stats["uploads"] += 1
+                    server.stats["bytes"] += size
+                return self.reply(200, {"file_id": file_id})
+            if self.path == "/store_metadata":
+                destination = os.path.join(server.storage_dir, uuid.uuid4().hex + ".part")
+                self.receive_part(destination)
+                with open(destination, "rb") as f:
+                    metadata = json.load(f)
+                os.replace(destination, os.path.join(server.storage_dir, metadata["file_id"] + ".json"))
+                with server.lock:
+                    server.stats["metadata"] += 1
+                return self.reply(200, {"status": "ok"})
+        except (ValueError, KeyError) as e:
+            self.close_connection = True
+            return self.reply(400, {"error": str(e)})
+
+        self.close_connection = True
+        self.reply(404, {"error": "Inconnu"})
+
+def make_server(host="127.0.0.1", port=0, storage_dir=None, api_key=API_KEY, fail_rate=0.0):
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.storage_dir = storage_dir or tempfile.mkdtemp(prefix="knob-api-")
+    os.makedirs(server.storage_dir, exist_ok=True)
+    server.api_key = api_key
+    server.fail_rate = fail_rate
+    server.lock = threading.Lock()
+    server.stats = {"uploads": 0, "metadata": 0, "bytes": 0}
+    return server
+
+def start_server(host="127.0.0.1", port=0, storage_dir=None, api_key=API_KEY, fail_rate=0.0):
+    """Démarre le serveur dans un thread, renvoie (serveur, URL)."""
+    server = make_server(host, port, storage_dir, api_key, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local imitant l'API de stockage.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--storage", default=None, help="Dossier où ranger les fichiers reçus")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Proportion de réponses 503 simulées")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.storage, fail_rate=args.fail_rate)
+    print(f"Serveur sur http://{args.host}:{args.port}, fichiers dans {server.storage_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
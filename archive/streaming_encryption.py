@@ -0,0 +1,161 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from knob_modes import ctr_cipher, resolve_mode
+from knob_padding import pad_block
+from xor_metadata import hash_batch
+import instrumentation
+
+# Constantes
+BLOCK_SIZE = 1024   # Taille de bloc en octets (1 Ko)
+CHUNK_SIZE = 256 * 1024  # Octets lus et chiffrés par appel AES (au moins un bloc)
+
+def selection_sampler(num_blocks, num_super_blocks, rng=random):
+    """
+    Tirage séquentiel (algorithme S de Knuth) : indique pour chaque bloc, dans
+    l'ordre, s'il est un super bloc. Chaque sous-ensemble de num_super_blocks
+    blocs a la même probabilité d'être tiré, en mémoire constante.
+    """
+    remaining = num_super_blocks
+    for i in range(num_blocks):
+        if rng.randrange(num_blocks - i) < remaining:
+            remaining -= 1
+            yield True
+        else:
+            yield False
+
+def read_full(infile, view):
+    """Remplit view autant que possible, renvoie le nombre d'octets lus."""
+    total = 0
+    while total < len(view):
+        n = infile.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+class StreamingEncryptor:
+    """
+    Chiffrement KNOB en une seule passe : chiffrement avec FK (AES-CBC ou
+    AES-CTR, voir knob_modes), accumulation de metaFK, tirage des super blocs
+    et chiffrement avec GK.
+
+    En CTR, chaque lot est découpé en tranches chiffrées et hachées sur
+    workers threads (PyCryptodome relâche le GIL pendant les appels AES).
+    La mémoire utilisée ne dépend que de CHUNK_SIZE, de workers et du nombre
+    de super blocs.
+    """
+
+    def __init__(self, file_key, gk_key, num_blocks, num_super_blocks, block_size=BLOCK_SIZE, iv=None,
+                 mode="cbc", workers=None):
+        if num_super_blocks > num_blocks:
+            raise ValueError(f"Impossible de sélectionner {num_super_blocks} super blocs parmi {num_blocks} blocs.")
+        self.file_key = file_key
+        self.gk_key = gk_key
+        self.num_blocks = num_blocks
+        self.num_super_blocks = num_super_blocks
+        self.block_size = block_size
+        self.iv = iv if iv is not None else get_random_bytes(16)
+        self.mode = resolve_mode(mode)
+        self.workers = (workers or os.cpu_count() or 1) if self.mode == "ctr" else 1
+        self.super_block_indices = []
+        self.encrypted_super_blocks = []
+        self._meta = 0
+
+    def encrypt(self, infile):
+        """
+        Génère (indice, bloc, est_super_bloc) pour chaque bloc du fichier chiffré.
+
+        Les blocs ordinaires sont des memoryview sur un tampon réutilisé : ils
+        doivent être consommés (écrits) avant de passer au bloc suivant.
+        """
+        bs = self.block_size
+        inst = instrumentation.current()
+        sampler = selection_sampler(self.num_blocks, self.num_super_blocks)
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        if self.mode == "cbc":
+            cipher = AES.new(self.file_key, AES.MODE_CBC, self.iv)
+
+        chunk = max(1, self.workers * CHUNK_SIZE // bs) * bs
+        buffer = bytearray(chunk + bs)  # Place pour le bloc de padding
+        encrypted = bytearray(len(buffer))
+        view = memoryview(buffer)
+        out = memoryview(encrypted)
+
+        index = 0
+        try:
+            while True:
+                with inst.stage("read"):
+                    n = read_full(infile, view[:chunk])
+                inst.add_bytes("read", n)
+                last = n < chunk
+                full = n - n % bs if last else n
+                if last:
+                    # Dernier bloc -> on ajoute du padding
+                    view[full:full + bs] = pad_block(bytes(view[full:n]), bs)
+                    full += bs
+
+                with inst.stage("fk_encrypt", full):
+                    if self.mode == "cbc":
+                        cipher.encrypt(view[:full], output=out[:full])
+                    else:
+                        self._run(executor, self._encrypt_ctr, index * bs, view, out, full)
+
+                # Formation de metaFK : hachage du lot entier avant émission
+                with inst.stage("meta_fk", full):
+                    self._meta ^= self._run(executor, self._hash, index * bs, view, out, full)
+
+                for offset in range(0, full, bs):
+                    yield self._emit(index, out[offset:offset + bs], next(sampler, False))
+                    index += 1
+
+                if last:
+                    break
+        finally:
+            if executor:
+                executor.shutdown()
+
+        if index != self.num_blocks:
+            raise ValueError(f"Le fichier a produit {index} blocs au lieu de {self.num_blocks}.")
+
+    def _run(self, executor, task, position, data, output, length):
+        """
+        Exécute task(position, données, sortie) sur des tranches de blocs entiers
+        de [0, length), sur le pool s'il existe. Renvoie le XOR des résultats.
+        """
+        bs = self.block_size
+        if executor is None:
+            return task(position, data[:length], output[:length]) or 0
+        shard = -(-(length // bs) // self.workers) * bs
+        futures = [executor.submit(task, position + start, data[start:min(start + shard, length)],
+                                   output[start:min(start + shard, length)])
+                   for start in range(0, length, shard)]
+        result = 0
+        for future in futures:
+            result ^= future.result() or 0
+        return result
+
+    def _encrypt_ctr(self, position, data, output):
+        ctr_cipher(self.file_key, self.iv, position).encrypt(data, output=output)
+
+    def _hash(self, position, data, output):
+        bs = self.block_size
+        return hash_batch([output[offset:offset + bs] for offset in range(0, len(output), bs)])
+
+    def _emit(self, index, block, is_super):
+        """Chiffre le bloc avec GK s'il s'agit d'un super bloc."""
+        if not is_super:
+            return index, block, False
+
+        with instrumentation.stage("gk_encrypt", len(block)):
+            cipher = AES.new(self.gk_key, AES.MODE_CBC, self.iv)
+            super_block = cipher.encrypt(block)
+        self.super_block_indices.append(index)
+        self.encrypted_super_blocks.append(super_block)
+        return index, super_block, True
+
+    def meta_fk(self):
+        """metaFK : XOR des hashes de tous les blocs chiffrés avec FK, puis de FK."""
+        return (self._meta ^ int.from_bytes(self.file_key, "big")).to_bytes(32, "big")
@@ -0,0 +1,99 @@
+import struct
+
+# Index compact des super blocs (texte clair de metaIndex).
+#
+# L'ancien format est une chaîne ASCII de '0' et de '1' (un octet par bloc).
+# Le nouveau commence par un octet nul, ce qui suffit à distinguer les deux :
+#
+#   MAGIC | version (1 o) | codage (1 o) | nombre de blocs (varint) | données
+#
+# - BITSET : un bit par bloc (N / 8 octets) ;
+# - DELTAS : nombre de super blocs puis écarts entre indices triés (varints),
+#   décodé en O(k).
+# Le codage le plus court des deux est retenu.
+MAGIC = b"\x00KIX"
+VERSION = 1
+BITSET = 0
+DELTAS = 1
+
+def encode_varint(value, out):
+    """Ajoute un entier positif à out, 7 bits par octet."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, pos):
+    """Lit un varint à la position pos, renvoie (valeur, nouvelle position)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def encode_index(num_blocks, super_block_indices):
+    """Code les indices des super blocs parmi num_blocks blocs."""
+    indices = sorted(super_block_indices)
+
+    deltas = bytearray()
+    encode_varint(len(indices), deltas)
+    previous = -1
+    for i in indices:
+        encode_varint(i - previous - 1, deltas)
+        previous = i
+
+    if len(deltas) <= (num_blocks + 7) // 8:
+        encoding, payload = DELTAS, deltas
+    else:
+        bitset = bytearray((num_blocks + 7) // 8)
+        for i in indices:
+            bitset[i >> 3] |= 1 << (i & 7)
+        encoding, payload = BITSET, bitset
+
+    header = bytearray(MAGIC + struct.pack("BB", VERSION, encoding))
+    encode_varint(num_blocks, header)
+    return bytes(header + payload)
+
+def decode_index(data):
+    """Renvoie (indices triés des super blocs, nombre de blocs)."""
+    if not data.startswith(MAGIC):
+        return decode_legacy_index(data)
+
+    version, encoding = struct.unpack_from("BB", data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"Version d'index inconnue : {version}")
+    num_blocks, pos = decode_varint(data, len(MAGIC) + 2)
+
+    indices = []
+    if encoding == DELTAS:
+        count, pos = decode_varint(data, pos)
+        previous = -1
+        for _ in range(count):
+            delta, pos = decode_varint(data, pos)
+            previous += delta + 1
+            indices.append(previous)
+    elif encoding == BITSET:
+        bits = int.from_bytes(data[pos:pos + (num_blocks + 7) // 8], "little")
+        while bits:
+            lowest = bits & -bits
+            indices.append(lowest.bit_length() - 1)
+            bits ^= lowest
+    else:
+        raise ValueError(f"Codage d'index inconnu : {encoding}")
+    return indices, num_blocks
+
+def decode_legacy_index(data):
+    """Ancien format : '0' ou '1' par bloc, la lecture s'arrête au premier autre caractère."""
+    data = bytes(data)
+    num_blocks = len(data) - len(data.lstrip(b"01"))
+
+    indices = []
+    i = data.find(b"1", 0, num_blocks)
+    while i != -1:
+        indices.append(i)
+        i = data.find(b"1", i + 1, num_blocks)
+    return indices, num_blocks
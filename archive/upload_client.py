@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+# Client d'envoi vers l'API de stockage.
+#
+# - Une seule session requests : les connexions sont réutilisées (keep-alive)
+#   au lieu d'en ouvrir une par appel, le pool est dimensionné sur la
+#   concurrence voulue.
+# - Les corps multipart sont produits en flux (Transfer-Encoding: chunked) :
+#   le fichier chiffré n'est jamais entièrement en mémoire.
+# - Les erreurs réseau, 429 et 5xx sont retentées un nombre borné de fois avec
+#   un délai exponentiel (et une part aléatoire).
+# - upload_many enchaîne /upload puis /store_metadata pour chaque fichier, les
+#   fichiers étant traités en parallèle (asyncio, un thread par requête).
+CHUNK_SIZE = 256 * 1024
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def multipart_body(field, filename, chunks, boundary):
+    """Corps multipart/form-data d'une seule partie, produit au fil de chunks."""
+    yield (f"--{boundary}\r\n"
+           f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+           "Content-Type: application/octet-stream\r\n\r\n").encode()
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+def file_chunks(filename, chunk_size=CHUNK_SIZE):
+    """Lit filename par morceaux de chunk_size octets."""
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+def serialize_metadata(file_id, meta):
+    """Métadonnées en JSON (champs binaires en base64) au lieu de str(dict)."""
+    record = {"file_id": file_id}
+    for name in ("metaFK", "metaSK", "metaIndex", "metaSGX"):
+        record[name] = base64.b64encode(meta[name]).decode()
+    if "metaMerkle" in meta:
+        record["metaMerkle"] = base64.b64encode(meta["metaMerkle"]).decode()
+    for name in ("block_size", "num_super_blocks", "compression", "mode"):
+        if name in meta:
+            record[name] = meta[name]
+    return json.dumps(record).encode()
+
+class UploadClient:
+    """Envoi des fichiers chiffrés et de leurs métadonnées à l'API REST."""
+
+    def __init__(self, base_url, api_key, pool_size=8, timeout=(5, 60), retries=3, backoff=0.5):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.headers["X-API-KEY"] = api_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post_stream(self, endpoint, field, filename, chunks_factory):
+        """
+        Envoie une partie multipart en flux et renvoie la réponse JSON.
+        chunks_factory() doit renvoyer un nouvel itérable à chaque tentative.
+        """
+        for attempt in range(self.retries + 1):
+            boundary = uuid.uuid4().hex
+            try:
+                response = self.session.post(
+                    f"{self.base_url}{endpoint}",
+                    data=multipart_body(field, filename, chunks_factory(), boundary),
+                    headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                    timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+                response.close()
+            time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random() / 2))
+
+    def upload(self, chunks_factory, filename="encrypted_file.bin"):
+        """Envoie un fichier chiffré, renvoie son file_id."""
+        return self.post_stream("/upload", "file", filename, chunks_factory)["file_id"]
+
+    def store_metadata(self, file_id, meta):
+        body = serialize_metadata(file_id, meta)
+        return self.post_stream("/store_metadata", "metadata", "metadata.json", lambda: [body])
+
+    async def upload_async(self, chunks_factory, filename="encrypted_file.bin"):
+        return await asyncio.to_thread(self.upload, chunks_factory, filename)
+
+    async def store_metadata_async(self, file_id, meta):
+        return await asyncio.to_thread(self.store_metadata, file_id, meta)
+
+    async def upload_many(self, jobs, concurrency=None):
+        """
+        jobs : itérable de (chunks_factory, meta). Chaque fichier est envoyé puis
+        ses métadonnées, au plus concurrency fichiers à la fois. Renvoie, dans
+        l'ordre des jobs, le file_id ou l'exception levée.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.pool_size)
+
+        async def run(chunks_factory, meta):
+            async with semaphore:
+                file_id = await self.upload_async(chunks_factory)
+                await self.store_metadata_async(file_id, meta)
+                return file_id
+
+        return await asyncio.gather(*(run(chunks_factory, meta) for chunks_factory, meta in jobs),
+                                    return_exceptions=True)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def bench(num_files, file_size, concurrency, storage_dir):
+    """Envoie num_files fichiers aléatoires au serveur de test local."""
+    from stand_in_api import start_server
+
+    server, url = start_server(storage_dir=storage_dir)
+    payload = os.urandom(file_size)
+    meta = {name: os.urandom(32) for name in ("metaFK", "metaSK", "metaIndex", "metaSGX")}
+    chunks_factory = lambda: (payload[i:i + CHUNK_SIZE] for i in range(0, file_size, CHUNK_SIZE))
+
+    try:
+        with UploadClient(url, server.api_key, pool_size=concurrency) as client:
+            start_time = time.perf_counter()
+            results = asyncio.run(client.upload_many([(chunks_factory, meta)] * num_files, concurrency))
+            elapsed = time.perf_counter() - start_time
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    size_mb = num_files * file_size / (1024 * 1024)
+    print(f"{num_files - len(failures)} fichiers envoyés ({size_mb:.1f} Mo) en {elapsed:.2f} secondes "
+          f"({size_mb / elapsed:.1f} Mo/s), {len(failures)} échecs.")
+    return not failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du client d'envoi contre le serveur de test local.")
+    parser.add_argument("--files", type=int, default=64, help="Nombre de fichiers à envoyer")
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="Taille de chaque fichier en octets")
+    parser.add_argument("--concurrency", type=int, default=8, help="Nombre d'envois simultanés")
+    parser.add_argument("--storage", default=None, help="Dossier de stockage du serveur (par défaut, temporaire)")
+    args = parser.parse_args()
+
+    if not bench(args.files, args.size, args.concurrency, args.storage):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
 import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:  # NumPy est optionnel : repli sur les entiers Python
+    np = None
+
+HASH_SIZE = 32      # Taille d'un hash SHA-256
+BATCH_SIZE = 4096   # Nombre de blocs hachés par tâche
 
 def xor_bytes(a, b):
     """Effectue un XOR entre deux valeurs de même longueur."""
-    return bytes(x ^ y for x, y in zip(a, b))
+    n = min(len(a), len(b))
+    return (int.from_bytes(a[:n], "big") ^ int.from_bytes(b[:n], "big")).to_bytes(n, "big")
 
 def compute_xor_metadata(blocks, key, additional_elements=None):
     """
@@ -37,3 +49,66 @@ def compute_xor_metadata(blocks, key, additional_elements=None):
     meta = xor_bytes(meta, key)
 
     return meta
+
+def xor_fold(digests):
+    """XOR de hashes SHA-256 concaténés, renvoyé sous forme d'entier."""
+    if np is not None:
+        words = np.frombuffer(digests, dtype=np.uint64).reshape(-1, HASH_SIZE // 8)
+        return int.from_bytes(np.bitwise_xor.reduce(words, axis=0).tobytes(), "big")
+
+    meta = 0
+    for offset in range(0, len(digests), HASH_SIZE):
+        meta ^= int.from_bytes(digests[offset:offset + HASH_SIZE], "big")
+    return meta
+
+def hash_batch(batch):
+    """Hache un lot de blocs et renvoie le XOR de leurs hashes (entier)."""
+    sha256 = hashlib.sha256
+    return xor_fold(b"".join([sha256(block).digest() for block in batch]))
+
+def batches(iterable, batch_size):
+    """Découpe un itérable en listes de batch_size éléments."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def xor_hashes(blocks, workers=None, batch_size=BATCH_SIZE):
+    """
+    XOR des hashes SHA-256 de tous les blocs (entier), calculé par lots sur
+    plusieurs threads. hashlib relâche le GIL pour les tampons de plus de 2 Ko :
+    le parallélisme n'est réel qu'au-delà de cette taille de bloc.
+    """
+    workers = workers or os.cpu_count() or 1
+    meta = 0
+
+    if workers == 1:
+        for batch in batches(blocks, batch_size):
+            meta ^= hash_batch(batch)
+        return meta
+
+    # Au plus 2 lots par thread en vol : mémoire bornée même pour un générateur
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for batch in batches(blocks, batch_size):
+            pending.append(executor.submit(hash_batch, batch))
+            if len(pending) >= 2 * workers:
+                meta ^= pending.pop(0).result()
+        for future in pending:
+            meta ^= future.result()
+    return meta
+
+def compute_xor_metadata_batched(blocks, key, additional_elements=None, workers=None, batch_size=BATCH_SIZE):
+    """Même résultat que compute_xor_metadata, avec hachage par lots en parallèle."""
+    if not blocks:
+        raise ValueError("Liste de blocs vide, impossible de calculer le XOR.")
+
+    meta = xor_hashes(blocks, workers, batch_size)
+    if additional_elements:
+        meta ^= xor_hashes(additional_elements, workers, batch_size)
+
+    key = key[:HASH_SIZE]
+    meta = (meta >> 8 * (HASH_SIZE - len(key))) ^ int.from_bytes(key, "big")
+    return meta.to_bytes(len(key), "big")
@@ -0,0 +1,58 @@
+import os
+import sys
+import pytest
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+
+# Les modules sont à plat dans archive/ et s'importent par leur nom
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "archive"))
+
+from block_container import open_block_source
+from decryption_service import decrypt_to_file
+from encryption_service import KEY_SIZE, encrypt_knob
+from knob_unwrap import get_sk, get_super_blocks_indices
+
+@pytest.fixture(scope="session")
+def knob_key():
+    """Clé RSA knob (privée), générée une fois pour toute la session."""
+    return RSA.generate(2048)
+
+@pytest.fixture
+def group_key():
+    return get_random_bytes(KEY_SIZE)
+
+@pytest.fixture
+def key_files(tmp_path, group_key, knob_key):
+    """(fichier GK, fichier de la clé RSA knob) pour les commandes."""
+    gk_file, knob_key_file = tmp_path / "gk_key", tmp_path / "knob-pri-key"
+    gk_file.write_bytes(group_key)
+    knob_key_file.write_bytes(knob_key.export_key())
+    return str(gk_file), str(knob_key_file)
+
+@pytest.fixture
+def encrypt(tmp_path, group_key, knob_key):
+    """encrypt(données, nom, **paramètres de encrypt_knob) -> (dossier KNOB, métadonnées)."""
+    def encrypt(data, name="knob", **params):
+        input_file = tmp_path / f"{name}.in"
+        input_file.write_bytes(data)
+        path = str(tmp_path / name)
+        meta = encrypt_knob(str(input_file), path, group_key, knob_key.publickey(), get_random_bytes(KEY_SIZE),
+                            **params)
+        return path, meta
+    return encrypt
+
+@pytest.fixture
+def decrypt(tmp_path, group_key, knob_key):
+    """
+    decrypt(dossier ou source de blocs, métadonnées, gk=None, **paramètres de
+    decrypt_to_file) -> données déchiffrées (chaîne complète).
+    """
+    def decrypt(path, meta, gk=None, **params):
+        sk = get_sk(knob_key, meta["metaSGX"])
+        super_block_indices, num_blocks = get_super_blocks_indices(meta["metaIndex"], sk)
+        output_file = tmp_path / "output.bin"
+        with open_block_source(path) if isinstance(path, str) else path as source:
+            decrypt_to_file(source, super_block_indices, num_blocks, gk or group_key, meta["metaFK"], str(output_file),
+                            **params)
+        return output_file.read_bytes()
+    return decrypt
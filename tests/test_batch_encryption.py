@@ -0,0 +1,36 @@
+import json
+import os
+import sys
+import batch_encryption
+from batch_encryption import list_inputs
+
+def make_tree(root, names):
+    for name in names:
+        os.makedirs(os.path.dirname(root / name), exist_ok=True)
+        (root / name).write_bytes(os.urandom(3000))
+
+def test_list_inputs_skips_out_dir(tmp_path):
+    source = tmp_path / "source"
+    make_tree(source, ["a.bin", "sub/b.bin", "out/old/blocks.knob"])
+    inputs = list(list_inputs(str(source), str(source / "out")))
+    assert [os.path.relpath(input_file, source) for input_file, _ in inputs] == ["a.bin", os.path.join("sub", "b.bin")]
+
+def test_summary_has_no_super_block_indices(tmp_path, monkeypatch, key_files, decrypt):
+    source = tmp_path / "source"
+    make_tree(source, ["a.bin", "b.bin"])
+    summary_file = tmp_path / "summary.json"
+    monkeypatch.setattr(sys, "argv", ["batch_encryption.py", str(source), str(tmp_path / "out"), key_files[0],
+                                      "--knob-key", key_files[1], "--workers", "1", "--summary", str(summary_file)])
+    batch_encryption.main()
+
+    text = summary_file.read_text()
+    assert "super_block_indices" not in text
+    summary = json.loads(text)
+    assert len(summary["succeeded"]) == 2
+    for result in summary["succeeded"]:
+        meta = {}
+        for name in batch_encryption.META_FILES:
+            with open(os.path.join(result["path"], name + ".bin"), "rb") as f:
+                meta[name] = f.read()
+        with open(result["input"], "rb") as f:
+            assert decrypt(result["path"], meta) == f.read()
@@ -0,0 +1,96 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from block_container import open_block_source
+from block_prefetch import BlockFetcher, Prefetcher
+
+DATA = os.urandom(40 * 1024 + 9)
+
+class RecordingSource:
+    """
+    Source de blocs non projetée en mémoire (lectures anticipées sur le pool)
+    autour d'un conteneur : note les fenêtres lues, peut bloquer les lectures
+    (gate) ou échouer sur un bloc (fail_at).
+    """
+
+    zero_copy = False
+
+    def __init__(self, source, gate=None, fail_at=None):
+        self.source = source
+        self.gate = gate
+        self.fail_at = fail_at
+        self.started = threading.Event()
+        self.reads = []
+        for name in ("iv", "block_size", "num_blocks", "num_super_blocks", "flags"):
+            setattr(self, name, getattr(source, name))
+
+    def block(self, j):
+        return self.source.block(j)
+
+    def super_block(self, j):
+        return self.source.super_block(j)
+
+    def read_blocks(self, j, count, buffer):
+        self.reads.append(j)
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait()
+        if self.fail_at is not None and j <= self.fail_at < j + count:
+            raise OSError(f"lecture du bloc {self.fail_at} impossible")
+        buffer[:] = self.source.read_blocks(j, count)
+        return buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+@pytest.fixture
+def knob(encrypt):
+    return encrypt(DATA, block_size=1024, num_super_blocks=4)
+
+def test_close_cancels_pending_reads(knob):
+    gate = threading.Event()
+    with open_block_source(knob[0]) as container:
+        source = RecordingSource(container, gate=gate)
+        fetcher = BlockFetcher(source, window_size=1024, depth=4, workers=1)
+        blocks = fetcher.regular_blocks()
+        # Première fenêtre en cours de lecture, les trois suivantes en attente sur l'unique thread
+        assert source.started.wait(10)
+        timer = threading.Timer(0.1, gate.set)
+        timer.start()
+        fetcher.close()
+        timer.join()
+        assert source.reads == [0]
+        assert list(blocks) == []
+
+def test_prefetcher_cancels_on_close():
+    ran = []
+    gate = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prefetcher = Prefetcher(executor, [lambda: gate.wait(10)] + [lambda n=n: ran.append(n) for n in range(5)],
+                                depth=3)
+        prefetcher.close()
+        gate.set()
+    assert ran == []
+    assert list(prefetcher) == []
+
+def test_read_error_propagates(knob):
+    with open_block_source(knob[0]) as container:
+        source = RecordingSource(container, fail_at=10)
+        with BlockFetcher(source, window_size=4 * 1024, depth=2) as fetcher:
+            blocks = fetcher.regular_blocks()
+            with pytest.raises(OSError, match="bloc 10"):
+                for _ in blocks:
+                    pass
+            # Fenêtres suivantes abandonnées : rien n'a été lu au-delà de la profondeur
+            assert max(source.reads) <= 8 + 2 * 4
+
+def test_decrypt_read_error_propagates(knob, decrypt):
+    path, meta = knob
+    with open_block_source(path) as container:
+        with pytest.raises(OSError, match="bloc 3"):
+            decrypt(RecordingSource(container, fail_at=3), meta)
+        assert decrypt(RecordingSource(container), meta) == DATA
@@ -0,0 +1,97 @@
+import pytest
+from shard_coordinator import LeaseLost, WorkStream, open_coordinator
+
+ITEMS = [f"item-{n:03d}" for n in range(20)]
+TTL = 30.0
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    return now
+
+@pytest.fixture
+def coordinator_url(tmp_path):
+    return "sqlite://" + str(tmp_path / "coordinator.db")
+
+@pytest.fixture
+def coordinators(coordinator_url, clock):
+    """Deux nœuds sur la même base, avec une horloge commune réglable."""
+    opened = []
+    for _ in range(2):
+        coordinator = open_coordinator(coordinator_url, TTL)
+        coordinator.clock = lambda: clock[0]
+        opened.append(coordinator)
+    yield opened
+    for coordinator in opened:
+        coordinator.close()
+
+def test_create_job_once(coordinators):
+    a, b = coordinators
+    assert a.create_job("job", ITEMS, num_shards=4)
+    assert not b.create_job("job", ITEMS, num_shards=4)
+    status = b.status("job")
+    assert (status["items"], status["shards"], status["remaining"]) == (len(ITEMS), 4, len(ITEMS))
+
+def test_expired_lease_is_taken_over(coordinators, clock):
+    a, b = coordinators
+    a.create_job("job", ITEMS, num_shards=1)
+    lease = a.acquire("job", "a")
+    index, item = a.claim(lease)
+    assert item == ITEMS[0]
+
+    # Battement de cœur : le bail court à nouveau TTL secondes
+    clock[0] += TTL / 2
+    a.heartbeat(lease)
+
+    # Nœud a arrêté : bail expiré, b reprend la tranche et l'élément réclamé non terminé
+    clock[0] += TTL + 1
+    taken = b.acquire("job", "b")
+    assert taken.shard == lease.shard
+    assert b.claim(taken) == (index, item)
+    with pytest.raises(LeaseLost):
+        a.complete(lease, index)
+    with pytest.raises(LeaseLost):
+        a.heartbeat(lease)
+    b.complete(taken, index)
+    assert b.status("job")["completed"] == 1
+
+def test_steal_half(coordinators):
+    a, b = coordinators
+    a.create_job("job", ITEMS, num_shards=1)
+    lease = a.acquire("job", "a")
+    a.claim(lease)
+    a.claim(lease)
+
+    stolen = b.acquire("job", "b")
+    assert stolen.shard != lease.shard
+    # Seconde moitié des éléments non réclamés
+    assert b.claim(stolen)[1] == ITEMS[11]
+
+    claimed_by_a = []
+    while (claimed := a.claim(lease)) is not None:
+        claimed_by_a.append(claimed[1])
+    assert claimed_by_a == ITEMS[2:11]
+
+def test_work_streams_process_every_item_once(coordinators):
+    a, b = coordinators
+    a.create_job("job", ITEMS, num_shards=4)
+    seen = []
+    with WorkStream(a, "job", "a") as first, WorkStream(b, "job", "b") as second:
+        for stream in (first, second):
+            for item in stream:
+                seen.append(item)
+                assert stream.complete(item)
+    assert sorted(seen) == ITEMS
+    assert a.status("job")["completed"] == len(ITEMS)
+
+def test_released_items_are_redistributed(coordinators):
+    a, b = coordinators
+    a.create_job("job", ITEMS, num_shards=1)
+    with WorkStream(a, "job", "a") as stream:
+        for item in stream:
+            break  # Arrêt avant complete() : l'élément est rendu avec la tranche
+    status = b.status("job")
+    assert (status["completed"], status["remaining"]) == (0, len(ITEMS))
+    with WorkStream(b, "job", "b") as stream:
+        done = [item for item in stream if stream.complete(item)]
+    assert sorted(done) == ITEMS
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import pytest
+from Crypto.Random import get_random_bytes
+from knob_client import KnobClient, KnobError
+from knob_daemon import KnobService, make_server
+
+DATA = os.urandom(30 * 1024 + 11)
+
+@pytest.fixture
+def daemon(key_files):
+    """Service sur un socket Unix (chemin court : limite de 108 octets), servi par un thread."""
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, "knob.sock")
+    service = KnobService(*key_files)
+    server = make_server(socket_path, service, pool_size=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+    server.batcher.close()
+    service.close()
+    thread.join()
+    shutil.rmtree(directory)
+
+def test_socket_is_private(daemon):
+    assert stat.S_IMODE(os.stat(daemon).st_mode) == 0o600
+
+def test_encrypt_decrypt_round_trip(daemon, tmp_path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(DATA)
+    path, output = str(tmp_path / "knob"), str(tmp_path / "output.bin")
+    with KnobClient(daemon, timeout=30) as client:
+        result = client.call("encrypt", input=str(input_file), path=path, block_size=1024, num_super_blocks=4)
+        assert (result["num_blocks"], result["block_size"]) == (31, 1024)
+        client.call("decrypt", path=path, output=output)
+        assert (tmp_path / "output.bin").read_bytes() == DATA
+
+        client.call("decrypt", path=path, output=output, range=[5000, 2000])
+        assert (tmp_path / "output.bin").read_bytes() == DATA[5000:7000]
+
+def test_pipelined_requests_are_batched(daemon, tmp_path):
+    requests = []
+    for n in range(8):
+        input_file = tmp_path / f"input-{n}.bin"
+        input_file.write_bytes(DATA[:1000 * (n + 1)])
+        requests.append({"op": "encrypt", "input": str(input_file), "path": str(tmp_path / f"knob-{n}"),
+                         "block_size": 1024})
+    with KnobClient(daemon, timeout=30) as client:
+        responses = client.call_many(requests)
+        assert all(response["ok"] for response in responses)
+        outputs = [str(tmp_path / f"output-{n}.bin") for n in range(8)]
+        responses = client.call_many([{"op": "decrypt", "path": request["path"], "output": output}
+                                      for request, output in zip(requests, outputs)])
+        assert all(response["ok"] for response in responses)
+        stats = client.call("stats")
+    for n, output in enumerate(outputs):
+        with open(output, "rb") as f:
+            assert f.read() == DATA[:1000 * (n + 1)]
+    # Regroupées en lots : au moins un lot, au plus un par requête
+    assert 1 <= stats["batches"] <= 17
+    assert stats["keyring"]["hits"] > 0
+
+def test_rotation_replay_is_skipped(daemon, tmp_path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(DATA)
+    path = str(tmp_path / "knob")
+    new_gk = tmp_path / "gk_new"
+    new_gk.write_bytes(get_random_bytes(32))
+    with KnobClient(daemon, timeout=30) as client:
+        client.call("encrypt", input=str(input_file), path=path, block_size=1024, num_super_blocks=4)
+        assert client.call("rotate", paths=[path], new_gk=str(new_gk)) == {"rotated": 1, "skipped": [], "failed": {}}
+        assert client.call("rotate", paths=[path], new_gk=str(new_gk)) == {"rotated": 0, "skipped": [path],
+                                                                             "failed": {}}
+        client.call("decrypt", path=path, output=str(tmp_path / "output.bin"), gk=str(new_gk))
+    assert (tmp_path / "output.bin").read_bytes() == DATA
+
+def test_errors(daemon, tmp_path):
+    with KnobClient(daemon, timeout=30) as client:
+        with pytest.raises(KnobError, match="Opération inconnue"):
+            client.call("compress")
+        with pytest.raises(KnobError, match="FileNotFoundError"):
+            client.call("decrypt", path=str(tmp_path / "absent"), output=str(tmp_path / "output.bin"))
+
+    # Ligne illisible : réponse d'erreur sans id, la connexion reste utilisable
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(30)
+        sock.connect(daemon)
+        sock.sendall(b"pas du json\n" + json.dumps({"op": "stats", "id": 7}).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as reader:
+            responses = [json.loads(line) for line in reader]
+    assert responses[0] == {"id": None, "ok": False, "error": "ValueError: Requête JSON invalide."}
+    assert (responses[1]["id"], responses[1]["ok"]) == (7, True)
@@ -0,0 +1,62 @@
+import os
+import pytest
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.Random import get_random_bytes
+from knob_epoch import Epoch, EpochWrapper, is_envelope, open_envelope, parse_envelope
+from knob_keyring import Keyring
+
+DATA = os.urandom(10 * 1024 + 9)
+
+def unwrap_with(knob_key):
+    return PKCS1_OAEP.new(knob_key).decrypt
+
+def test_envelope(knob_key):
+    epoch = Epoch(knob_key.publickey())
+    sk = get_random_bytes(32)
+    meta_sgx = epoch.wrap(sk)
+    assert is_envelope(meta_sgx, knob_key)
+    assert open_envelope(meta_sgx, unwrap_with(knob_key)) == sk
+
+def test_envelope_tampered(knob_key):
+    meta_sgx = bytearray(Epoch(knob_key.publickey()).wrap(get_random_bytes(32)))
+    meta_sgx[-1] ^= 1
+    with pytest.raises(ValueError):
+        open_envelope(bytes(meta_sgx), unwrap_with(knob_key))
+    with pytest.raises(ValueError):
+        parse_envelope(bytes(meta_sgx[:20]))
+
+def test_legacy_meta_sgx_is_not_an_envelope(knob_key):
+    meta_sgx = PKCS1_OAEP.new(knob_key.publickey()).encrypt(get_random_bytes(32))
+    assert not is_envelope(meta_sgx, knob_key)
+
+def test_keyring_unwraps_epoch_key_once(knob_key):
+    epoch = Epoch(knob_key.publickey())
+    sks = [get_random_bytes(32) for _ in range(5)]
+    keyring = Keyring()
+    decrypted = []
+    cipher = PKCS1_OAEP.new(knob_key)
+
+    class CountingCipher:
+        def decrypt(self, data):
+            decrypted.append(data)
+            return cipher.decrypt(data)
+
+    keyring.oaep_cipher = lambda key: CountingCipher()
+    assert [keyring.unwrap_sk(knob_key, epoch.wrap(sk)) for sk in sks] == sks
+    assert decrypted == [epoch.wrapped]  # Une seule opération RSA pour tout le lot
+
+def test_epoch_wrapper_rotates(knob_key):
+    now = [0.0]
+    wrapper = EpochWrapper(knob_key.publickey(), lifetime=10, max_files=3, clock=lambda: now[0])
+    headers = [parse_envelope(wrapper.wrap(get_random_bytes(32)))[0] for _ in range(4)]
+    now[0] = 11
+    headers.append(parse_envelope(wrapper.wrap(get_random_bytes(32)))[0])
+    assert wrapper.epochs == 3
+    assert len(set(headers)) == 3
+
+def test_roundtrip_with_epoch(encrypt, decrypt, knob_key):
+    epoch = Epoch(knob_key.publickey())
+    files = [encrypt(DATA, name=f"knob{n}", epoch=epoch, block_size=1024, num_super_blocks=2) for n in range(3)]
+    for path, meta in files:
+        assert is_envelope(meta["metaSGX"], knob_key)
+        assert decrypt(path, meta) == DATA
@@ -0,0 +1,93 @@
+import contextvars
+import json
+import os
+import pstats
+import threading
+import pytest
+import instrumentation
+from instrumentation import NULL, current, instrument, stage
+
+DATA = os.urandom(20 * 1024 + 3)
+
+@pytest.fixture(autouse=True)
+def no_environment(monkeypatch):
+    for name in (instrumentation.ENV_FORMAT, instrumentation.ENV_FILE, instrumentation.ENV_TRACEMALLOC,
+                 instrumentation.ENV_PROFILE):
+        monkeypatch.delenv(name, raising=False)
+
+def test_disabled_by_default():
+    with instrument("encrypt") as run:
+        assert run is NULL and current() is NULL
+        with stage("write", 10):
+            pass
+    assert current() is NULL
+
+def test_environment_enables_json(tmp_path, monkeypatch, encrypt):
+    report_file = tmp_path / "report.jsonl"
+    monkeypatch.setenv(instrumentation.ENV_FORMAT, "json")
+    monkeypatch.setenv(instrumentation.ENV_FILE, str(report_file))
+    for _ in range(2):
+        with instrument("encrypt") as run:
+            assert current() is run
+            meta = encrypt(DATA, block_size=1024, num_super_blocks=2)[1]
+    assert current() is NULL
+
+    # Une ligne JSON par exécution, ajoutée au fichier
+    reports = [json.loads(line) for line in report_file.read_text().splitlines()]
+    assert len(reports) == 2
+    stages = reports[1]["stages"]
+    assert reports[1]["pipeline"] == "encrypt"
+    assert {"write", "index_encrypt", "rsa_wrap"} <= set(stages)
+    assert stages["write"]["calls"] == meta["num_blocks"]
+    assert stages["write"]["bytes"] == meta["num_blocks"] * meta["block_size"]
+    assert stages["rsa_wrap"]["wall_seconds"] > 0
+
+def test_prometheus_replaces_file(tmp_path):
+    report_file = tmp_path / "knob.prom"
+    for nbytes in (100, 200):
+        with instrument("decrypt", "prometheus", str(report_file)):
+            with stage("fk_recover", nbytes):
+                pass
+            current().add_bytes("decompress", 7)
+    text = report_file.read_text()
+    assert "# TYPE knob_stage_bytes_total counter" in text
+    assert 'knob_stage_bytes_total{pipeline="decrypt",stage="fk_recover"} 200' in text
+    assert 'knob_stage_calls_total{pipeline="decrypt",stage="decompress"} 0' in text
+    assert text.count("# HELP knob_stage_calls_total") == 1
+
+def test_observers_and_cumulated_stages(tmp_path):
+    seen = []
+    with instrument("encrypt", "json", str(tmp_path / "report.jsonl")) as run:
+        run.observers.append(lambda pipeline, name, wall: seen.append((pipeline, name)))
+        for _ in range(3):
+            with stage("merkle", 5):
+                pass
+        assert run.stages["merkle"]["calls"] == 3 and run.stages["merkle"]["bytes"] == 15
+    assert seen == [("encrypt", "merkle")] * 3
+
+def test_threads_have_their_own_run(tmp_path):
+    results = {}
+    with instrument("encrypt", "json", str(tmp_path / "report.jsonl")) as run:
+        # Thread nu : aucune exécution en cours ; avec copy_context().run : celle de l'appelant
+        plain = threading.Thread(target=lambda: results.update(plain=current()))
+        context = contextvars.copy_context()
+        copied = threading.Thread(target=context.run, args=(lambda: results.update(copied=current()),))
+        for thread in (plain, copied):
+            thread.start()
+            thread.join()
+    assert results == {"plain": NULL, "copied": run}
+
+def test_tracemalloc_and_profile(tmp_path):
+    profile = tmp_path / "run.prof"
+    with instrument("encrypt", "json", str(tmp_path / "report.jsonl"), trace_malloc=True,
+                    profile=str(profile)) as run:
+        with stage("fk_encrypt"):
+            data = [bytearray(1024) for _ in range(100)]
+        assert run.stages["fk_encrypt"]["allocated_bytes"] >= 100 * 1024
+        del data
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        with instrument("encrypt", "xml"):
+            pass
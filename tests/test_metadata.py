@@ -0,0 +1,109 @@
+import os
+import pytest
+from knob_metadata import MIN_CAPACITY, MetadataLog, pack_record, path_id, unpack_record
+
+def make_meta(n):
+    return {"metaFK": os.urandom(32), "metaSK": os.urandom(64), "metaIndex": os.urandom(48),
+            "metaSGX": os.urandom(256), "block_size": 1024, "num_blocks": 10 + n, "num_super_blocks": 2,
+            "compression": "zlib" if n % 2 else "none", "mode": "ctr" if n % 3 else "cbc"}
+
+def same(meta, expected):
+    return all(meta[name] == value for name, value in expected.items())
+
+@pytest.fixture
+def log_file(tmp_path):
+    return str(tmp_path / "meta.log")
+
+@pytest.fixture
+def records():
+    # Plus que MIN_CAPACITY * MAX_LOAD : l'index est agrandi au moins une fois
+    return {f"file-{n}": make_meta(n) for n in range(MIN_CAPACITY)}
+
+def test_pack_unpack():
+    meta = make_meta(1)
+    file_id, unpacked = unpack_record(pack_record("abc", meta))
+    assert file_id == "abc"
+    assert same(unpacked, meta)
+    assert "metaMerkle" not in unpacked
+
+def test_append_and_get(log_file, records):
+    with MetadataLog(log_file, writable=True) as log:
+        log.append_many(records.items())
+        assert same(log.get("file-7"), records["file-7"])
+    with MetadataLog(log_file) as log:
+        assert all(same(log.get(file_id), meta) for file_id, meta in records.items())
+        with pytest.raises(KeyError):
+            log.get("absent")
+
+def test_newer_record_replaces(log_file):
+    first, second = make_meta(1), make_meta(2)
+    with MetadataLog(log_file, writable=True) as log:
+        log.append("f", first)
+        log.append("f", second)
+        assert same(log.get("f"), second)
+        assert log.compact() == 1
+        assert same(log.get("f"), second)
+
+@pytest.mark.parametrize("damage", ["remove", "truncate", "garbage"])
+def test_index_is_rebuilt(log_file, records, damage):
+    with MetadataLog(log_file, writable=True) as log:
+        log.append_many(records.items())
+    index_file = log_file + ".idx"
+    if damage == "remove":
+        os.remove(index_file)
+    elif damage == "truncate":
+        with open(index_file, "r+b") as f:
+            f.truncate(100)
+    else:
+        with open(index_file, "r+b") as f:
+            f.write(os.urandom(64))
+
+    # Lecteur sans index utilisable : le journal est relu
+    with MetadataLog(log_file) as log:
+        assert same(log.get("file-3"), records["file-3"])
+    # L'écrivain reconstruit l'index
+    with MetadataLog(log_file, writable=True) as log:
+        assert same(log.get("file-3"), records["file-3"])
+    with MetadataLog(log_file) as log:
+        assert all(same(log.get(file_id), meta) for file_id, meta in records.items())
+
+def test_stale_index_catches_up(log_file, records):
+    items = list(records.items())
+    with MetadataLog(log_file, writable=True) as log:
+        log.append_many(items[:10])
+    with open(log_file + ".idx", "rb") as f:
+        stale_index = f.read()
+    with MetadataLog(log_file, writable=True) as log:
+        log.append_many(items[10:20])
+    # Index d'avant les derniers ajouts : la fin du journal est rejouée
+    with open(log_file + ".idx", "wb") as f:
+        f.write(stale_index)
+    with MetadataLog(log_file) as log:
+        assert all(same(log.get(file_id), meta) for file_id, meta in items[:20])
+
+def test_interrupted_append_is_dropped(log_file):
+    with MetadataLog(log_file, writable=True) as log:
+        log.append("a", make_meta(1))
+        log.append("b", make_meta(2))
+    with open(log_file, "r+b") as f:
+        f.truncate(os.path.getsize(log_file) - 10)
+    with MetadataLog(log_file, writable=True) as log:
+        assert "a" in log
+        assert "b" not in log
+        log.append("c", make_meta(3))
+    with MetadataLog(log_file) as log:
+        assert "c" in log
+
+def test_reindex(log_file, records):
+    with MetadataLog(log_file, writable=True) as log:
+        log.append_many(records.items())
+        log.reindex()
+        assert all(same(log.get(file_id), meta) for file_id, meta in records.items())
+
+def test_decrypt_from_log(log_file, encrypt, decrypt):
+    data = os.urandom(5000)
+    path, meta = encrypt(data, block_size=1024, num_super_blocks=2)
+    with MetadataLog(log_file, writable=True) as log:
+        log.append(path_id(path), meta)
+    with MetadataLog(log_file) as log:
+        assert decrypt(path, log.get(path_id(path))) == data
@@ -0,0 +1,120 @@
+import os
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from encrypt_classic import encrypt_classic
+from mixslice_engine import (COMMIT, IV_SIZE, MINI_BLOCK_SIZE, ZERO_BEFORE, MixSliceFile, decrypt_file,
+                             read_sidecar, revoke_mini_blocks, sidecar_name)
+
+DATA = os.urandom(20 * 1024 + 300)
+
+@pytest.fixture
+def classic(tmp_path):
+    """(fichier AES-CBC classique, clé)."""
+    key = get_random_bytes(32)
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(DATA)
+    encrypted = str(tmp_path / "encrypted.bin")
+    encrypt_classic(str(input_file), encrypted, key)
+    return encrypted, key
+
+def decrypt(filename, key, layer_keys=()):
+    output_file = filename + ".out"
+    decrypt_file(filename, output_file, key, layer_keys)
+    with open(output_file, "rb") as f:
+        return f.read()
+
+def test_revoke(classic):
+    filename, key = classic
+    new_key = get_random_bytes(32)
+    with open(filename, "rb") as f:
+        before = f.read()
+    assert revoke_mini_blocks(filename, [0, 5, 6, 100], new_key) == 4
+
+    with open(filename, "rb") as f:
+        after = f.read()
+    assert len(after) == len(before)
+    assert after != before
+    assert decrypt(filename, key, [new_key]) == DATA
+    with pytest.raises(KeyError):
+        decrypt(filename, key)
+
+def undo_with_sidecar(filename, key):
+    """Remet dans le fichier les octets d'avant de l'annexe et le déchiffre avec la seule ancienne clé."""
+    with open(filename, "rb") as f:
+        data = bytearray(f.read())
+    batches, _, _ = read_sidecar(filename)
+    for records in batches:
+        for index, _, _, before in records:
+            start = IV_SIZE + index * MINI_BLOCK_SIZE
+            data[start:start + MINI_BLOCK_SIZE] = before
+    return AES.new(key, AES.MODE_CBC, bytes(data[:IV_SIZE])).decrypt(bytes(data[IV_SIZE:]))
+
+def test_revoke_cannot_be_undone_with_old_key(classic):
+    filename, key = classic
+    revoke_mini_blocks(filename, [2, 50], get_random_bytes(32))
+    batches, _, _ = read_sidecar(filename)
+    assert all(before == ZERO_BEFORE for records in batches for _, _, _, before in records)
+    plain = undo_with_sidecar(filename, key)
+    assert plain[2 * MINI_BLOCK_SIZE:3 * MINI_BLOCK_SIZE] != DATA[2 * MINI_BLOCK_SIZE:3 * MINI_BLOCK_SIZE]
+    assert plain[50 * MINI_BLOCK_SIZE:51 * MINI_BLOCK_SIZE] != DATA[50 * MINI_BLOCK_SIZE:51 * MINI_BLOCK_SIZE]
+
+def test_undo_bytes_erased_on_reopen(classic, monkeypatch):
+    filename, key = classic
+    new_key = get_random_bytes(32)
+    # Interruption entre la validation du lot et l'effacement des octets d'avant
+    with monkeypatch.context() as patch:
+        patch.setattr(MixSliceFile, "_erase_undo", lambda self, position, counts: None)
+        revoke_mini_blocks(filename, [4], new_key)
+    assert read_sidecar(filename)[0][0][0][3] != ZERO_BEFORE
+
+    MixSliceFile(filename).close()
+    assert read_sidecar(filename)[0][0][0][3] == ZERO_BEFORE
+    assert decrypt(filename, key, [new_key]) == DATA
+
+def test_double_revoke(classic):
+    filename, key = classic
+    new_key = get_random_bytes(32)
+    assert revoke_mini_blocks(filename, [3, 4], new_key) == 2
+    with open(filename, "rb") as f:
+        once = f.read()
+
+    # Même clé : mini-blocs déjà révoqués ignorés, fichier inchangé
+    assert revoke_mini_blocks(filename, [3, 4], new_key) == 0
+    assert revoke_mini_blocks(filename, [4, 7], new_key) == 1
+    with open(filename, "rb") as f:
+        assert f.read()[:IV_SIZE + 7 * MINI_BLOCK_SIZE] == once[:IV_SIZE + 7 * MINI_BLOCK_SIZE]
+    assert decrypt(filename, key, [new_key]) == DATA
+
+    # Autre clé : une seconde couche
+    other_key = get_random_bytes(32)
+    assert revoke_mini_blocks(filename, [3], other_key) == 1
+    assert decrypt(filename, key, [new_key, other_key]) == DATA
+
+def test_nonce_per_batch(classic):
+    filename, key = classic
+    new_key = get_random_bytes(32)
+    revoke_mini_blocks(filename, [1], new_key)
+    revoke_mini_blocks(filename, [2], new_key)
+    batches, pending, _ = read_sidecar(filename)
+    assert pending is None
+    assert batches[0][0][2] != batches[1][0][2]
+
+def test_interrupted_batch_is_rolled_back(classic, monkeypatch):
+    filename, key = classic
+    new_key = get_random_bytes(32)
+    revoke_mini_blocks(filename, [1], new_key)
+    with open(filename, "rb") as f:
+        committed = f.read()
+
+    # Lot écrit dans l'annexe et appliqué, mais pas validé (octets d'avant encore là)
+    with monkeypatch.context() as patch, MixSliceFile(filename) as mixslice:
+        patch.setattr(MixSliceFile, "_erase_undo", lambda self, position, counts: None)
+        mixslice.revoke([8, 9], new_key)
+    with open(sidecar_name(filename), "r+b") as f:
+        f.truncate(os.path.getsize(sidecar_name(filename)) - len(COMMIT))
+
+    MixSliceFile(filename).close()
+    with open(filename, "rb") as f:
+        assert f.read() == committed
+    assert decrypt(filename, key, [new_key]) == DATA
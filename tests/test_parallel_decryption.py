@@ -0,0 +1,50 @@
+import os
+import pytest
+from Crypto.Cipher import AES
+import parallel_decryption
+from knob_modes import ctr_cipher
+from parallel_decryption import crypt_ctr_sharded, decrypt_cbc_sharded, shard_ranges
+
+KEY = os.urandom(32)
+IV = os.urandom(16)
+DATA = os.urandom(50 * 1024 + 123)
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    """Tranches d'un bloc KNOB (1 Ko) au lieu de 1 Mo ; nombre de tranches de chaque appel."""
+    monkeypatch.setattr(parallel_decryption, "MIN_SHARD_SIZE", 1024)
+    counts = []
+    def spy(length, workers, min_shard_size=None):
+        ranges = shard_ranges(length, workers, min_shard_size)
+        counts.append(len(ranges))
+        return ranges
+    monkeypatch.setattr(parallel_decryption, "shard_ranges", spy)
+    return counts
+
+@pytest.mark.parametrize("in_place", [False, True])
+def test_cbc_shards(small_shards, in_place):
+    ciphertext = AES.new(KEY, AES.MODE_CBC, IV).encrypt(DATA[:40 * 1024])
+    buffer = bytearray(ciphertext)
+    output = buffer if in_place else bytearray(len(buffer))
+    decrypt_cbc_sharded(KEY, IV, buffer, output, workers=4)
+    assert small_shards == [4]
+    assert bytes(output) == DATA[:40 * 1024]
+
+def test_ctr_shards(small_shards):
+    offset = 3 * 1024
+    ciphertext = ctr_cipher(KEY, IV, offset).encrypt(DATA)
+    output = bytearray(len(ciphertext))
+    crypt_ctr_sharded(KEY, IV, offset, ciphertext, output, workers=4)
+    assert small_shards == [4]
+    assert bytes(output) == DATA
+
+@pytest.mark.parametrize("mode", ["cbc", "ctr"])
+def test_sharded_decryption_matches(small_shards, encrypt, decrypt, mode):
+    path, meta = encrypt(DATA, mode=mode, block_size=1024, num_super_blocks=4)
+    expected = decrypt(path, meta, workers=1)
+    assert max(small_shards, default=1) == 1
+
+    # Chaque fenêtre de blocs ordinaires commence ou finit contre un super bloc :
+    # la première et la dernière tranche de chaque appel le touchent
+    assert decrypt(path, meta, workers=4) == expected == DATA
+    assert max(small_shards) >= 2
@@ -0,0 +1,98 @@
+import os
+import pytest
+from block_container import CONTAINER_NAME, BlockContainer, open_block_source
+from knob_merkle import TREE_NAME, MerkleTree, verify_source
+from knob_reader import open_reader
+from knob_stream import decrypt_stream
+from knob_unwrap import get_sk, get_super_blocks_indices
+
+DATA = os.urandom(40 * 1024 + 77)
+TEXT = b"".join(b"ligne %d du fichier de test\n" % i for i in range(4000))
+
+@pytest.mark.parametrize("mode", ["cbc", "ctr"])
+@pytest.mark.parametrize("offset, length", [(0, 1), (0, len(DATA)), (1000, 100), (1020, 10), (5 * 1024, 3 * 1024),
+                                            (len(DATA) - 50, 50), (len(DATA) - 10, 100), (len(DATA), 10)])
+def test_decrypt_range(encrypt, group_key, knob_key, mode, offset, length):
+    path, meta = encrypt(DATA, mode=mode, block_size=1024, num_super_blocks=5)
+    with open_block_source(path) as source:
+        reader = open_reader(source, meta["metaFK"], meta["metaIndex"], meta["metaSGX"], group_key, knob_key)
+        assert reader.size() == len(DATA)
+        assert reader.decrypt_range(offset, length) == DATA[offset:offset + length]
+
+def test_decrypt_range_refuses_compressed_files(encrypt, group_key, knob_key):
+    path, meta = encrypt(TEXT, compression="zlib", block_size=1024, num_super_blocks=2)
+    with open_block_source(path) as source, pytest.raises(ValueError):
+        open_reader(source, meta["metaFK"], meta["metaIndex"], meta["metaSGX"], group_key, knob_key)
+
+@pytest.mark.parametrize("mode", ["cbc", "ctr"])
+@pytest.mark.parametrize("data, compression", [(DATA, "none"), (TEXT, "zlib"), (b"", "none")])
+def test_decrypt_stream(encrypt, group_key, knob_key, mode, data, compression):
+    path, meta = encrypt(data, mode=mode, compression=compression, block_size=1024, num_super_blocks=1)
+    sk = get_sk(knob_key, meta["metaSGX"])
+    super_block_indices, num_blocks = get_super_blocks_indices(meta["metaIndex"], sk)
+    with open_block_source(path) as source:
+        chunks = list(decrypt_stream(source, super_block_indices, num_blocks, group_key, meta["metaFK"],
+                                     chunk_size=4096))
+    assert b"".join(chunks) == data
+    assert all(chunks)
+
+RANGE = (10 * 1024 + 100, 2500)  # Blocs 10 à 12
+
+def regular_block_outside(meta, blocks):
+    """Premier bloc ordinaire (ni super bloc, ni dernier bloc) parmi blocks."""
+    return next(i for i in blocks if i not in meta["super_block_indices"] and i != meta["num_blocks"] - 1)
+
+def tamper(path, meta, i):
+    """Altère un octet du bloc ordinaire i dans le conteneur."""
+    filename = os.path.join(path, CONTAINER_NAME)
+    with BlockContainer(filename) as container:
+        offset = container.blocks_offset + (i - sum(k < i for k in meta["super_block_indices"])) * container.block_size
+    with open(filename, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 1]))
+
+def merkle_reader(path, meta, group_key, knob_key, source):
+    tree = MerkleTree(os.path.join(path, TREE_NAME))
+    return open_reader(source, meta["metaFK"], meta["metaIndex"], meta["metaSGX"], group_key, knob_key,
+                       (tree, meta["metaMerkle"]))
+
+def test_range_verifies_only_touched_leaves(encrypt, group_key, knob_key, monkeypatch):
+    path, meta = encrypt(DATA, merkle=True, block_size=1024, num_super_blocks=5)
+    verified = []
+    verify = MerkleTree.verify
+    def spy(tree, blocks, root):
+        verified.extend(blocks)
+        return verify(tree, blocks, root)
+    monkeypatch.setattr(MerkleTree, "verify", spy)
+
+    with open_block_source(path) as source:
+        reader = merkle_reader(path, meta, group_key, knob_key, source)
+        assert reader.decrypt_range(*RANGE) == DATA[RANGE[0]:sum(RANGE)]
+        # Feuilles des blocs 10 à 12 et du dernier bloc (padding), rien d'autre
+        expected = [reader.stored_block(i)[0] for i in (10, 11, 12, meta["num_blocks"] - 1)]
+        reader.merkle[0].close()
+    assert sorted(verified) == sorted(expected)
+
+def test_range_rejects_tampered_block_inside(encrypt, group_key, knob_key):
+    path, meta = encrypt(DATA, merkle=True, block_size=1024, num_super_blocks=5)
+    tamper(path, meta, regular_block_outside(meta, range(10, 13)))
+    with open_block_source(path) as source:
+        reader = merkle_reader(path, meta, group_key, knob_key, source)
+        with pytest.raises(ValueError, match="Merkle"):
+            reader.decrypt_range(*RANGE)
+        reader.merkle[0].close()
+
+def test_range_ignores_tampered_block_outside(encrypt, group_key, knob_key):
+    path, meta = encrypt(DATA, merkle=True, block_size=1024, num_super_blocks=5)
+    tamper(path, meta, regular_block_outside(meta, range(0, 10)))
+    with open_block_source(path) as source:
+        reader = merkle_reader(path, meta, group_key, knob_key, source)
+        # Hors de la plage : la vérification de la plage passe (FK, qui dépend de tous les blocs, ne se
+        # reconstitue plus, mais ce n'est pas l'arbre de Merkle qui le signale) ; la vérification complète
+        # le détecte
+        reader.verify_blocks(10, 13)
+        reader.verify_blocks(meta["num_blocks"] - 1, meta["num_blocks"])
+        reader.merkle[0].close()
+        assert not verify_source(source, meta["metaMerkle"])
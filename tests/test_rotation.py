@@ -0,0 +1,165 @@
+import os
+import pytest
+from Crypto.Random import get_random_bytes
+from block_container import open_block_source
+from block_storage import StoreBlockSource, open_store
+from group_key_rotation import (JOURNAL_NAME, atomic_write, journal_tag, read_super_blocks, rotate_directory,
+                                run_rotation, write_super_blocks)
+from knob_merkle import META_NAME, TREE_NAME, MerkleTree, verify_source
+from shard_coordinator import WorkStream, open_coordinator
+
+DATA = os.urandom(30 * 1024 + 5)
+
+@pytest.fixture
+def new_key():
+    return get_random_bytes(32)
+
+@pytest.mark.parametrize("legacy_dirs", [False, True])
+def test_rotation(encrypt, decrypt, group_key, new_key, legacy_dirs):
+    path, meta = encrypt(DATA, legacy_dirs=legacy_dirs, block_size=1024, num_super_blocks=4)
+    summary = run_rotation([path], group_key, new_key)
+    assert (summary["rotated"], summary["skipped"], summary["failed"]) == (1, 0, [])
+    assert summary["super_blocks"] == 4
+    assert decrypt(path, meta, gk=new_key) == DATA
+    assert not os.path.exists(os.path.join(path, JOURNAL_NAME))
+
+def test_rotation_twice_is_skipped(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+    run_rotation([path], group_key, new_key)
+    # Relancée sans fichier de reprise : gk.tag indique que la rotation est faite
+    summary = run_rotation([path], group_key, new_key)
+    assert (summary["rotated"], summary["skipped"], summary["already_rotated"]) == (0, 1, [path])
+    assert decrypt(path, meta, gk=new_key) == DATA
+
+def test_rotation_duplicate_path(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+    summary = run_rotation([path, path + os.sep], group_key, new_key)
+    assert (summary["rotated"], summary["skipped"]) == (1, 1)
+    assert decrypt(path, meta, gk=new_key) == DATA
+
+def test_rotation_wrong_old_key(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+    summary = run_rotation([path], get_random_bytes(32), new_key)
+    assert summary["rotated"] == 0
+    assert [failure["path"] for failure in summary["failed"]] == [path]
+    assert decrypt(path, meta) == DATA
+
+def test_rotation_lease_lost_and_reacquired(tmp_path, encrypt, decrypt, group_key, new_key):
+    first, first_meta = encrypt(DATA, "a", block_size=1024, num_super_blocks=4)
+    second, second_meta = encrypt(DATA, "b", block_size=1024, num_super_blocks=4)
+    now = [1000.0]
+    expired = []
+
+    def decode(item):
+        # Bail expiré juste après la réclamation du second dossier, avant la fin du premier
+        if item == second and not expired:
+            expired.append(item)
+            now[0] += 31.0
+        return item
+
+    with open_coordinator("sqlite://" + str(tmp_path / "coordinator.db"), 30.0) as coordinator:
+        coordinator.clock = lambda: now[0]
+        coordinator.create_job("job", [first, second], num_shards=1)
+        with WorkStream(coordinator, "job", "a", decode) as work:
+            summary = run_rotation(None, group_key, new_key, workers=1, max_in_flight=1, work=work)
+        # Les deux dossiers, redonnés sous le nouveau bail, sont traités à nouveau et déclarés terminés
+        assert work.lost == 1
+        assert coordinator.status("job")["completed"] == 2
+    assert summary["failed"] == []
+    assert decrypt(first, first_meta, gk=new_key) == DATA
+    assert decrypt(second, second_meta, gk=new_key) == DATA
+
+def test_rotation_checkpoint(tmp_path, encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+    checkpoint = str(tmp_path / "rotation.done")
+    assert run_rotation([path], group_key, new_key, checkpoint)["rotated"] == 1
+    assert run_rotation([path], group_key, new_key, checkpoint)["skipped"] == 1
+
+    # Rotation suivante avec le même fichier de reprise : il est recommencé
+    third_key = get_random_bytes(32)
+    assert run_rotation([path], new_key, third_key, checkpoint)["rotated"] == 1
+    assert decrypt(path, meta, gk=third_key) == DATA
+
+def test_rotation_resume(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+
+    # Interruption pendant la réécriture : journal complet, super blocs à moitié réécrits
+    iv, block_size, blocks = read_super_blocks(path)
+    atomic_write(os.path.join(path, JOURNAL_NAME), journal_tag(new_key) + b"".join(blocks))
+    write_super_blocks(path, [get_random_bytes(block_size)] * 2 + blocks[2:])
+
+    summary = run_rotation([path], group_key, new_key)
+    assert (summary["rotated"], summary["failed"]) == (1, [])
+    assert decrypt(path, meta, gk=new_key) == DATA
+    assert not os.path.exists(os.path.join(path, JOURNAL_NAME))
+
+def test_rotation_resume_after_tag(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+
+    # Interruption après gk.tag, avant la suppression du journal : la rotation est reprise depuis le journal
+    old_blocks = read_super_blocks(path)[2]
+    rotate_directory(path, group_key, new_key)
+    assert os.path.exists(os.path.join(path, JOURNAL_NAME))
+    assert read_super_blocks(path)[2] != old_blocks
+
+    summary = run_rotation([path], group_key, new_key)
+    assert (summary["rotated"], summary["failed"]) == (1, [])
+    assert decrypt(path, meta, gk=new_key) == DATA
+
+def test_rotation_updates_merkle_tree(encrypt, decrypt, group_key, new_key):
+    path, meta = encrypt(DATA, merkle=True, block_size=1024, num_super_blocks=4)
+    run_rotation([path], group_key, new_key)
+
+    with open(os.path.join(path, META_NAME), "rb") as f:
+        root = f.read()
+    assert root != meta["metaMerkle"]
+    with MerkleTree(os.path.join(path, TREE_NAME)) as tree:
+        assert tree.root() == root
+    with open_block_source(path) as source:
+        assert verify_source(source, root)
+        assert not verify_source(source, meta["metaMerkle"])
+    assert decrypt(path, meta, gk=new_key) == DATA
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_store("sqlite://" + str(tmp_path / "blocks.db"))
+    yield store
+    store.close()
+
+def test_store_rotation(encrypt, decrypt, group_key, new_key, store):
+    meta = encrypt(DATA, block_size=1024, num_super_blocks=4, store=store, file_id="f")[1]
+    assert store.get_metadata("f")["gk_tag"] == journal_tag(group_key)
+
+    summary = run_rotation(["f"], group_key, new_key, store=store)
+    assert (summary["rotated"], summary["super_blocks"], summary["failed"]) == (1, 4, [])
+    record = store.get_metadata("f")
+    assert record["gk_tag"] == journal_tag(new_key)
+    assert record["metaSK"] == b"".join(store.get_super_blocks("f"))
+    assert "rotation_journal" not in record
+    assert decrypt(StoreBlockSource(store, "f"), meta, gk=new_key) == DATA
+
+    # Relancée : sautée ; mauvaise ancienne clé : refusée sans rien réécrire
+    summary = run_rotation(["f"], group_key, new_key, store=store)
+    assert summary["already_rotated"] == ["f"]
+    summary = run_rotation(["f"], group_key, get_random_bytes(32), store=store)
+    assert [failure["path"] for failure in summary["failed"]] == ["f"]
+    assert decrypt(StoreBlockSource(store, "f"), meta, gk=new_key) == DATA
+
+def test_store_rotation_resume(encrypt, decrypt, group_key, new_key, store):
+    meta = encrypt(DATA, block_size=1024, num_super_blocks=4, store=store, file_id="f")[1]
+
+    # Interruption pendant la réécriture : journal dans les métadonnées, super blocs à moitié réécrits
+    blocks = store.get_super_blocks("f")
+    store.put_metadata("f", dict(store.get_metadata("f"), rotation_journal=journal_tag(new_key) + b"".join(blocks)))
+    store.put_super_blocks("f", [get_random_bytes(1024)] * 2 + blocks[2:])
+
+    summary = run_rotation(["f"], group_key, new_key, store=store)
+    assert (summary["rotated"], summary["failed"]) == (1, [])
+    assert "rotation_journal" not in store.get_metadata("f")
+    assert decrypt(StoreBlockSource(store, "f"), meta, gk=new_key) == DATA
+
+def test_store_rotation_refuses_merkle(encrypt, decrypt, group_key, new_key, store):
+    meta = encrypt(DATA, merkle=True, block_size=1024, num_super_blocks=4, store=store, file_id="f")[1]
+    summary = run_rotation(["f"], group_key, new_key, store=store)
+    assert "Merkle" in summary["failed"][0]["error"]
+    assert decrypt(StoreBlockSource(store, "f"), meta) == DATA
@@ -0,0 +1,58 @@
+import os
+import pytest
+from block_container import CONTAINER_NAME, BlockContainerWriter, convert_blocks_directory, open_block_source
+
+DATA = os.urandom(50 * 1024 + 123)
+TEXT = b"".join(b"ligne %d du fichier de test\n" % i for i in range(4000))
+
+@pytest.mark.parametrize("mode", ["cbc", "ctr"])
+@pytest.mark.parametrize("legacy_dirs", [False, True])
+def test_roundtrip(encrypt, decrypt, mode, legacy_dirs):
+    path, meta = encrypt(DATA, mode=mode, legacy_dirs=legacy_dirs, block_size=1024, num_super_blocks=4)
+    assert os.path.exists(os.path.join(path, CONTAINER_NAME)) != legacy_dirs
+    assert meta["mode"] == mode
+    assert len(meta["super_block_indices"]) == 4
+    assert decrypt(path, meta) == DATA
+
+@pytest.mark.parametrize("mode", ["cbc", "ctr"])
+def test_roundtrip_compressed(encrypt, decrypt, mode):
+    path, meta = encrypt(TEXT, mode=mode, compression="zlib", block_size=1024, num_super_blocks=2)
+    assert meta["compression"] == "zlib"
+    assert meta["num_blocks"] < len(TEXT) // 1024
+    assert decrypt(path, meta) == TEXT
+
+def test_incompressible_data_is_stored_uncompressed(encrypt, decrypt):
+    path, meta = encrypt(DATA, compression="zlib")
+    assert meta["compression"] == "none"
+    assert decrypt(path, meta) == DATA
+
+@pytest.mark.parametrize("size", [0, 1, 1023, 1024, 1025])
+def test_roundtrip_padding(encrypt, decrypt, size):
+    data = os.urandom(size)
+    path, meta = encrypt(data, block_size=1024, num_super_blocks=1)
+    assert decrypt(path, meta) == data
+
+def test_convert_blocks_directory(encrypt, decrypt):
+    path, meta = encrypt(DATA, legacy_dirs=True, block_size=1024, num_super_blocks=3)
+    with open_block_source(path) as directory:
+        stored = [directory.block(j) for j in range(directory.num_blocks)]
+
+    convert_blocks_directory(path)
+    with open_block_source(path) as container:
+        assert container.num_super_blocks == 3
+        assert [bytes(container.block(j)) for j in range(container.num_blocks)] == stored
+    assert decrypt(path, meta) == DATA
+
+def test_failed_encryption_leaves_no_container(encrypt, monkeypatch, tmp_path):
+    def write_super_block(self, block):
+        raise OSError("disque plein")
+    monkeypatch.setattr(BlockContainerWriter, "write_super_block", write_super_block)
+    with pytest.raises(OSError):
+        encrypt(DATA, block_size=1024, num_super_blocks=4)
+    # Aucun conteneur à l'en-tête valide (ni partiel) ne reste après l'échec
+    assert not os.path.exists(tmp_path / "knob" / CONTAINER_NAME)
+
+def test_meta_sk_is_super_blocks(encrypt):
+    path, meta = encrypt(DATA, block_size=1024, num_super_blocks=4)
+    with open_block_source(path) as source:
+        assert meta["metaSK"] == b"".join(bytes(source.super_block(j)) for j in range(source.num_super_blocks))
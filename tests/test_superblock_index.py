@@ -0,0 +1,41 @@
+import random
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from encryption_service import encrypt_superblock_index
+from knob_unwrap import get_super_blocks_indices
+from superblock_index import decode_index, decode_legacy_index, encode_index
+
+@pytest.mark.parametrize("num_blocks, indices", [(1, []), (1, [0]), (10, [0, 9]), (1000, [3, 500, 999]),
+                                                 (64, list(range(0, 64, 2))), (200000, [7, 123456])])
+def test_encode_decode(num_blocks, indices):
+    assert decode_index(encode_index(num_blocks, indices)) == (indices, num_blocks)
+
+def test_encode_unsorted():
+    indices = random.sample(range(5000), 40)
+    assert decode_index(encode_index(5000, indices)) == (sorted(indices), 5000)
+
+def test_decode_legacy_index():
+    assert decode_legacy_index(b"0100100001") == ([1, 4, 9], 10)
+    assert decode_index(b"0100100001") == ([1, 4, 9], 10)
+    # La lecture s'arrête au premier caractère qui n'est ni '0' ni '1' (padding)
+    assert decode_legacy_index(b"0110\x0c\x0c") == ([1, 2], 4)
+
+def test_legacy_meta_index():
+    sk = get_random_bytes(32)
+    legacy = "0" * 40 + "1" + "0" * 9
+    assert get_super_blocks_indices(encrypt_superblock_index(legacy, sk), sk) == ([40], 50)
+
+def test_legacy_meta_index_without_padding():
+    # Anciens index dont la longueur était un multiple de 16 : chiffrés sans padding
+    sk = get_random_bytes(32)
+    iv = get_random_bytes(16)
+    legacy = b"1" + b"0" * 30 + b"1"
+    meta_index = iv + AES.new(sk, AES.MODE_CBC, iv).encrypt(legacy)
+    assert get_super_blocks_indices(meta_index, sk) == ([0, 31], 32)
+
+def test_unknown_version():
+    data = bytearray(encode_index(10, [1]))
+    data[4] = 99
+    with pytest.raises(ValueError):
+        decode_index(bytes(data))
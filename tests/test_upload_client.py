@@ -0,0 +1,108 @@
+import asyncio
+import io
+import json
+import threading
+import pytest
+import requests
+from upload_client import UploadClient
+
+def response(status, payload=None):
+    result = requests.Response()
+    result.status_code = status
+    result._content = json.dumps(payload or {}).encode()
+    result.url = "http://api.test"
+    result.raw = io.BytesIO()
+    return result
+
+class FakeSession:
+    """Session requests simulée : chaque post consomme le corps, puis suit outcomes (statut ou exception)."""
+
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, data, headers, timeout):
+        streamed = not isinstance(data, (bytes, str))
+        body = b"".join(data)
+        with self.lock:
+            self.posts.append({"url": url, "headers": headers, "body": body, "streamed": streamed})
+            outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        # file_id déduit du corps : chaque fichier envoyé a le sien
+        return response(outcome, {"file_id": f"id-{len(body)}", "status": "ok"})
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def client():
+    with UploadClient("http://api.test/", "secret", retries=2, backoff=0) as client:
+        yield client
+
+def chunks(*parts):
+    return lambda: iter(parts)
+
+def test_upload_is_streamed_multipart(client):
+    client.session = FakeSession()
+    file_id = client.upload(chunks(b"abc", b"", b"def"))
+    post = client.session.posts[0]
+    assert file_id == f"id-{len(post['body'])}"
+    assert post["url"] == "http://api.test/upload"
+    assert post["streamed"]  # Générateur : envoyé en Transfer-Encoding: chunked
+    boundary = post["headers"]["Content-Type"].split("boundary=")[1]
+    assert post["body"].startswith(f"--{boundary}\r\n".encode())
+    assert post["body"].endswith(f"\r\n--{boundary}--\r\n".encode())
+    assert b'name="file"' in post["body"]
+    assert b"\r\n\r\nabcdef\r\n" in post["body"]
+
+@pytest.mark.parametrize("failure", [503, 429, requests.ConnectionError("coupure"), requests.Timeout("délai")])
+def test_upload_retries(client, failure):
+    client.session = FakeSession([failure, failure])
+    file_id = client.upload(chunks(b"data"))
+    posts = client.session.posts
+    assert len(posts) == 3
+    # Corps reproduit en entier à chaque tentative, avec une nouvelle frontière
+    assert len({post["headers"]["Content-Type"] for post in posts}) == 3
+    assert all(b"\r\n\r\ndata\r\n" in post["body"] for post in posts)
+    assert file_id == f"id-{len(posts[-1]['body'])}"
+
+def test_upload_gives_up_after_retries(client):
+    client.session = FakeSession([503, 503, 503])
+    with pytest.raises(requests.HTTPError):
+        client.upload(chunks(b"data"))
+    assert len(client.session.posts) == 3
+
+def test_connection_error_after_retries(client):
+    client.session = FakeSession([requests.ConnectionError("coupure")] * 3)
+    with pytest.raises(requests.ConnectionError):
+        client.upload(chunks(b"data"))
+
+def test_client_error_is_not_retried(client):
+    client.session = FakeSession([400])
+    with pytest.raises(requests.HTTPError):
+        client.upload(chunks(b"data"))
+    assert len(client.session.posts) == 1
+
+def test_upload_many(client):
+    client.session = FakeSession()
+    meta = {name: bytes(32) for name in ("metaFK", "metaSK", "metaIndex", "metaSGX")}
+    payloads = [b"x" * n for n in (10, 20, 30)]
+    jobs = [(chunks(payload), dict(meta, block_size=len(payload))) for payload in payloads]
+    results = asyncio.run(client.upload_many(jobs, concurrency=2))
+
+    uploads = {post["body"]: post for post in client.session.posts if post["url"].endswith("/upload")}
+    assert results == [f"id-{len(body)}" for body in sorted(uploads, key=len)]
+    records = [json.loads(post["body"].split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0])
+               for post in client.session.posts if post["url"].endswith("/store_metadata")]
+    assert sorted((record["file_id"], record["block_size"]) for record in records) == \
+        sorted(zip(results, (10, 20, 30)))
+
+def test_upload_many_reports_failures_in_order(client):
+    # Première requête (upload du premier fichier, concurrence 1) en échec définitif
+    client.session = FakeSession([400])
+    meta = {name: bytes(32) for name in ("metaFK", "metaSK", "metaIndex", "metaSGX")}
+    results = asyncio.run(client.upload_many([(chunks(b"a"), meta), (chunks(b"bb"), meta)], concurrency=1))
+    assert isinstance(results[0], requests.HTTPError)
+    assert isinstance(results[1], str)
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import sys
+import utils_group_keys
+from knob_keyring import default_keyring
+assert utils_group_keys.default_keyring is default_keyring
+first = utils_group_keys.load_key(sys.argv[1])
+assert utils_group_keys.load_key(sys.argv[1]) is first
+print(default_keyring.stats()["hits"])
+"""
+
+def test_keyring_from_repository_root(key_files):
+    # Nouveau processus lancé depuis la racine, sans le chemin de recherche de conftest
+    env = {name: value for name, value in os.environ.items() if name != "PYTHONPATH"}
+    result = subprocess.run([sys.executable, "-c", SCRIPT, key_files[1]], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert int(result.stdout) == 1
@@ -0,0 +1,34 @@
+import os
+import pytest
+import xor_metadata
+from xor_metadata import compute_xor_metadata, compute_xor_metadata_batched
+
+BLOCKS = [os.urandom(1024) for _ in range(37)]
+SUPER_BLOCKS = [os.urandom(1024) for _ in range(3)]
+KEY = os.urandom(32)
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("batch_size", [1, 5, xor_metadata.BATCH_SIZE])
+@pytest.mark.parametrize("additional", [None, SUPER_BLOCKS])
+def test_batched_matches_per_block(workers, batch_size, additional):
+    expected = compute_xor_metadata(BLOCKS, KEY, additional)
+    assert compute_xor_metadata_batched(BLOCKS, KEY, additional, workers, batch_size) == expected
+    # Un générateur (blocs lus en flux) donne le même résultat
+    assert compute_xor_metadata_batched(iter(BLOCKS), KEY, additional, workers, batch_size) == expected
+
+def test_batched_without_numpy(monkeypatch):
+    monkeypatch.setattr(xor_metadata, "np", None)
+    assert compute_xor_metadata_batched(BLOCKS, KEY, SUPER_BLOCKS, 4, 5) == compute_xor_metadata(BLOCKS, KEY,
+                                                                                                 SUPER_BLOCKS)
+
+def test_batched_short_key():
+    # Clé plus courte qu'un hash : XOR sur les premiers octets, comme xor_bytes
+    assert compute_xor_metadata_batched(BLOCKS, KEY[:16]) == compute_xor_metadata(BLOCKS, KEY[:16])
+
+def test_batched_recovers_file_key():
+    meta = compute_xor_metadata(BLOCKS, KEY, SUPER_BLOCKS)
+    assert compute_xor_metadata_batched(BLOCKS, meta, SUPER_BLOCKS) == KEY
+
+def test_batched_empty():
+    with pytest.raises(ValueError):
+        compute_xor_metadata_batched([], KEY)
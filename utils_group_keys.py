@@ -2,7 +2,11 @@ import os
 import sys
 from Crypto.Signature import PKCS1_PSS
 from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.PublicKey import RSA
+
+# Les modules KNOB sont à plat dans archive/ : ajouté au chemin de recherche
+# pour le trousseau, d'où que ce module soit importé ou lancé
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+from knob_keyring import default_keyring
 
 # --- Fonctions auxiliaires ---
 def load_file(file):
@@ -11,9 +15,8 @@ def load_file(file):
         return f.read()
 
 def load_key(file):
-    """ Charge une clé """
-    with open(file, "rb") as f:
-        return RSA.import_key(f.read())
+    """ Charge une clé (une seule fois par processus, trousseau) """
+    return default_keyring.rsa_key(file)
 
 # --- Fonctions ---
 def decrypt_group_keys(meta_task, admin_key, knob_pri_key):
@@ -22,9 +25,13 @@ def decrypt_group_keys(meta_task, admin_key, knob_pri_key):
     admin_key = load_file(admin_key)
     knob_pri_key = load_key(knob_pri_key)
     
-    cipher_rsa_PSS = PKCS1_PSS.new(admin_key)
-    cipher_rsa_OAEP = PKCS1_OAEP.new(knob_pri_key)
-    group_keys = cipher_rsa_OAEP.decrypt(cipher_rsa_PSS.verify(meta_task))
+    def unwrap():
+        cipher_rsa_PSS = PKCS1_PSS.new(admin_key)
+        cipher_rsa_OAEP = PKCS1_OAEP.new(knob_pri_key)
+        return cipher_rsa_OAEP.decrypt(cipher_rsa_PSS.verify(meta_task))
+
+    # Clés de groupe déjà déchiffrées pour ce meta_task : pas de nouveau RSA
+    group_keys = default_keyring.unwrap_group_keys(knob_pri_key, admin_key, meta_task, unwrap)
     
     return group_keys[:32], group_keys[32:]
 